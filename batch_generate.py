@@ -1,15 +1,64 @@
+"""
+Build OpenAI batch input files from cleansed_data/.
+
+Tables are read in chunks and every request is written as soon as it is built, so memory does
+not grow with the data. Output is split into shards (batch_shards/batched_000.jsonl, ...)
+that stay under the batch API's per-file request and byte limits. Each custom_id is
+"<file>:<row>", so results can be joined straight back onto row <row> (0-based position) of
+cleansed_data/<file>.
+
+Rows are skipped when they were already labeled: answered by the merchant cache (seeded
+without the labeled/ tables of the months in --data-dir) or, with --cascade-threshold, by a
+similar enough labeled row (knn_index.KNN_THRESHOLD) or by Naive Bayes (those go to
+batched_cache_hits.jsonl instead), or present with a successful response in a downloaded batch
+result under batch_results/.
+
+The rest are compacted before they are written:
+  - rows with the same key share one request: --group merchant (the default) keys on the
+    merchant name (merchant_cache.merchant_keys) and amount, --group exact on the cleaned
+    description and amount, --any-amount drops the amount from either. Only the first row of
+    a group is sent; every other row is written to batched_fanout.jsonl and gets its answer
+    when batch_pipeline.py joins the results.
+  - with --pack N, up to N such rows go into one multi-item prompt that asks for a JSON array
+    of labels. Its custom_id lists the rows' ids joined by "+", so a result can always be
+    split back onto rows; an answer that is not an array of the right length counts as not
+    answered, and those rows are requested again on the next run.
+With --few-shot K (3 by default), the prompt's fixed example is replaced by the K labeled rows
+most similar to the row (knn_index.py); a packed prompt takes its items' nearest rows in turn,
+still K in all. --few-shot 0 writes the old prompt exactly.
+Requests and prompt tokens (estimated at ~4 characters per token) are reported against one
+request per row, so the savings are known before anything is submitted.
+
+Usage:
+  python batch_generate.py
+  python batch_generate.py --pack 20 --group merchant --any-amount
+  python batch_generate.py --cascade-threshold 0.6 --max-requests 10000
+  python batch_generate.py --few-shot 0                       # one fixed example in every prompt
+"""
+
+import argparse
 import json
-from openai import OpenAI
-import pandas as pd
 from pathlib import Path
 
+import metrics
+from merchant_cache import MerchantLabelCache, merchant_keys
+from storage import ID_COL, clean_descriptions, iter_chunks, list_tables
 
 DATA_DIR = Path("cleansed_data")
-data_list = list(DATA_DIR.rglob("*.csv"))
+SHARD_DIR = Path("batch_shards")
+RESULTS_DIR = Path("batch_results")
+CACHE_HITS_PATH = Path("batched_cache_hits.jsonl")
+FANOUT_PATH = Path("batched_fanout.jsonl")
+PACK_SEP = "+"
+
+# OpenAI batch limits per input file
+MAX_REQUESTS_PER_SHARD = 50_000
+MAX_SHARD_BYTES = 200 * 1024 * 1024
 
 label_enums = {'1':'grocery','2':'dining','3':'travel','4':'shopping','5':'subscriptions','6':'utilities','7':'health','8':'entertainment','9':'other'}
 
 model = "gpt-5-nano-2025-08-07"
+system_prompt = "You are a an excellent data labeler. Your task is to label whatever string user sends."
 prompt = """
 Following text, with an amount of expense is from a bank statement document.
 You are tasked to label this text into following 9 categories:
@@ -24,12 +73,7 @@ You are tasked to label this text into following 9 categories:
     9.Other
 
 If you are absolutely uncertain on which one to put one label in, put to 9.
-You must always give a guess. Here is an example:
-
-    DESCRIPTION: HANGAR PUB WINGS AMHER10 UNIVERSITY DR AMHERST 01002 MA USA 1%
-    AMOUNT: 	50.44
-    Label: Dining
-
+You must always give a guess. {examples}
 Here is data to be labeled: 
 
     DESCRIPTION: {description}
@@ -38,34 +82,364 @@ Here is data to be labeled:
 
 ONLY RETURN THE LABEL, NOTHING ELSE
 """
+pack_prompt = """
+Following texts, each with an amount of expense, are from a bank statement document.
+You are tasked to label each text into following 9 categories:
+    1.Grocery
+    2.Dining
+    3.Travel
+    4.Shopping
+    5.Subscription
+    6.Utilites
+    7.Health
+    8.Entertainment
+    9.Other
+
+If you are absolutely uncertain on which one to put one label in, put to 9.
+You must always give a guess. {examples}
+Here are the {n} items to be labeled:
+{items}
+ONLY RETURN A JSON ARRAY OF {n} LABELS IN THE SAME ORDER, e.g. ["Dining", "Other"], NOTHING ELSE
+"""
+pack_item = """
+{i}. DESCRIPTION: {description}
+    AMOUNT : {amount}
+"""
+static_example = """Here is an example:
+
+    DESCRIPTION: HANGAR PUB WINGS AMHER10 UNIVERSITY DR AMHERST 01002 MA USA 1%
+    AMOUNT: 	50.44
+    Label: Dining
+"""
+example_item = """
+    DESCRIPTION: {description}
+    AMOUNT: 	{amount}
+    Label: {label}
+"""
+
+
+def make_custom_id(file_name, row):
+    return f"{file_name}:{row}"
+
+
+def parse_custom_id(custom_id):
+    """"april.csv:12" -> ("april.csv", 12)"""
+    file_name, _, row = custom_id.rpartition(":")
+    return file_name, int(row)
+
+
+def split_answer(custom_id, content):
+    """
+    [(row custom_id, raw answer)] for one response: the answer itself for a single-row request,
+    one entry per row for a packed one, or nothing when a packed answer does not parse.
+    """
+    ids = custom_id.split(PACK_SEP)
+    if len(ids) == 1:
+        return [(custom_id, content)]
+    # tolerate a code fence or a sentence around the array
+    start, end = content.find("["), content.rfind("]")
+    try:
+        labels = json.loads(content[start:end + 1]) if start >= 0 else None
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(labels, list) or len(labels) != len(ids):
+        return []
+    return [(i, str(label)) for i, label in zip(ids, labels)]
+
+
+def estimate_tokens(body):
+    """Rough prompt size: ~4 characters per token."""
+    return sum(len(m["content"]) for m in body["messages"]) // 4
+
+
+def format_examples(examples):
+    """The prompt's example block: the labeled (description, amount, label) rows, or the fixed one."""
+    if not examples:
+        return static_example
+    return "Here are similar transactions that are already labeled:\n" + "".join(
+        example_item.format(description=d, amount=a, label=label.capitalize()) for d, a, label in examples)
+
+
+def merge_examples(neighbours, k):
+    """Up to k distinct examples for a packed request, taking each item's nearest in turn."""
+    out, seen = [], set()
+    for rank in range(max(map(len, neighbours), default=0)):
+        for examples in neighbours:
+            if rank < len(examples) and examples[rank][0] not in seen:
+                seen.add(examples[rank][0])
+                out.append(examples[rank])
+                if len(out) == k:
+                    return out
+    return out
+
+
+def build_request(custom_id, description, amount, examples=None):
+    """One single-row request; examples (see format_examples) replace the fixed example."""
+    content = prompt.format(description=description, amount=amount, examples=format_examples(examples))
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content}],
+            "temperature": 0.0, "max_tokens": 10},
+    }
+
+
+def build_packed_request(items, examples=None):
+    """One request for several (custom_id, description, amount) rows, answered with a JSON array."""
+    text = "".join(pack_item.format(i=i, description=d, amount=a) for i, (_, d, a) in enumerate(items, 1))
+    content = pack_prompt.format(n=len(items), items=text, examples=format_examples(examples))
+    return {
+        "custom_id": PACK_SEP.join(custom_id for custom_id, _, _ in items),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content}],
+            "temperature": 0.0, "max_tokens": 10 * len(items)},
+    }
+
+
+def iter_answers(results_dir=RESULTS_DIR):
+    """(row custom_id, raw answer) for every row answered by a successful response in results_dir."""
+    for path in sorted(Path(results_dir).glob("*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                response = rec.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                content = response["body"]["choices"][0]["message"]["content"] or ""
+                yield from split_answer(rec["custom_id"], content)
+
+
+def load_done_ids(results_dir=RESULTS_DIR):
+    """Row custom_ids with an answer in any downloaded batch result file."""
+    return {custom_id for custom_id, _ in iter_answers(results_dir)}
+
+
+class Compactor:
+    """
+    Turns rows into requests: the first row of every key is sent, packed up to pack per request,
+    and later rows with the same key go to the fan-out file. Keeps one entry per distinct key.
+    With knn (a knn_index.KNNIndex), every prompt shows up to few_shot similar labeled rows.
+    """
+
+    def __init__(self, shards, fanout_out, pack=1, knn=None, few_shot=0):
+        self.shards = shards
+        self.fanout_out = fanout_out
+        self.pack = pack
+        self.knn = knn if few_shot else None
+        self.few_shot = few_shot
+        self.first = {}      # key -> custom_id of the row that answers it
+        self.pending = []
+        self.rows = self.fanout = 0
+        self.tokens = self.naive_tokens = 0
+
+    def seen(self, key, custom_id):
+        """Register a row answered elsewhere (an earlier batch) as the answer for its key."""
+        if key is not None:
+            self.first.setdefault(key, custom_id)
+
+    def add(self, key, custom_id, description, amount, txn_id=None):
+        self.rows += 1
+        examples = None
+        if self.knn is not None:
+            # labeled/ may hold this very row: it is never its own example
+            with metrics.timer("batch.few_shot"):
+                examples = self.knn.examples(description, self.few_shot, exclude=txn_id)
+        self.naive_tokens += estimate_tokens(build_request(custom_id, description, amount, examples)["body"])
+        if key is not None and key in self.first:
+            file_name, row = parse_custom_id(custom_id)
+            self.fanout_out.write(json.dumps({"custom_id": custom_id, "file": file_name, "row": row,
+                                              "answer_from": self.first[key]}, ensure_ascii=False) + "\n")
+            self.fanout += 1
+            return
+        self.seen(key, custom_id)
+        self.pending.append((custom_id, description, amount, examples))
+        if len(self.pending) >= self.pack:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if len(self.pending) == 1:
+            request = build_request(*self.pending[0])
+        else:
+            examples = None
+            if self.knn is not None:
+                examples = merge_examples([ex for *_, ex in self.pending], self.few_shot)
+            request = build_packed_request([item[:3] for item in self.pending], examples)
+        self.tokens += estimate_tokens(request["body"])
+        self.shards.write(request)
+        self.pending = []
+
+    def report(self):
+        requests = self.shards.total
+        saved = lambda new, old: f"{1 - new / old:.1%} fewer" if old else "-"
+        return (f"{self.rows} rows to label: {requests} requests instead of {self.rows} ({saved(requests, self.rows)}), "
+                f"~{self.tokens:,} prompt tokens instead of ~{self.naive_tokens:,} ({saved(self.tokens, self.naive_tokens)}); "
+                f"{self.fanout} rows share the answer of the row they are grouped with ({FANOUT_PATH})")
+
+
+def group_keys(descriptions, amounts, group, any_amount=False):
+    """The compaction key of every row; None (never grouped) for --group none or an empty name."""
+    if group == "none":
+        return [None] * len(descriptions)
+    names = merchant_keys(descriptions) if group == "merchant" else clean_descriptions(descriptions)
+    if any_amount:
+        return [name or None for name in names]
+    return [(name, amount) if name else None for name, amount in zip(names, amounts.round(2))]
+
+
+class ShardWriter:
+    """Writes JSONL lines to numbered shards, starting a new one before either limit is exceeded."""
+
+    def __init__(self, out_dir=SHARD_DIR, prefix="batched", max_requests=MAX_REQUESTS_PER_SHARD,
+                 max_bytes=MAX_SHARD_BYTES):
+        self.out_dir = Path(out_dir)
+        self.prefix = prefix
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.paths = []
+        self.total = 0
+        self._f = None
+        self._requests = 0
+        self._bytes = 0
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        # shards from an earlier run would be submitted again alongside the new ones
+        for old in self.out_dir.glob(f"{prefix}_*.jsonl"):
+            old.unlink()
+
+    def write(self, obj):
+        line = (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        if len(line) > self.max_bytes:
+            raise ValueError(f"request {obj.get('custom_id')} is larger than the {self.max_bytes} byte shard limit")
+        if self._f is None or self._requests >= self.max_requests or self._bytes + len(line) > self.max_bytes:
+            self._next_shard()
+        self._f.write(line)
+        self._requests += 1
+        self._bytes += len(line)
+        self.total += 1
+
+    def _next_shard(self):
+        self.close()
+        path = self.out_dir / f"{self.prefix}_{len(self.paths):03d}.jsonl"
+        self.paths.append(path)
+        self._f = open(path, "wb")
+        self._requests = 0
+        self._bytes = 0
 
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
 
-reqs = []
-id = 0
-for file in DATA_DIR.iterdir():
-    data = pd.read_csv(file)
-    for idx, row in data.iterrows():
-        payload = {
-                "custom_id":f"request-{id}",
-                "method":"POST",
-                "url":"/v1/chat/completions",
-                "body":{
-                    "model":model,
-                    "messages":[
-                        {"role":"system",
-                         "content":"You are a an excellent data labeler. Your task is to label whatever string user sends."},
-                        {"role":"user","content":prompt.format(description=row['description'],amount=row['amount'])}],
-                    "temperature":0.0,"max_tokens":10}
-                   }
-        print(payload['custom_id'])
-        id = id+1
-        reqs.append(payload)
 
+def main():
+    ap = argparse.ArgumentParser(description="Build sharded batch input files for the OpenAI batch API.")
+    ap.add_argument("--data-dir", default=DATA_DIR)
+    ap.add_argument("--out-dir", default=SHARD_DIR)
+    ap.add_argument("--results-dir", default=RESULTS_DIR, help="skip rows already answered in these batch results")
+    ap.add_argument("--chunksize", type=int, default=10_000, help="rows read at a time")
+    ap.add_argument("--max-requests", type=int, default=MAX_REQUESTS_PER_SHARD, help="requests per shard")
+    ap.add_argument("--max-bytes", type=int, default=MAX_SHARD_BYTES, help="bytes per shard")
+    ap.add_argument("--no-merchant-cache", action="store_true", help="send every row, even known merchants")
+    ap.add_argument("--cascade-threshold", type=float, default=None,
+                    help="let Naive Bayes label rows it is at least this confident about (see cascade.py)")
+    ap.add_argument("--group", choices=["merchant", "exact", "none"], default="merchant",
+                    help="send one request per merchant and amount, per cleaned description and amount, or per row")
+    ap.add_argument("--any-amount", action="store_true", help="group rows regardless of their amount")
+    ap.add_argument("--pack", type=int, default=1, help="rows per request, answered as a JSON array of labels")
+    ap.add_argument("--few-shot", type=int, default=3,
+                    help="prompt examples: the K most similar labeled rows (knn_index.py); 0: one fixed example")
+    args = ap.parse_args()
+    if args.pack < 1:
+        ap.error("--pack must be at least 1")
+    if args.few_shot < 0:
+        ap.error("--few-shot must be at least 0")
 
-with open("batched.jsonl","w",encoding="utf-8") as f_out:
-    for obj in reqs:
-                    f_out.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    # Rows whose merchant is already known, or that Naive Bayes is confident about, are answered
+    # locally and kept out of the batch; they go to batched_cache_hits.jsonl so they can be merged
+    # with the batch results.
+    # the gold labels of the months being labeled must not come back as model answers, so the
+    # merchant cache, the kNN index and the cascade's NB all leave those months out
+    months = {f.stem for f in list_tables(args.data_dir)}
+    merchants = None if args.no_merchant_cache else MerchantLabelCache(skip=months)
+    index = nb = None
+    if args.few_shot or args.cascade_threshold is not None:
+        from knn_index import load_or_build
+        index = load_or_build(skip=months)
+    if args.cascade_threshold is not None:
+        from knn_index import KNN_THRESHOLD
+        from nb_classify import load_labeled, nb_predict, train
+        labeled = load_labeled(skip=months).dropna(subset=["label"])
+        if labeled.empty:
+            print("[WARN] every labeled month is being labeled, so --cascade-threshold has nothing to learn from")
+        else:
+            nb = train(labeled)
+    done = load_done_ids(args.results_dir)
 
+    shards = ShardWriter(args.out_dir, max_requests=args.max_requests, max_bytes=args.max_bytes)
+    n_local = n_done = 0
+    with open(CACHE_HITS_PATH, "w", encoding="utf-8") as hits_out, open(FANOUT_PATH, "w", encoding="utf-8") as fanout_out:
+        compactor = Compactor(shards, fanout_out, args.pack, index, args.few_shot)
+        for file in list_tables(args.data_dir):
+            start = 0
+            for chunk in iter_chunks(file, columns=[ID_COL, "description", "amount"], chunksize=args.chunksize):
+                rows = range(start, start + len(chunk))
+                start += len(chunk)
+                ids = [make_custom_id(file.name, row) for row in rows]
+                keys = group_keys(chunk["description"], chunk["amount"], args.group, args.any_amount)
+                if nb is not None:
+                    with metrics.timer("batch.knn_transfer"):
+                        knn_labels, sims = index.predict(chunk["description"].tolist(), exclude=chunk[ID_COL])
+                    with metrics.timer("batch.nb_cascade"):
+                        nb_labels, nb_conf = nb_predict(nb, chunk["description"])
+                for i, (custom_id, row, txn_id, description, amount) in enumerate(
+                        zip(ids, rows, chunk[ID_COL], chunk["description"], chunk["amount"])):
+                    if custom_id in done:
+                        compactor.seen(keys[i], custom_id)
+                        n_done += 1
+                        continue
+                    hit = None
+                    if merchants is not None:
+                        label = merchants.get(description)
+                        if label is not None:
+                            hit = {"label": label, "source": "cache"}
+                    # a neighbour's label goes by similarity; --cascade-threshold is for NB's predict_proba only
+                    if hit is None and nb is not None and sims[i] >= KNN_THRESHOLD:
+                        hit = {"label": str(knn_labels[i]), "source": "knn"}
+                    if hit is None and nb is not None and nb_conf[i] >= args.cascade_threshold:
+                        hit = {"label": str(nb_labels[i]), "source": "nb"}
+                    if hit is not None:
+                        hits_out.write(json.dumps({"custom_id": custom_id, "file": file.name, "row": int(row), **hit},
+                                                  ensure_ascii=False) + "\n")
+                        n_local += 1
+                        continue
+                    compactor.add(keys[i], custom_id, description, amount, txn_id)
+        compactor.flush()
+    shards.close()
+    metrics.count("batch.requests", shards.total)
+    metrics.count("batch.fanout_rows", compactor.fanout)
+    metrics.count("batch.local_answers", n_local)
+    metrics.count("batch.already_done", n_done)
 
+    print(f"{shards.total} requests in {len(shards.paths)} shard(s) under {args.out_dir}/, "
+          f"{n_local} rows answered locally ({CACHE_HITS_PATH}), {n_done} already in {args.results_dir}/")
+    print(compactor.report())
+    if merchants is not None:
+        print(merchants.stats())
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Local stand-in for the parts of the OpenAI API that batch_pipeline.py and label_with_llm.py
+use, so both can be exercised without network access or an API key.
+
+  POST /v1/files                  multipart upload (purpose=batch)
+  GET  /v1/files/{id}/content     download an uploaded or generated file
+  POST /v1/batches                create a batch from an uploaded file
+  GET  /v1/batches/{id}           batch status; every poll moves it one step closer to done
+  POST /v1/chat/completions       real-time answer after --latency seconds (+-50%)
+
+Answers come from a keyword rule (or "Other"). When a batch completes, roughly --error-rate of
+its requests fail instead and land in the error file; real-time requests get a 429 with a
+Retry-After header at --rate-limit-rate.
+
+Usage:
+  python batch_mock_server.py --port 8700
+  OPENAI_BASE_URL=http://127.0.0.1:8700/v1 python batch_pipeline.py run
+or just `python batch_pipeline.py run --mock`, which starts one in-process.
+"""
+
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATUS_STEPS = ["validating", "in_progress", "finalizing", "completed"]
+KEYWORDS = [
+    (re.compile(r"GROCERY|MARKET|WHOLE ?FDS|TRADER JOE|STOP & SHOP|ALDI", re.I), "Grocery"),
+    (re.compile(r"CAFE|COFFEE|PIZZA|PUB|GRILL|RESTAURANT|DOORDASH|UBER ?EATS|SQ \*", re.I), "Dining"),
+    (re.compile(r"AIRLINE|DELTA|UNITED|JETBLUE|HOTEL|AIRBNB|UBER|LYFT|AMTRAK", re.I), "Travel"),
+    (re.compile(r"AMAZON|TARGET|WALMART|BEST ?BUY", re.I), "Shopping"),
+    (re.compile(r"NETFLIX|SPOTIFY|HULU|APPLE\.COM", re.I), "Subscription"),
+    (re.compile(r"ELECTRIC|EVERSOURCE|VERIZON|COMCAST|XFINITY|T-MOBILE|WATER", re.I), "Utilites"),
+    (re.compile(r"PHARMACY|CVS|WALGREENS|CLINIC|DENTAL", re.I), "Health"),
+    (re.compile(r"CINEMA|THEATER|TICKETMASTER|STEAM", re.I), "Entertainment"),
+]
+DESCRIPTION_RE = re.compile(r"DESCRIPTION: (.*)")
+
+
+def fake_answer(prompt):
+    # the DESCRIPTION: lines before "to be labeled" are the prompt's examples, the rest are the rows
+    _, _, tail = prompt.rpartition("to be labeled")
+    rows = DESCRIPTION_RE.findall(tail) or [prompt]
+    labels = [next((label for pattern, label in KEYWORDS if pattern.search(d)), "Other") for d in rows]
+    # a packed prompt (batch_generate.py --pack) asks for a JSON array
+    return json.dumps(labels) if "JSON ARRAY" in prompt else labels[-1]
+
+
+class MockBatchAPI:
+    def __init__(self, polls_per_step=1, error_rate=0.0, latency=0.0, rate_limit_rate=0.0, seed=0):
+        self.files = {}      # id -> (metadata, bytes)
+        self.batches = {}    # id -> metadata
+        self.polls = {}      # batch id -> retrieve count
+        self.polls_per_step = polls_per_step
+        self.error_rate = error_rate
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add_file(self, filename, purpose, data):
+        file_id = f"file-mock{next(self.ids)}"
+        meta = {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+        self.files[file_id] = (meta, data)
+        return meta
+
+    def create_batch(self, body):
+        if body.get("input_file_id") not in self.files:
+            return None
+        batch_id = f"batch_mock{next(self.ids)}"
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body.get("endpoint"),
+            "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+            "status": STATUS_STEPS[0], "created_at": int(time.time()), "output_file_id": None,
+            "error_file_id": None, "metadata": body.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self.polls[batch_id] = 0
+        return self.batches[batch_id]
+
+    def retrieve_batch(self, batch_id):
+        batch = self.batches.get(batch_id)
+        if batch is None or batch["status"] == "completed":
+            return batch
+        self.polls[batch_id] += 1
+        step = min(self.polls[batch_id] // self.polls_per_step, len(STATUS_STEPS) - 1)
+        batch["status"] = STATUS_STEPS[step]
+        if batch["status"] == "completed":
+            self._run(batch)
+        return batch
+
+    def chat(self, body):
+        """A chat.completion for one request, or None when this call should be rate limited."""
+        with self.lock:
+            limited = self.rng.random() < self.rate_limit_rate
+            delay = self.latency * self.rng.uniform(0.5, 1.5)
+            n = next(self.ids)
+        time.sleep(delay)
+        if limited:
+            return None
+        prompt = body["messages"][-1]["content"]
+        return {"id": f"chatcmpl-{n}", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"), "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 2,
+                                                      "total_tokens": len(prompt) // 4 + 2},
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": fake_answer(prompt)}}]}
+
+    def _run(self, batch):
+        out, err = [], []
+        for line in self.files[batch["input_file_id"]][1].decode("utf-8").splitlines():
+            req = json.loads(line)
+            n = next(self.ids)
+            if self.rng.random() < self.error_rate:
+                err.append({"id": f"batch_req_{n}", "custom_id": req["custom_id"], "response": None,
+                            "error": {"code": "server_error", "message": "mock failure"}})
+                continue
+            prompt = req["body"]["messages"][-1]["content"]
+            out.append({"id": f"batch_req_{n}", "custom_id": req["custom_id"], "error": None, "response": {
+                "status_code": 200, "request_id": f"req_{n}",
+                "body": {"id": f"chatcmpl-{n}", "object": "chat.completion", "model": req["body"].get("model"),
+                         "choices": [{"index": 0, "finish_reason": "stop",
+                                      "message": {"role": "assistant", "content": fake_answer(prompt)}}]},
+            }})
+        batch["request_counts"] = {"total": len(out) + len(err), "completed": len(out), "failed": len(err)}
+        to_bytes = lambda recs: "".join(json.dumps(r) + "\n" for r in recs).encode("utf-8")
+        batch["output_file_id"] = self.add_file(f"{batch['id']}_output.jsonl", "batch_output", to_bytes(out))["id"]
+        if err:
+            batch["error_file_id"] = self.add_file(f"{batch['id']}_error.jsonl", "batch_output", to_bytes(err))["id"]
+        batch["completed_at"] = int(time.time())
+
+
+class MockServer(ThreadingHTTPServer):
+    # the default backlog of 5 drops connections when many clients connect at once
+    request_queue_size = 128
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj=None, raw=None, headers=()):
+            body = raw if raw is not None else json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _not_found(self):
+            self._reply(404, {"error": {"message": f"no route {self.path}", "type": "invalid_request_error"}})
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            with api.lock:
+                if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" and parts[2] in api.files:
+                    return self._reply(200, raw=api.files[parts[2]][1])
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3:
+                    batch = api.retrieve_batch(parts[2])
+                    if batch is not None:
+                        return self._reply(200, batch)
+            self._not_found()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/v1/chat/completions":
+                completion = api.chat(json.loads(body))
+                if completion is None:
+                    return self._reply(429, {"error": {"message": "mock rate limit", "type": "requests"}},
+                                       headers=[("Retry-After", "0.05")])
+                return self._reply(200, completion)
+            with api.lock:
+                if self.path == "/v1/files":
+                    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                        b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body)
+                    fields = {p.get_param("name", header="content-disposition"): p for p in msg.iter_parts()}
+                    upload = fields["file"]
+                    return self._reply(200, api.add_file(upload.get_filename(), fields["purpose"].get_content().strip(),
+                                                         upload.get_payload(decode=True)))
+                if self.path == "/v1/batches":
+                    batch = api.create_batch(json.loads(body))
+                    if batch is None:
+                        return self._reply(400, {"error": {"message": "unknown input_file_id", "type": "invalid_request_error"}})
+                    return self._reply(200, batch)
+            self._not_found()
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def start(host="127.0.0.1", port=0, **api_kwargs):
+    """Start a mock server in a background thread; returns (server, base_url)."""
+    server = MockServer((host, port), make_handler(MockBatchAPI(**api_kwargs)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Mock OpenAI batch API for local runs.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8700)
+    ap.add_argument("--polls-per-step", type=int, default=1, help="retrieves before a batch moves to its next status")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of batch requests that fail")
+    ap.add_argument("--latency", type=float, default=0.05, help="mean seconds per chat completion")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of chat completions answered 429")
+    args = ap.parse_args()
+    api = MockBatchAPI(args.polls_per_step, args.error_rate, args.latency, args.rate_limit_rate)
+    server = MockServer((args.host, args.port), make_handler(api))
+    print(f"Mock OpenAI API on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
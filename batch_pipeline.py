@@ -0,0 +1,239 @@
+"""
+Submit, poll, download and join OpenAI batches for the shards written by batch_generate.py.
+
+  python batch_pipeline.py run            # upload every shard, wait, download, join
+  python batch_pipeline.py status         # what batch_state.json knows about each shard
+  python batch_pipeline.py join           # rebuild the labeled tables from batch_results/
+  python batch_pipeline.py run --mock     # same, against batch_mock_server.py in-process
+
+Shards are uploaded and polled concurrently with asyncio (AsyncOpenAI). Polling backs off
+exponentially with jitter. Finished output and error files are streamed to
+batch_results/<batch id>.jsonl, which is also where batch_generate.py looks for rows that no
+longer need a request.
+
+Every step is recorded in batch_state.json as soon as it happens, keyed by the shard's sha256,
+so after a crash `run` picks up where it stopped: uploaded files are not re-uploaded, running
+batches are polled again and finished downloads are skipped. A regenerated shard with
+different content counts as a new one, and the entry of a shard that was regenerated or deleted
+before it was uploaded is dropped.
+
+The join maps each custom_id ("<file>:<row>", or several joined by "+" for a packed request)
+back onto cleansed_data/<file>, adds the local answers from batched_cache_hits.jsonl, gives the
+rows in batched_fanout.jsonl the answer of the row they were grouped with, and writes
+llm_gen/openai/<prefix>_<month>.<format>, which compute_accuracy.py picks up like any other
+prediction set.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+from pathlib import Path
+
+from batch_generate import (CACHE_HITS_PATH, DATA_DIR, FANOUT_PATH, RESULTS_DIR, SHARD_DIR, iter_answers,
+                            parse_custom_id)
+from compute_accuracy import LABEL_ALIASES
+from llm_infra import parse_label
+from pdf_cache import file_digest
+from storage import DEFAULT_FORMAT, FORMATS, ID_COL, TableWriter, iter_chunks, list_tables
+
+STATE_PATH = Path("batch_state.json")
+OUT_DIR = Path("llm_gen/openai")
+TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchState:
+    """shard sha256 -> {shard, file_id, batch_id, status, ...}, rewritten atomically on every change."""
+
+    def __init__(self, path=STATE_PATH):
+        self.path = Path(path)
+        self.shards = json.loads(self.path.read_text(encoding="utf-8")) if self.path.is_file() else {}
+
+    def update(self, key, **fields):
+        self.shards.setdefault(key, {}).update(fields)
+        self._save()
+
+    def drop(self, key):
+        self.shards.pop(key, None)
+        self._save()
+
+    def _save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.shards, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+async def download(client, file_id, dest):
+    """Stream a file to dest via a .part file, so a partial download never looks finished."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part = dest.with_name(dest.name + ".part")
+    async with client.files.with_streaming_response.content(file_id) as resp:
+        with open(part, "wb") as f:
+            async for chunk in resp.iter_bytes():
+                f.write(chunk)
+    os.replace(part, dest)
+
+
+async def process_shard(client, key, state, sem, args):
+    entry = state.shards[key]
+    shard = Path(entry["shard"])
+    async with sem:
+        if "file_id" not in entry:
+            with open(shard, "rb") as f:
+                uploaded = await client.files.create(file=f, purpose="batch")
+            state.update(key, file_id=uploaded.id)
+            print(f"{shard.name}: uploaded as {uploaded.id}")
+        if "batch_id" not in entry:
+            batch = await client.batches.create(input_file_id=entry["file_id"], endpoint="/v1/chat/completions",
+                                                completion_window="24h", metadata={"shard": shard.name})
+            state.update(key, batch_id=batch.id, status=batch.status)
+            print(f"{shard.name}: batch {batch.id} created")
+
+    delay = args.poll_initial
+    while entry.get("status") not in TERMINAL:
+        batch = await client.batches.retrieve(entry["batch_id"])
+        if batch.status != entry.get("status"):
+            print(f"{shard.name}: {batch.status}")
+        counts = batch.request_counts.model_dump() if batch.request_counts else None
+        state.update(key, status=batch.status, output_file_id=batch.output_file_id,
+                     error_file_id=batch.error_file_id, request_counts=counts)
+        if batch.status in TERMINAL:
+            break
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, args.poll_max)
+
+    async with sem:
+        for field, suffix in (("output_file_id", ""), ("error_file_id", ".errors")):
+            done_field = field.replace("_file_id", "_downloaded")
+            if entry.get(field) and not entry.get(done_field):
+                await download(client, entry[field], Path(args.results_dir) / f"{entry['batch_id']}{suffix}.jsonl")
+                state.update(key, **{done_field: True})
+    return entry
+
+
+async def run_all(args, state):
+    from openai import AsyncOpenAI
+
+    shards = [Path(p) for p in args.shards] or sorted(Path(args.shard_dir).glob("batched_*.jsonl"))
+    # batch_generate.py rewrites the shards on every run: a shard never uploaded whose file is
+    # gone or holds other requests now is forgotten (its current content gets its own entry below)
+    for key, entry in list(state.shards.items()):
+        shard = Path(entry["shard"])
+        if "file_id" not in entry and (not shard.is_file() or file_digest(shard) != key):
+            print(f"{shard.name}: rewritten or deleted before it was uploaded, dropping its old entry")
+            state.drop(key)
+    for shard in shards:
+        key = file_digest(shard)
+        if key not in state.shards:
+            state.update(key, shard=str(shard))
+    pending = [k for k, e in state.shards.items()
+               if e.get("status") not in TERMINAL or (e.get("output_file_id") and not e.get("output_downloaded"))
+               or (e.get("error_file_id") and not e.get("error_downloaded"))]
+    print(f"{len(pending)} shard(s) to submit, poll or download, {len(state.shards) - len(pending)} already done")
+
+    client = AsyncOpenAI(api_key=args.api_key, base_url=args.base_url, max_retries=5)
+    sem = asyncio.Semaphore(args.concurrency)
+    try:
+        results = await asyncio.gather(*(process_shard(client, k, state, sem, args) for k in pending),
+                                       return_exceptions=True)
+    finally:
+        await client.close()
+    failed = [(state.shards[k]["shard"], r) for k, r in zip(pending, results) if isinstance(r, BaseException)]
+    for shard, exc in failed:
+        print(f"[WARN] {shard}: {exc!r}, run again to resume")
+    return not failed
+
+
+def iter_results(results_dir):
+    """(row custom_id, label) for every row answered in the downloaded batch output files."""
+    for custom_id, content in iter_answers(results_dir):
+        label = parse_label(content)
+        yield custom_id, LABEL_ALIASES.get(label, label)
+
+
+def join(data_dir=DATA_DIR, results_dir=RESULTS_DIR, out_dir=OUT_DIR, prefix="gpt5_nano", fmt=DEFAULT_FORMAT,
+         chunksize=50_000):
+    """Write <out_dir>/<prefix>_<month>.<fmt> for every cleansed table with label and label_source columns."""
+    answers = {}
+    for custom_id, label in iter_results(results_dir):
+        answers[parse_custom_id(custom_id)] = (label, "batch")
+    if Path(CACHE_HITS_PATH).is_file():
+        with open(CACHE_HITS_PATH, encoding="utf-8") as f:
+            for line in f:
+                hit = json.loads(line)
+                answers.setdefault((hit["file"], hit["row"]), (hit["label"], hit["source"]))
+    if Path(FANOUT_PATH).is_file():
+        with open(FANOUT_PATH, encoding="utf-8") as f:
+            for line in f:
+                rec = json.loads(line)
+                answer = answers.get(parse_custom_id(rec["answer_from"]))
+                if answer is not None:
+                    answers.setdefault((rec["file"], rec["row"]), (answer[0], "group"))
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    total = labeled = 0
+    for file in list_tables(data_dir):
+        writer, start = None, 0
+        for chunk in iter_chunks(file, chunksize=chunksize):
+            if writer is None:
+                writer = TableWriter(out_dir / f"{prefix}_{file.stem}.{fmt}",
+                                     [c for c in chunk.columns if c != ID_COL] + ["label", "label_source"])
+            # row positions are what batch_generate.py put in the custom_id
+            got = [answers.get((file.name, row), (None, None)) for row in range(start, start + len(chunk))]
+            chunk["label"] = [a[0] for a in got]
+            chunk["label_source"] = [a[1] for a in got]
+            writer.write(chunk)
+            start += len(chunk)
+            total += len(chunk)
+            labeled += sum(a[0] is not None for a in got)
+        if writer is not None:
+            writer.close()
+    print(f"joined {labeled}/{total} labeled rows into {out_dir}/{prefix}_*.{fmt}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent OpenAI batch submission, polling and result join.")
+    ap.add_argument("command", choices=["run", "status", "join"])
+    ap.add_argument("shards", nargs="*", help="shard files (default: every batched_*.jsonl in --shard-dir)")
+    ap.add_argument("--shard-dir", default=SHARD_DIR)
+    ap.add_argument("--results-dir", default=RESULTS_DIR)
+    ap.add_argument("--state", default=STATE_PATH)
+    ap.add_argument("--concurrency", type=int, default=8, help="uploads/downloads in flight at once")
+    ap.add_argument("--poll-initial", type=float, default=30.0, help="seconds before the first re-poll")
+    ap.add_argument("--poll-max", type=float, default=600.0, help="longest wait between polls")
+    ap.add_argument("--base-url", default=None, help="API base URL (default: OPENAI_BASE_URL or api.openai.com)")
+    ap.add_argument("--mock", action="store_true", help="run against an in-process batch_mock_server")
+    ap.add_argument("--prefix", default="gpt5_nano", help="output file prefix under llm_gen/openai/")
+    ap.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT, help="format of the joined tables")
+    args = ap.parse_args()
+
+    state = BatchState(args.state)
+    if args.command == "status":
+        for e in state.shards.values():
+            counts = e.get("request_counts") or {}
+            print(f"{e['shard']:40s} {e.get('batch_id', '-'):40s} {e.get('status', 'not submitted'):12s} "
+                  f"{counts.get('completed', 0)}/{counts.get('total', 0)} done, {counts.get('failed', 0)} failed")
+        return
+
+    if args.command == "run":
+        args.api_key = None
+        if args.mock:
+            import batch_mock_server
+
+            server, args.base_url = batch_mock_server.start()
+            args.api_key = "mock"
+            args.poll_initial = min(args.poll_initial, 0.05)
+        else:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+        ok = asyncio.run(run_all(args, state))
+        if not ok:
+            raise SystemExit(1)
+    join(results_dir=args.results_dir, prefix=args.prefix, fmt=args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Throughput benchmark for cleanse_data.py on a synthetic million-row statement table.
+
+Rows are resampled from the parsed descriptions in labeled/ and dressed up the way the parser
+emits them: a printed date in front, a random store number and the Daily Cash suffix behind.
+Reports, for the same table:
+  cleanse   - cleanse_data.run(): read Parquet, vectorized cleanse, write Parquet
+  rerun     - the same call again: hashes the unchanged input and skips it
+  row-wise  - the per-row equivalent (re.sub + merchant_key() in a Python loop), for reference
+
+Usage:
+  python bench_cleanse.py              # 1M rows
+  python bench_cleanse.py 200000
+"""
+
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import cleanse_data
+import storage
+from merchant_cache import merchant_key
+from nb_classify import load_labeled
+
+
+def build_table(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    descs = load_labeled()["description"].astype(str).str.strip().to_numpy()
+    dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 700, n_rows), unit="D")
+    desc = (pd.Series(dates.strftime("%m/%d/%Y ")) + descs[rng.integers(0, len(descs), n_rows)]
+            + pd.Series(rng.integers(0, 10**5, n_rows)).map(" #{:05d}".format)
+            + pd.Series(rng.choice(["", " 1%", " 2%", " 3%"], n_rows)))
+    return pd.DataFrame({"date": dates, "description": desc.to_numpy(), "amount": np.round(rng.lognormal(3, 1.2, n_rows), 2),
+                         "balance": np.nan, "type": "purchase", "source_file": "synthetic.pdf",
+                         "source_line": desc.to_numpy()})
+
+
+def rowwise(descriptions):
+    date_re, cash_re = re.compile(storage.DATE_IN_TEXT_RE), re.compile(storage.CASHBACK_RE)
+    out = []
+    for d in descriptions:
+        clean = " ".join(cash_re.sub("", date_re.sub(" ", d.upper())).split())
+        out.append((clean, merchant_key(clean)))
+    return out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    df = storage.normalize(build_table(n))
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir, out_dir = Path(tmp) / "data", Path(tmp) / "cleansed"
+        storage.write_table(df, storage.table_path(data_dir, "synthetic"))
+        print(f"{n} rows, {df['description'].nunique()} distinct descriptions")
+
+        for name in ("cleanse", "rerun"):
+            t0 = time.perf_counter()
+            cleansed, _, _ = cleanse_data.run(data_dir, out_dir)
+            seconds = time.perf_counter() - t0
+            print(f"{name:9s} {seconds:7.2f}s  {n / seconds:12,.0f} rows/s  ({cleansed} file(s) cleansed)")
+
+        out = storage.read_table(storage.table_path(out_dir, "synthetic"))
+        t0 = time.perf_counter()
+        reference = rowwise(df["description"])
+        seconds = time.perf_counter() - t0
+        print(f"{'row-wise':9s} {seconds:7.2f}s  {n / seconds:12,.0f} rows/s  (cleanse step only)")
+        assert [r[0] for r in reference] == out["description"].tolist()
+        assert [r[1] for r in reference] == out["merchant"].tolist()
+
+
+if __name__ == "__main__":
+    main()
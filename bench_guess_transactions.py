@@ -0,0 +1,164 @@
+"""
+Benchmark parse_pdf.guess_transactions() against the original multi-regex implementation
+on a synthetic statement, and check that both produce identical records.
+Both sides call parse_pdf.try_parse_date, so the difference measured is the line scanning.
+
+Usage:
+  python bench_guess_transactions.py            # 100k lines
+  python bench_guess_transactions.py 500000
+"""
+
+import random
+import re
+import sys
+import time
+import datetime
+
+from parse_pdf import guess_transactions, detect_year_hint, try_parse_date, normalize_money
+
+
+# --- Reference: guess_transactions() as it was before the single-pass rewrite ---
+
+_CURRENCY_RE = re.compile(r'(?<![\d,.-])(-?\$?\d{1,3}(?:,\d{3})*\.\d{2})(?![\d])')
+_DATE_CANDIDATE_RE = re.compile(
+    r'\b((?:\d{1,2}[-/]\d{1,2}(?:[-/]\d{2,4})?)|(?:\d{4}[-/]\d{1,2}[-/]\d{1,2}))\b'
+)
+_POSSIBLE_HEADER_HINTS = re.compile(
+    r'(previous\s+balance|new\s+balance|total\s+payment|statement\s+period|credit\s+limit)',
+    re.I
+)
+
+def _is_header_line(line):
+    if len(line.strip()) < 3:
+        return True
+    if _POSSIBLE_HEADER_HINTS.search(line):
+        return True
+    if re.search(r'page\s+\d+\s+of\s+\d+', line, re.I):
+        return True
+    return False
+
+def _clean_line(line):
+    return re.sub(r'\s+', ' ', line).strip()
+
+def legacy_guess_transactions(lines, year_hint=None):
+    txns = []
+    for raw_line in lines:
+        if not raw_line or _is_header_line(raw_line):
+            continue
+        monies = list(_CURRENCY_RE.finditer(raw_line))
+        if not monies:
+            continue
+        if re.search(r'\b(total|new balance|previous balance|payments?\s+and\s+credits)\b', raw_line, re.I):
+            continue
+        amount_m = monies[-1]
+        amount = normalize_money(amount_m.group(1))
+        if amount is None:
+            continue
+        balance = None
+        if len(monies) >= 2:
+            balance = normalize_money(monies[-2].group(1))
+        date = None
+        head = raw_line[:40]
+        date_m = _DATE_CANDIDATE_RE.search(head) or _DATE_CANDIDATE_RE.search(raw_line)
+        if date_m:
+            date = try_parse_date(date_m.group(1), year_hint=year_hint)
+        desc_segment = raw_line[:amount_m.start()].rstrip()
+        if balance is not None:
+            desc_segment = raw_line[:monies[-2].start()].rstrip()
+        description = _clean_line(desc_segment)
+        line_l = raw_line.lower()
+        if any(k in line_l for k in ['payment', 'autopay', 'thank you']):
+            tx_type = 'payment'
+            if amount > 0:
+                amount = -amount
+        elif any(k in line_l for k in ['fee', 'interest', 'late']):
+            tx_type = 'fee/interest'
+        elif any(k in line_l for k in ['credit', 'refund', 'reversal']) and amount > 0:
+            tx_type = 'credit'
+            amount = -abs(amount)
+        else:
+            tx_type = 'purchase'
+            amount = abs(amount)
+        txns.append({
+            "date": date,
+            "description": description or None,
+            "amount": round(amount, 2) if amount is not None else None,
+            "balance": round(balance, 2) if balance is not None else None,
+            "type": tx_type,
+            "source_line": _clean_line(raw_line),
+        })
+    return [
+        t for t in txns
+        if t["amount"] is not None and (t["date"] is not None or t["description"])
+    ]
+
+
+# --- Synthetic statement -----------------------------------------------------
+
+MERCHANTS = [
+    "SQ *SHARE 178 North Pleasant Amherst 01002 MA USA 2%",
+    "TEXAS ROADHOUSE #2507 280 RUSSELL STREET HADLEY 01035 MA USA 2%",
+    "UBER *EATS PENDING help.uber.com CA USA 1%",
+    "APPLE.COM/BILL ONE APPLE PARK WAY 866-712-7753 CUPERTINO 95014 CA USA 3%",
+    "ACH Deposit Internet transfer from account ending in 0729",
+    "Monthly Installments (12 of 12)",
+    "Late fee",
+    "Interest charged on purchases",
+    "Refund STOP & SHOP 0429 HADLEY MA",
+    "AUTOPAY PAYMENT - THANK YOU",
+]
+NOISE = [
+    "",
+    "  ",
+    "Page 2 of 6",
+    "Statement Period 03/01/2025 - 03/31/2025",
+    "Previous Balance $1,220.20",
+    "Total payments and credits -$541.64",
+    "Transactions",
+    "Date Description Daily Cash Amount",
+    "Apple Card Customer",
+]
+
+def synthetic_lines(n, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    start = datetime.date(2025, 1, 1)
+    for _ in range(n):
+        if rng.random() < 0.3:
+            lines.append(rng.choice(NOISE))
+            continue
+        day = start + datetime.timedelta(days=rng.randrange(365))
+        amount = rng.uniform(0.5, 2500)
+        cash = amount * 0.02
+        date_tok = day.strftime(rng.choice(["%m/%d/%Y", "%m/%d", "%Y-%m-%d"]))
+        sign = "-" if rng.random() < 0.1 else ""
+        lines.append(f"{date_tok} {rng.choice(MERCHANTS)} ${cash:,.2f} {sign}${amount:,.2f}")
+    return lines
+
+
+def bench(fn, lines, year_hint, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(lines, year_hint=year_hint)
+        best = min(best, time.perf_counter() - t0)
+    return out, best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lines = synthetic_lines(n)
+    year_hint = detect_year_hint("\n".join(lines))
+
+    ref, t_ref = bench(legacy_guess_transactions, lines, year_hint)
+    new, t_new = bench(guess_transactions, lines, year_hint)
+    assert new == ref, "guess_transactions output differs from the reference implementation"
+
+    print(f"{n} lines, {len(new)} transactions (outputs identical)")
+    print(f"  legacy : {n / t_ref:12,.0f} lines/sec  ({t_ref:.3f}s)")
+    print(f"  current: {n / t_new:12,.0f} lines/sec  ({t_new:.3f}s)")
+    print(f"  speedup: {t_ref / t_new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
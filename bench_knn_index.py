@@ -0,0 +1,124 @@
+"""
+Speed and accuracy of knn_index.py's nearest-neighbour index.
+
+  python bench_knn_index.py [--rows 100000] [--queries 1000]
+
+Speed, on labeled/ and on --rows synthetic rows (labeled descriptions with other store numbers,
+streets and cities, so chains repeat the way they do in real statements): build time, single
+query latency (p50/p99) and the cost of insert() between rebuilds.
+
+Accuracy is leave-one-month-out on labeled/: every month is predicted by an index of the other
+months, next to Naive Bayes (nb_classify) trained on the same rows. Per similarity threshold,
+"rows" is how many rows the kNN label would replace the NB one for and the two accuracies are on
+those rows; "unknown merchant" counts only rows whose merchant never appears in the other months,
+the ones the merchant cache cannot answer. KNN_THRESHOLD comes from this table.
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from knn_index import K, KNN_THRESHOLD, KNNIndex
+from merchant_cache import merchant_keys
+from nb_classify import train
+from storage import list_tables, read_table
+
+CITIES = ["NORTHAMPTON MA", "AMHERST MA", "BOSTON MA", "HADLEY MA", "SPRINGFIELD MA", "NEW YORK NY",
+          "BROOKLYN NY", "HARTFORD CT", "PROVIDENCE RI", "BURLINGTON VT", "PORTLAND ME", "ALBANY NY"]
+STREETS = ["MAIN ST", "KING ST", "PLEASANT ST", "RUSSELL ST", "BROADWAY", "UNIVERSITY DR", "ELM ST"]
+
+
+def synthetic(df, n, seed=0):
+    """n (description, label) rows: labeled merchant names at random store numbers and addresses."""
+    from knn_index import merchant_name
+
+    rng = random.Random(seed)
+    names = [(merchant_name(d), label) for d, label in zip(df["description"], df["label"])]
+    rows = []
+    for _ in range(n):
+        name, label = rng.choice(names)
+        rows.append((f"{name} #{rng.randint(1, 9999)} {rng.randint(1, 999)} {rng.choice(STREETS)} "
+                     f"{rng.choice(CITIES)} USA {rng.choice([1, 2, 3])}%", label))
+    return rows
+
+
+def percentile_ms(times, q):
+    return float(np.percentile(times, q)) * 1000
+
+
+def speed(name, descriptions, labels, queries):
+    t0 = time.perf_counter()
+    index = KNNIndex()
+    index.insert(descriptions, labels)
+    index._rebuild()
+    build_s = time.perf_counter() - t0
+    times = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.search(q)
+        times.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    for q in queries[:200]:
+        index.insert([q], ["other"])
+    insert_ms = (time.perf_counter() - t0) / min(len(queries), 200) * 1000
+    # queries with up to 200 pending rows scanned next to the inverted index
+    pending = []
+    for q in queries[:200]:
+        t0 = time.perf_counter()
+        index.search(q)
+        pending.append(time.perf_counter() - t0)
+    print(f"{name:10s} {len(descriptions):8d} {len(index.terms):7d} {build_s:8.2f} "
+          f"{percentile_ms(times, 50):8.3f} {percentile_ms(times, 99):8.3f} "
+          f"{percentile_ms(pending, 50):11.3f} {insert_ms:9.3f}")
+
+
+def leave_one_month_out(months, thresholds):
+    parts = []
+    for i, test in enumerate(months):
+        rest = pd.concat([m for j, m in enumerate(months) if j != i], ignore_index=True)
+        knn_labels, sims = KNNIndex.from_frame(rest).predict(test["description"].tolist(), K)
+        nb_labels = train(rest).predict(test["description"].astype(str))
+        known = merchant_keys(test["description"]).isin(set(merchant_keys(rest["description"])))
+        parts.append(pd.DataFrame({"knn": knn_labels, "sim": sims, "nb": nb_labels,
+                                   "gold": test["label"].to_numpy(), "known": known.to_numpy()}))
+    r = pd.concat(parts, ignore_index=True)
+    r["knn_ok"], r["nb_ok"] = r["knn"] == r["gold"], r["nb"] == r["gold"]
+    print(f"{len(r)} rows in {len(months)} months, all rows: kNN {r['knn_ok'].mean():.1%}, NB {r['nb_ok'].mean():.1%}")
+    print(f"\n{'similarity':>10s} {'rows':>6s} {'kNN':>7s} {'NB':>7s}   {'unknown merchant':>16s} {'kNN':>7s} {'NB':>7s}")
+    for t in thresholds:
+        s = r[r["sim"] >= t]
+        u = s[~s["known"]]
+        acc = lambda col, d: f"{d[col].mean():.1%}" if len(d) else "-"
+        mark = " <- KNN_THRESHOLD" if t == KNN_THRESHOLD else ""
+        print(f"{t:>10.2f} {len(s):6d} {acc('knn_ok', s):>7s} {acc('nb_ok', s):>7s}   {len(u):16d} "
+              f"{acc('knn_ok', u):>7s} {acc('nb_ok', u):>7s}{mark}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Speed and accuracy of the nearest-neighbour index.")
+    ap.add_argument("--labeled-dir", default="labeled")
+    ap.add_argument("--rows", type=int, default=100_000, help="synthetic rows for the scale test")
+    ap.add_argument("--queries", type=int, default=1000)
+    ap.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    args = ap.parse_args()
+
+    paths = sorted(list_tables(args.labeled_dir), key=lambda p: datetime.strptime(p.stem, "%B").month)
+    months = [read_table(p).dropna(subset=["label"]).reset_index(drop=True) for p in paths]
+    labeled = pd.concat(months, ignore_index=True)
+    queries = [d for d, _ in synthetic(labeled, args.queries, seed=1)]
+
+    print(f"{'index':10s} {'rows':>8s} {'n-grams':>7s} {'build s':>8s} {'p50 ms':>8s} {'p99 ms':>8s} "
+          f"{'pending p50':>11s} {'insert ms':>9s}")
+    speed("labeled", labeled["description"].tolist(), labeled["label"].tolist(), queries)
+    rows = synthetic(labeled, args.rows)
+    speed("synthetic", [d for d, _ in rows], [label for _, label in rows], queries)
+    print()
+    leave_one_month_out(months, args.thresholds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Throughput and latency of label_with_llm.py's real-time client against the local mock API.
+
+Writes a synthetic statement by resampling labeled/ (so some rows repeat, as recurring charges
+do), starts batch_mock_server in-process with --latency and --rate-limit-rate, and labels it at
+several worker-pool sizes. Reports rows/sec, API calls, retries, deduplicated rows and the p50
+and p99 latency of successful calls.
+
+Usage:
+  python bench_label_realtime.py [--rows 2000] [--latency 0.05] [--rate-limit-rate 0.02]
+"""
+
+import argparse
+import asyncio
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import batch_mock_server
+import label_with_llm
+from nb_classify import load_labeled
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--latency", type=float, default=0.05)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.02)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    args = ap.parse_args()
+
+    server, base_url = batch_mock_server.start(latency=args.latency, rate_limit_rate=args.rate_limit_rate)
+    src_rows = load_labeled()[["date", "description", "amount"]]
+    with tempfile.TemporaryDirectory() as tmp:
+        src = Path(tmp) / "statement.csv"
+        src_rows.sample(args.rows, replace=True, random_state=0).reset_index(drop=True).to_csv(src)
+        for concurrency in args.concurrency:
+            run_args = SimpleNamespace(api_key="mock", base_url=base_url, timeout=30.0, rpm=1e6, tpm=1e9,
+                                       max_retries=6, concurrency=concurrency, out_dir=Path(tmp) / f"c{concurrency}",
+                                       prefix="bench")
+            print(f"--- concurrency {concurrency}")
+            labeler, failed = asyncio.run(label_with_llm.run([src], run_args))
+            assert failed == 0
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Replay labeled/ through labeler.py's active-learning session, with the gold labels answering.
+
+Months are labeled in calendar order, each by a model trained on the months before it (the
+first month starts from nothing), for several --auto-accept thresholds. Reported per threshold:
+  asked      - questions the labeler put to the user (the old labeler asked every row)
+  keystrokes - answers that needed a key other than Enter (the model's guess was wrong or absent)
+  auto       - rows auto-accepted, and how many of them match the gold label
+
+Usage:
+  python bench_labeler.py
+  python bench_labeler.py --thresholds 0.99 0.9
+"""
+
+import argparse
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from checkpoint import LabelCheckpoint
+from labeler import OUT_DIR, label_file, train_model
+from storage import list_tables, read_table
+
+
+def replay(months, auto_accept):
+    stats = {"rows": 0, "asked": 0, "keystrokes": 0, "auto": 0, "auto_correct": 0}
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (path, gold) in enumerate(months):
+            model, temperature = train_model([p for p, _ in months[:i]])
+            data = gold.drop(columns=["label"])
+
+            def ask(row, guess, confidence):
+                stats["asked"] += 1
+                answer = gold["label"].iat[row.name]
+                stats["keystrokes"] += answer != guess
+                return answer
+
+            done = label_file(model, temperature, data, LabelCheckpoint(Path(tmp) / path.name), ask, auto_accept)
+            auto = [row for row, rec in done.items() if rec["source"] == "auto"]
+            stats["rows"] += len(data)
+            stats["auto"] += len(auto)
+            stats["auto_correct"] += sum(done[row]["label"] == gold["label"].iat[row] for row in auto)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay labeled/ through the active-learning labeler.")
+    ap.add_argument("--labeled-dir", default=OUT_DIR)
+    ap.add_argument("--thresholds", type=float, nargs="+", default=[0.99, 0.95, 0.9, 0.8])
+    args = ap.parse_args()
+
+    paths = sorted(list_tables(args.labeled_dir), key=lambda p: datetime.strptime(p.stem, "%B").month)
+    months = [(p, read_table(p).reset_index(drop=True)) for p in paths]
+    print(f"{sum(len(g) for _, g in months)} gold rows in {len(months)} months: {', '.join(p.stem for p in paths)}\n")
+    print(f"{'auto-accept':>11s} {'asked':>7s} {'keystrokes':>11s} {'auto':>6s} {'auto correct':>13s} {'seconds':>8s}")
+    for threshold in [None, *args.thresholds]:
+        t0 = time.perf_counter()
+        s = replay(months, threshold)
+        auto_acc = f"{s['auto_correct'] / s['auto']:.1%}" if s["auto"] else "-"
+        print(f"{threshold or 'off':>11} {s['asked']:7d} {s['keystrokes']:11d} {s['auto']:6d} "
+              f"{auto_acc:>13s} {time.perf_counter() - t0:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Parse throughput of parse_pdf.py's bank layouts against the generic line parser.
+
+For the statement PDFs in a folder (data/ by default), reports the cost of layout detection
+(text of the first page only, next to the text of the whole document it replaces), then, per
+parser, the pages, rows and wall time over --repeat runs (best run kept): the generic parser
+on every statement, each registered layout on the statements it claims. Both include
+pdfplumber's text extraction of every page, which the cache stores whichever parser runs.
+
+Usage:
+  python bench_layouts.py
+  python bench_layouts.py path/to/statements/ --repeat 5
+"""
+
+import argparse
+import time
+
+import parse_pdf
+
+
+def best_of(repeat, fn):
+    """(fastest wall time, result) of repeat calls of fn."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        seconds = time.perf_counter() - t0
+        best = seconds if best is None else min(best, seconds)
+    return best, out
+
+
+def parse_with(layout, pdf_path):
+    """
+    Rows of pdf_path from the generic parser when layout is None, else from parse_pdf(), which
+    detects the layout on the first page and parses every page with it in the same pass.
+    """
+    if layout is None:
+        return parse_pdf.parse_lines(parse_pdf.extract_text_lines(pdf_path), pdf_path)
+    return parse_pdf.parse_pdf(pdf_path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Parse throughput of each bank layout vs the generic parser.")
+    ap.add_argument("inp", nargs="?", default="data", help="a PDF file or a folder of PDFs")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pdfs = list(parse_pdf.iter_pdf_files(args.inp))
+    pages = {p: parse_pdf.count_pages(p) for p in pdfs}
+    detected, detect_s, text_s = {}, 0.0, 0.0
+    for p in pdfs:
+        seconds, layout = best_of(args.repeat, lambda: parse_pdf.detect_layout(next(parse_pdf.iter_page_lines(p, (0, 1)))))
+        detected[p], detect_s = layout, detect_s + seconds
+        text_s += best_of(args.repeat, lambda: parse_pdf.extract_text_lines(p))[0]
+    print(f"{len(pdfs)} statements, {sum(pages.values())} pages in {args.inp}")
+    print(f"detection: {detect_s / len(pdfs) * 1000:.1f} ms per statement (first page), "
+          f"whole-document text would be {text_s / len(pdfs) * 1000:.1f} ms\n")
+
+    print(f"{'parser':12s} {'files':>5s} {'pages':>6s} {'rows':>6s} {'seconds':>8s} {'pages/s':>8s} {'rows/s':>8s}")
+    for name, layout in [("generic", None), *parse_pdf.LAYOUTS.items()]:
+        files = pdfs if layout is None else [p for p in pdfs if detected[p] is layout]
+        if not files:
+            print(f"{name:12s} {0:5d}  no matching statements")
+            continue
+        seconds, rows = 0.0, 0
+        for p in files:
+            s, out = best_of(args.repeat, lambda: parse_with(layout, p))
+            seconds, rows = seconds + s, rows + len(out)
+        n_pages = sum(pages[p] for p in files)
+        print(f"{name:12s} {len(files):5d} {n_pages:6d} {rows:6d} {seconds:8.2f} "
+              f"{n_pages / seconds:8.1f} {rows / seconds:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Overhead of metrics.py instrumentation, off and on.
+
+Times a million calls of each primitive against the bare equivalent, then the instrumented
+parser (guess_transactions over synthetic statement lines) with metrics off and on. Each
+setting runs in a fresh process, since metrics turn on at import.
+
+Usage:
+  python bench_metrics.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+N = 1_000_000
+
+
+def child():
+    import metrics
+    from parse_pdf import guess_transactions
+
+    def bare():
+        return None
+
+    @metrics.timed("bench.fn")
+    def wrapped():
+        return None
+
+    out = {}
+    t0 = time.perf_counter()
+    for _ in range(N):
+        bare()
+    out["bare call"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(N):
+        wrapped()
+    out["@timed call"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(N):
+        with metrics.timer("bench.block"):
+            pass
+    out["with timer()"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(N):
+        metrics.count("bench.count")
+    out["count()"] = time.perf_counter() - t0
+
+    lines = [f"{m:02d}/{d:02d} MERCHANT {i} 100 MAIN ST AMHERST MA USA 2% $1{i % 1000}.{i % 100:02d}"
+             for i, (m, d) in enumerate(((i % 12) + 1, (i % 28) + 1) for i in range(20_000))]
+    t0 = time.perf_counter()
+    for _ in range(10):
+        guess_transactions(lines)
+    out["guess_transactions x10 (200k lines)"] = time.perf_counter() - t0
+    print(json.dumps(out))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child()
+    results = {}
+    report = os.path.join(tempfile.mkdtemp(), "bench_metrics.json")
+    for label, env in (("off", {}), ("on", {"BANK_METRICS": report})):
+        env = {k: v for k, v in os.environ.items() if k not in ("BANK_METRICS", "BANK_PROFILE")} | env
+        out = subprocess.run([sys.executable, __file__, "--child"], env=env, capture_output=True, text=True,
+                             check=True).stdout
+        results[label] = json.loads(out.strip().splitlines()[-1])
+    with open(report, encoding="utf-8") as f:
+        counters = json.load(f)["counters"]
+    os.remove(report)
+    print(f"{'':38s} {'metrics off':>12s} {'metrics on':>12s}")
+    for name in results["off"]:
+        off, on = results["off"][name], results["on"][name]
+        unit = (1e9 / N, "ns/call") if "x10" not in name else (1.0, "s")
+        print(f"{name:38s} {off * unit[0]:10.1f}{unit[1][:2]:>2s} {on * unit[0]:10.1f}{unit[1][:2]:>2s}")
+    print(f"report counters with metrics on: {counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Cold-start time and per-row latency of nb_predict.py against retraining with nb_classify.
+
+  python bench_nb_predict.py [--rows 100000] [--runs 5]
+
+Cold start is a fresh interpreter classifying one stdin line. Per-row latency is measured on
+single-row calls, throughput on one bulk call over synthetic descriptions, and HTTP latency on
+single-row POSTs to the --serve endpoint. Predictions are checked against scikit-learn first.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+
+from nb_classify import load_labeled, save_model, train
+from nb_predict import NBModel
+
+RETRAIN_SNIPPET = (
+    "from nb_classify import load_labeled, nb_predict, train; "
+    "print(nb_predict(train(load_labeled()), ['SQ *JET RAG 825 North La Brea'])[0][0])"
+)
+
+
+def cold_start(cmd, runs, stdin=None):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, input=stdin, capture_output=True, text=True, check=True)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def synthetic_descriptions(base, n, seed=0):
+    rng = random.Random(seed)
+    words = " ".join(base).split()
+    return [" ".join(rng.choices(words, k=rng.randint(3, 12))) for _ in range(n)]
+
+
+def percentiles(samples):
+    a = np.array(samples) * 1e6
+    return f"p50 {np.percentile(a, 50):7.1f}us  p99 {np.percentile(a, 99):7.1f}us"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--port", type=int, default=8799)
+    args = ap.parse_args()
+
+    df = load_labeled()
+    sk_model = train(df)
+    tmp = Path(tempfile.mkdtemp())
+    artifact = save_model(sk_model, tmp / "nb.npz", trained_on=df)
+    model = NBModel(artifact)
+
+    texts = synthetic_descriptions(df["description"].astype(str), args.rows)
+    check = texts[:5000] + df["description"].astype(str).tolist()
+    diff = np.abs(sk_model.predict_proba(check) - model.predict_proba(check)).max()
+    assert diff < 1e-9, f"nb_predict disagrees with scikit-learn by {diff}"
+    print(f"artifact {artifact.stat().st_size / 1024:.0f} KiB, max |p - p_sklearn| = {diff:.1e}")
+
+    line = "SQ *JET RAG 825 North La Brea LOS ANGELES\n"
+    t_predict = cold_start([sys.executable, "nb_predict.py", "--model", str(artifact)], args.runs, line)
+    t_retrain = cold_start([sys.executable, "-c", RETRAIN_SNIPPET], args.runs)
+    print(f"cold start, one row:  nb_predict {t_predict * 1e3:7.0f} ms   retrain with nb_classify {t_retrain * 1e3:7.0f} ms")
+
+    single = []
+    for text in texts[:2000]:
+        t0 = time.perf_counter()
+        model.predict([text])
+        single.append(time.perf_counter() - t0)
+    sk_single = []
+    for text in texts[:2000]:
+        t0 = time.perf_counter()
+        sk_model.predict_proba([text])
+        sk_single.append(time.perf_counter() - t0)
+    print(f"single-row call:      nb_predict {percentiles(single)}   sklearn {percentiles(sk_single)}")
+
+    t0 = time.perf_counter()
+    model.predict(texts)
+    t_np = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    sk_model.predict_proba(texts)
+    t_sk = time.perf_counter() - t0
+    print(f"bulk {len(texts)} rows:    nb_predict {len(texts) / t_np:9.0f} rows/s   sklearn {len(texts) / t_sk:9.0f} rows/s")
+
+    server = subprocess.Popen([sys.executable, "nb_predict.py", "--model", str(artifact), "--serve", "--port", str(args.port)],
+                              stderr=subprocess.PIPE, text=True)
+    try:
+        server.stderr.readline()  # "Serving ..." once the socket is bound
+        url = f"http://127.0.0.1:{args.port}/predict"
+        http = []
+        for text in texts[:500]:
+            req = urllib.request.Request(url, data=json.dumps({"descriptions": [text]}).encode(),
+                                         headers={"Content-Type": "application/json"})
+            t0 = time.perf_counter()
+            with urllib.request.urlopen(req) as resp:
+                json.load(resp)
+            http.append(time.perf_counter() - t0)
+        print(f"HTTP single-row POST: {percentiles(http)}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Peak-memory benchmark for nb_classify's train-stream mode against the in-memory trainer.
+
+Writes synthetic labeled CSVs by resampling labeled/ with fresh store numbers and merchant
+suffixes (so the TF-IDF vocabulary keeps growing, as it would with years of new merchants),
+then trains in a fresh process per mode and size and reports peak RSS:
+  tfidf  - nb_classify.train(): pd.concat of everything + trigram TfidfVectorizer
+  stream - nb_classify.train_streaming(): chunked HashingVectorizer + partial_fit
+
+Usage:
+  python bench_nb_stream.py                    # 100k and 400k rows
+  python bench_nb_stream.py 100000 1000000
+"""
+
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import nb_classify
+
+
+def build_csv(n_rows, out_path, seed=0):
+    rng = random.Random(seed)
+    df = nb_classify.load_labeled()
+    pairs = list(zip(df["description"].astype(str), df["label"].astype(str)))
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write("description,label\n")
+        for _ in range(n_rows):
+            desc, label = rng.choice(pairs)
+            words = desc.replace(",", " ").split()
+            words.insert(rng.randint(1, len(words)), f"X{rng.randrange(10**6):06d}")
+            f.write(f"{' '.join(words)} #{rng.randrange(10**5)},{label}\n")
+
+
+def child(mode, csv_path, estimator):
+    t0 = time.perf_counter()
+    if mode == "tfidf":
+        model = nb_classify.train(nb_classify.load_labeled(Path(csv_path).parent))
+    else:
+        model = nb_classify.train_streaming([csv_path], estimator, chunksize=20_000)
+    print(json.dumps({
+        "labels": len(model.classes_),
+        "seconds": time.perf_counter() - t0,
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(*sys.argv[2:5])
+    sizes = [int(a) for a in sys.argv[1:]] or [100_000, 400_000]
+    print(f"{'rows':>9s} {'mode':>12s} {'seconds':>8s} {'peak RSS':>9s}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = Path(tmp) / "labeled.csv"
+            build_csv(n, csv_path)
+            for mode, estimator in [("tfidf", "-"), ("stream", "nb"), ("stream", "sgd")]:
+                out = subprocess.run([sys.executable, __file__, "--child", mode, str(csv_path), estimator],
+                                     capture_output=True, text=True, check=True).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                name = mode if estimator == "-" else f"{mode}/{estimator}"
+                print(f"{n:9d} {name:>12s} {r['seconds']:8.1f} {r['peak_mb']:7.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Startup time of the bank-classifier CLI (main.py), per subcommand.
+
+Every case runs in fresh processes; the median wall time over --runs is reported next to a
+bare `python -c pass`, together with what the command imported (from one `python -X importtime`
+run): its slowest top-level imports and which heavy dependencies were loaded at all. The
+top-level --help and predict's (which scores with NumPy only) are expected under 100 ms.
+
+Usage:
+  python bench_startup.py
+  python bench_startup.py --runs 20
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+HEAVY = ["pandas", "pyarrow", "sklearn", "pdfplumber", "torch", "transformers", "matplotlib", "openai", "vllm"]
+TARGET_MS = 100
+# (name, argv after main.py, stdin, expected under TARGET_MS)
+CASES = [
+    ("--help", ["--help"], None, True),
+    ("predict --help", ["predict", "--help"], None, True),
+    ("predict (3 rows)", ["predict"], "STARBUCKS STORE 123\nSHELL OIL 5742\nNETFLIX.COM\n", False),
+    ("cleanse --help", ["cleanse", "--help"], None, False),
+    ("evaluate --help", ["evaluate", "--help"], None, False),
+    ("label --help", ["label", "--help"], None, False),
+    ("parse --help", ["parse", "--help"], None, False),
+    ("train --help", ["train", "--help"], None, False),
+]
+
+
+def run(cmd, stdin=None):
+    env = {k: v for k, v in os.environ.items() if k not in ("BANK_METRICS", "BANK_PROFILE")}
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, input=stdin, capture_output=True, text=True, cwd=HERE, env=env)
+    return time.perf_counter() - t0, proc
+
+
+def imports(argv, stdin):
+    """
+    (package -> cumulative import microseconds of its outermost imports, every package loaded)
+    for one run of main.py argv.
+    """
+    _, proc = run([sys.executable, "-X", "importtime", "main.py", *argv], stdin)
+    cumulative, loaded = {}, set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        name = name[1:].rstrip()  # nested imports are indented further
+        package = name.strip().split(".")[0]
+        loaded.add(package)
+        if not name.startswith(" "):
+            cumulative[package] = cumulative.get(package, 0) + int(cum)
+    return cumulative, loaded
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Startup time of the bank-classifier CLI.")
+    ap.add_argument("--runs", type=int, default=10)
+    args = ap.parse_args()
+
+    base = statistics.median(run([sys.executable, "-c", "pass"])[0] for _ in range(args.runs))
+    print(f"{'python -c pass':20s} {base * 1000:7.1f} ms")
+    has_model = (HERE / "models" / "nb_classify.npz").is_file()
+    for name, argv, stdin, fast in CASES:
+        if argv[0] == "predict" and stdin is not None and not has_model:
+            print(f"{name:20s} skipped, run `bank-classifier train` first")
+            continue
+        times = []
+        for _ in range(args.runs):
+            seconds, proc = run([sys.executable, "main.py", *argv], stdin)
+            if proc.returncode != 0:
+                raise SystemExit(f"{name} failed:\n{proc.stderr}")
+            times.append(seconds)
+        ms = statistics.median(times) * 1000
+        cumulative, loaded = imports(argv, stdin)
+        heavy = [m for m in HEAVY if m in loaded] or ["-"]
+        slowest = ", ".join(f"{m} {us / 1000:.0f}" for m, us in sorted(cumulative.items(), key=lambda kv: -kv[1])[:3])
+        verdict = ("ok" if ms < TARGET_MS else "SLOW") if fast else ""
+        print(f"{name:20s} {ms:7.1f} ms {verdict:4s}  heavy: {' '.join(heavy):32s} slowest imports (ms): {slowest}")
+
+
+if __name__ == "__main__":
+    main()
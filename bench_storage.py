@@ -0,0 +1,86 @@
+"""
+Load-time and size benchmark for the table formats in storage.py.
+
+Builds a synthetic transaction table by resampling labeled/ (txn_id, date, description,
+amount, label), writes it as CSV, Parquet and Arrow, then reads it back in a fresh process
+per format, once in full and once projected to (txn_id, description) the way the NB trainer
+and the merchant cache read it. Reports file size, read time and peak RSS of the full read.
+
+Usage:
+  python bench_storage.py                  # 1M rows
+  python bench_storage.py 100000 2000000
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import storage
+from nb_classify import load_labeled
+
+PROJECTION = [storage.ID_COL, "description"]
+
+
+def build_table(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = load_labeled()
+    pick = rng.integers(0, len(df), n_rows)
+    return storage.normalize(pd.DataFrame({
+        "date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 2000, n_rows), unit="D"),
+        "description": df["description"].astype(str).to_numpy()[pick],
+        "amount": np.round(rng.lognormal(3, 1.2, n_rows), 2),
+        "label": df["label"].astype(str).to_numpy()[pick],
+    }))
+
+
+def build(n_rows, directory):
+    df = build_table(int(n_rows))
+    seconds = {}
+    for fmt in storage.FORMATS:
+        t0 = time.perf_counter()
+        storage.write_table(df, storage.table_path(directory, "bench", fmt))
+        seconds[fmt] = time.perf_counter() - t0
+    print(json.dumps(seconds))
+
+
+def read(path, projected):
+    t0 = time.perf_counter()
+    df = storage.read_table(path, columns=PROJECTION if projected == "1" else None)
+    print(json.dumps({
+        "rows": len(df),
+        "seconds": time.perf_counter() - t0,
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def child(*args):
+    out = subprocess.run([sys.executable, __file__, *map(str, args)], capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ("--build", "--read"):
+        return (build if sys.argv[1] == "--build" else read)(*sys.argv[2:4])
+    sizes = [int(a) for a in sys.argv[1:]] or [1_000_000]
+    print(f"{'rows':>9s} {'format':>8s} {'size':>8s} {'write':>7s} {'read all':>9s} {'read 2 cols':>12s} {'peak RSS':>9s}")
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            # every step in its own process, so peak RSS is the reader's alone
+            write_s = child("--build", n, tmp)
+            for fmt in storage.FORMATS:
+                path = storage.table_path(tmp, "bench", fmt)
+                full, projected = child("--read", path, "0"), child("--read", path, "1")
+                size_mb = Path(path).stat().st_size / 2**20
+                print(f"{n:9d} {fmt:>8s} {size_mb:6.1f}MB {write_s[fmt]:6.2f}s {full['seconds']:8.2f}s "
+                      f"{projected['seconds']:11.2f}s {full['peak_mb']:7.0f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Peak-memory benchmark for parse_pdf's --stream mode on a very large statement.
+
+Builds a long PDF by repeating the pages of the statements in data/ (pypdfium2 ships with
+pdfplumber), then parses it in a fresh process per mode and reports peak RSS:
+  legacy - every line of every page in one list, joined into all_text, as parse_pdf() used to
+  stream - parse_pdf.iter_pdf_transactions(), page by page
+
+Usage:
+  python bench_streaming.py              # 300 pages
+  python bench_streaming.py 1000
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pypdfium2
+
+import parse_pdf
+
+DATA_DIR = Path("data")
+
+
+def build_big_pdf(n_pages, out_path):
+    sources = [pypdfium2.PdfDocument(p) for p in sorted(DATA_DIR.glob("*.pdf"))]
+    big = pypdfium2.PdfDocument.new()
+    i = 0
+    while len(big) < n_pages:
+        src = sources[i % len(sources)]
+        big.import_pages(src, list(range(min(len(src), n_pages - len(big)))))
+        i += 1
+    big.save(out_path)
+
+
+def legacy_parse(pdf_path):
+    lines = []
+    with parse_pdf.pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            text = page.extract_text() or ""
+            lines.extend(text.splitlines())
+    all_text = "\n".join(lines)
+    year_hint = parse_pdf.detect_year_hint(all_text)
+    return parse_pdf.guess_transactions(lines, year_hint=year_hint)
+
+
+def child(mode, pdf_path):
+    t0 = time.perf_counter()
+    if mode == "legacy":
+        n_rows = len(legacy_parse(pdf_path))
+    else:
+        n_rows = sum(1 for _ in parse_pdf.iter_pdf_transactions(pdf_path))
+    print(json.dumps({
+        "rows": n_rows,
+        "seconds": time.perf_counter() - t0,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+        return
+
+    n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = str(Path(tmp) / "big.pdf")
+        build_big_pdf(n_pages, pdf_path)
+        print(f"{n_pages}-page statement")
+        for mode in ("legacy", "stream"):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", mode, pdf_path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            r = json.loads(out)
+            print(f"  {mode:7s}: peak RSS {r['peak_rss_mb']:8.1f} MB  "
+                  f"{r['seconds']:6.1f}s  {r['rows']} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Cascade labeling: the Naive Bayes model from nb_classify.py labels every row first, and only
+rows whose top predict_proba is below a threshold go on to the LLM. Use
+`llm_infra.py --cascade-threshold T` or `batch_generate.py --cascade-threshold T` to label that way.
+Those also hand rows with a labeled neighbour at least knn_index.KNN_THRESHOLD similar their
+neighbour's label first (label_source "knn", see bench_knn_index.py for its accuracy); T is only
+ever compared with Naive Bayes' predict_proba, which is what the curve below models.
+
+This script picks T. It replays the cascade on the gold data in labeled/, using out-of-fold NB
+probabilities and the LLM answers already saved in llm_gen/, and prints accuracy against the
+fraction of rows that would need an LLM call for every threshold.
+
+Usage:
+  python cascade.py                                   # gemma_4b answers from llm_gen/gemma
+  python cascade.py --llm-prefix gemma_1b --target-accuracy 0.85
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
+
+from compute_accuracy import LABEL_ALIASES
+from llm_infra import parse_label
+from nb_classify import DATA_DIR, make_model
+from storage import ID_COL, find_table, list_tables, read_table
+
+
+def load_gold_with_llm(pred_dir, prefix):
+    """Gold rows from labeled/ with the saved LLM answer for each (NaN where there is none)."""
+    frames = []
+    for gold_path in list_tables(DATA_DIR):
+        gold = read_table(gold_path)
+        pred_path = find_table(pred_dir, f"{prefix}_{gold_path.stem}")
+        if pred_path is not None:
+            pred = read_table(pred_path, columns=[ID_COL, "label"]).rename(columns={"label": "llm_label"})
+            pred["llm_label"] = pred["llm_label"].astype(str).map(parse_label).replace(LABEL_ALIASES)
+            gold = gold.merge(pred, on=ID_COL, how="left")
+        else:
+            print(f"[WARN] No {prefix}_{gold_path.stem} table in {pred_dir}, counting those rows as LLM misses")
+            gold["llm_label"] = np.nan
+        frames.append(gold)
+    return pd.concat(frames, ignore_index=True)
+
+
+def tradeoff_curve(nb_labels, nb_conf, llm_labels, gold):
+    """
+    Accuracy and LLM-call fraction for every distinct threshold: rows with nb_conf < t take
+    the LLM label, the rest keep the NB label.
+    """
+    nb_ok = nb_labels == gold
+    llm_ok = llm_labels == gold
+    order = np.argsort(nb_conf)
+    conf_sorted = nb_conf[order]
+    # routing the k least confident rows: accuracy = llm_ok on those + nb_ok on the rest
+    gain = np.concatenate([[0], np.cumsum(llm_ok[order].astype(int) - nb_ok[order].astype(int))])
+    n = len(gold)
+    thresholds = np.concatenate([[0.0], conf_sorted[1:], [np.inf]])
+    ks = np.searchsorted(conf_sorted, thresholds, side="left")
+    return pd.DataFrame({
+        "threshold": thresholds,
+        "llm_fraction": ks / n,
+        "accuracy": (nb_ok.sum() + gain[ks]) / n,
+    }).drop_duplicates("llm_fraction")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Accuracy vs. LLM-call trade-off of the NB -> LLM cascade.")
+    ap.add_argument("--llm-dir", default="llm_gen/gemma")
+    ap.add_argument("--llm-prefix", default="gemma_4b")
+    ap.add_argument("--target-accuracy", type=float, default=None,
+                    help="report the cheapest threshold reaching this accuracy")
+    ap.add_argument("--folds", type=int, default=5)
+    ap.add_argument("--out", default="cascade_curve.csv")
+    args = ap.parse_args()
+
+    df = load_gold_with_llm(args.llm_dir, args.llm_prefix)
+    X = df["description"].astype(str)
+    y = df["label"].astype(str).to_numpy()
+
+    # out-of-fold probabilities, so NB is never scored on rows it was trained on
+    cv = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=42)
+    model = make_model()
+    proba = cross_val_predict(model, X, y, cv=cv, method="predict_proba")
+    classes = np.unique(y)
+    nb_labels = classes[proba.argmax(axis=1)]
+    nb_conf = proba.max(axis=1)
+    llm_labels = df["llm_label"].to_numpy()
+
+    curve = tradeoff_curve(nb_labels, nb_conf, llm_labels, y)
+    curve.to_csv(args.out, index=False)
+
+    print(f"{len(df)} gold rows, NB alone {np.mean(nb_labels == y):.4f}, "
+          f"{args.llm_prefix} alone {np.mean(llm_labels == y):.4f}")
+    print(f"{'threshold':>10s} {'llm calls':>10s} {'accuracy':>9s}")
+    step = max(1, len(curve) // 20)
+    for r in curve.iloc[list(range(0, len(curve), step)) + [len(curve) - 1]].itertuples():
+        print(f"{r.threshold:10.4f} {r.llm_fraction:10.1%} {r.accuracy:9.4f}")
+    print(f"full curve saved to {args.out}")
+
+    if args.target_accuracy is not None:
+        ok = curve[curve["accuracy"] >= args.target_accuracy]
+        if ok.empty:
+            print(f"No threshold reaches accuracy {args.target_accuracy}")
+        else:
+            best = ok.iloc[0]
+            print(f"Cheapest threshold for accuracy >= {args.target_accuracy}: "
+                  f"{best.threshold:.4f} ({best.llm_fraction:.1%} LLM calls, accuracy {best.accuracy:.4f})")
+
+
+if __name__ == "__main__":
+    main()
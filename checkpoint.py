@@ -0,0 +1,100 @@
+"""
+Append-only progress log for labeling runs.
+
+Each labeled row is appended to a JSONL file next to the output table as
+{"txn_id": t, "label": ..., ...}; extra fields such as a confidence ride along. Callers work in
+row positions and hand load() the table's txn_ids, so a resume after the input was re-cleansed,
+reordered or appended to still puts every label on its own transaction. Without txn_ids
+records are keyed {"row": n} on position alone.
+Appending is O(batch) no matter how big the file is. If the run is interrupted, load() returns
+the labels that made it to disk so the next run can pick up where it stopped; a line torn by a
+crash is skipped, and the next append() starts on a fresh line after it. Once every row is
+labeled, finalize() writes the table once (storage.write_table) and removes the log.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from storage import write_table
+
+
+class LabelCheckpoint:
+    def __init__(self, save_path, fsync_every=20):
+        self.save_path = Path(save_path)
+        self.path = self.save_path.with_name(self.save_path.name + ".progress.jsonl")
+        self.fsync_every = fsync_every
+        self._f = None
+        self._appends = 0
+        self._txn_ids = None
+        self.stale = 0
+
+    def load(self, txn_ids=None):
+        """
+        Return {row: record} for every row already in the log. With txn_ids (the table's
+        storage.ID_COL in row order) records are matched on txn_id, here and in later appends;
+        those of transactions no longer in the table are left out and counted in self.stale.
+        """
+        self._txn_ids = None if txn_ids is None else [int(t) for t in txn_ids]
+        row_of = None if txn_ids is None else {t: row for row, t in enumerate(self._txn_ids)}
+        done = {}
+        self.stale = 0
+        if not self.path.exists():
+            return done
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    # a torn line from a crash mid-write; append() starts the next record on a
+                    # new line, so rows after it are still good
+                    continue
+                if row_of is None:
+                    done[rec.pop("row")] = rec
+                    continue
+                # a log from before txn_id keys cannot be trusted to match the table
+                row = row_of.get(rec.pop("txn_id", None))
+                rec.pop("row", None)
+                if row is None:
+                    self.stale += 1
+                else:
+                    done[row] = rec
+        return done
+
+    def append(self, records):
+        """
+        Append record dicts (each with "row" and "label"; None fields are dropped) and flush them.
+        After load(txn_ids), the row's txn_id is written in place of its position.
+        """
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+            if self._torn():
+                self._f.write("\n")
+        for rec in records:
+            rec = {k: v for k, v in rec.items() if v is not None}
+            row = int(rec.pop("row"))
+            key = {"row": row} if self._txn_ids is None else {"txn_id": self._txn_ids[row]}
+            self._f.write(json.dumps({**key, **rec}, ensure_ascii=False) + "\n")
+        self._f.flush()
+        self._appends += 1
+        if self.fsync_every and self._appends % self.fsync_every == 0:
+            os.fsync(self._f.fileno())
+
+    def _torn(self):
+        """True when the log's last line has no newline, i.e. a write was cut short."""
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return False
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def finalize(self, data):
+        """Write the finished DataFrame to save_path and drop the log."""
+        self.close()
+        write_table(data, self.save_path)
+        self.path.unlink(missing_ok=True)
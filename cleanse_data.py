@@ -1,21 +1,112 @@
-import pandas as pd
-import numpy as np
-import re
+"""
+Cleanse the parsed statement tables in data/ into cleansed_data/.
+
+Each table goes through one vectorized pass over its columns (no per-row Python):
+  - description: upper-cased, dates printed into the text removed, whitespace collapsed
+    (storage.clean_descriptions, the same form txn_id is hashed from)
+  - cashback_pct: the Apple Card Daily Cash suffix ("... MA USA 2%"), cut off the description
+  - merchant: the merchant name (merchant_cache.merchant_keys, same rules as the label cache)
+  - the parser's bookkeeping columns (type, balance, source_file, source_line) are dropped
+
+Only inputs whose content changed since the last run are processed: cleansed_data/
+.manifest.json records the sha256 of every input next to the CLEANSE_VERSION and output it
+produced. Outputs depend on nothing but the input bytes, so re-cleansing an unchanged input
+gives a byte-identical file. Bump CLEANSE_VERSION when the rules change.
+
+Usage:
+  python cleanse_data.py                  # cleansed_data/<month>.parquet for new/changed inputs
+  python cleanse_data.py --format csv --force
+"""
+
+import argparse
+import json
+import os
+import time
 from pathlib import Path
 
+import pandas as pd
+
+import metrics
+from merchant_cache import merchant_keys
+from pdf_cache import file_digest
+from storage import (DEFAULT_FORMAT, FORMATS, clean_descriptions, list_tables, normalize,
+                     read_table, table_path, write_table)
 
 DATA_DIR = Path("data")
-data_list = list(DATA_DIR.rglob("*.csv"))
-for file in data_list:
-    
-    print("cleaning the data:  " +str(file))
-    data = pd.read_csv(file)
-    cleansed_df =pd.DataFrame().reindex_like(data)
-    #cleanse descriptions
-    data['description'] = data['description'].astype(str).str.replace(r"\d{1,2}\/\d{1,2}\/\d{2,4}", " ", regex=True)
-    data.drop(columns= ['type','source_line','source_file','balance'],axis=1,inplace=True)
+OUT_DIR = Path("cleansed_data")
+MANIFEST_NAME = ".manifest.json"
+CLEANSE_VERSION = 1
+DROP_COLS = ["type", "balance", "source_file", "source_line"]
+# storage.CASHBACK_RE's percentage, matched on the last 4 characters only ("<space>NN%")
+CASHBACK_TAIL_PAT = r"(?s)^(?:.*\s(\d{1,2})%|.*)$"
+
+
+@metrics.timed("cleanse.transform")
+def cleanse(df):
+    """The cleansed frame for one parsed table."""
+    # txn_id is assigned before the description changes (a no-op for tables that already have one)
+    df = normalize(df).drop(columns=DROP_COLS, errors="ignore")
+    raw = df["description"].astype("str").fillna("")
+    tail = raw.str.rstrip().str.slice(-4)
+    df["cashback_pct"] = pd.to_numeric(tail.str.replace(CASHBACK_TAIL_PAT, r"\1", regex=True), errors="coerce")
+    df["description"] = clean_descriptions(raw)
+    df["merchant"] = merchant_keys(df["description"], clean=True)
+    return df
+
+
+class Manifest:
+    """input file name -> {sha256, version, output}, rewritten atomically after every file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = json.loads(self.path.read_text(encoding="utf-8")) if self.path.is_file() else {}
+
+    def is_current(self, src, digest, out_path):
+        entry = self.entries.get(src.name)
+        return (entry is not None and entry["sha256"] == digest and entry["version"] == CLEANSE_VERSION
+                and entry["output"] == out_path.name and out_path.is_file())
+
+    def record(self, src, digest, out_path, rows):
+        self.entries[src.name] = {"sha256": digest, "version": CLEANSE_VERSION, "output": out_path.name, "rows": rows}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def run(data_dir=DATA_DIR, out_dir=OUT_DIR, fmt=DEFAULT_FORMAT, force=False):
+    """Cleanse every new or changed table in data_dir; returns (files cleansed, files skipped, rows)."""
+    out_dir = Path(out_dir)
+    manifest = Manifest(out_dir / MANIFEST_NAME)
+    cleansed = skipped = rows = 0
+    for src in list_tables(data_dir):
+        out_path = table_path(out_dir, src.stem, fmt)
+        digest = file_digest(src)
+        if not force and manifest.is_current(src, digest, out_path):
+            skipped += 1
+            metrics.count("cleanse.files_unchanged")
+            continue
+        t0 = time.perf_counter()
+        df = cleanse(read_table(src))
+        write_table(df, out_path)
+        manifest.record(src, digest, out_path, len(df))
+        cleansed += 1
+        rows += len(df)
+        metrics.count("cleanse.files")
+        metrics.count("cleanse.rows", len(df))
+        print(f"{src} -> {out_path}: {len(df)} rows in {time.perf_counter() - t0:.2f}s")
+    return cleansed, skipped, rows
+
 
-    print(data.columns)
-    data.to_csv(f"cleansed_{str(file)}")
+def main():
+    ap = argparse.ArgumentParser(description="Cleanse parsed statement tables into cleansed_data/.")
+    ap.add_argument("--data-dir", default=DATA_DIR)
+    ap.add_argument("--out-dir", default=OUT_DIR)
+    ap.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT)
+    ap.add_argument("--force", action="store_true", help="re-cleanse inputs that have not changed")
+    args = ap.parse_args()
+    cleansed, skipped, rows = run(args.data_dir, args.out_dir, args.format, args.force)
+    print(f"cleansed {cleansed} file(s) ({rows} rows), {skipped} unchanged")
 
 
+if __name__ == "__main__":
+    main()
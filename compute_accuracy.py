@@ -1,72 +1,247 @@
+"""
+Evaluate every prediction set under llm_gen/ (plus out-of-fold Naive Bayes) against labeled/.
+
+Gold labels are loaded once into an integer-coded array. A prediction set is any group of
+tables named <prefix>_<month>.<csv|parquet|arrow> in one directory under llm_gen/, e.g.
+llm_gen/gemma/gemma_4b_*.csv is the model "gemma/gemma_4b". Predictions are joined to the gold
+rows on txn_id (see storage.py). Every model is scored in one vectorized pass: accuracy and
+macro-F1 with paired bootstrap confidence intervals, per-class precision/recall/F1 and a
+confusion matrix each.
+
+Raw model output is normalized before scoring (trailing newlines, punctuation, the prompt's
+own misspellings such as "Utilites" and "Subscription", and the "1"-"9" enum answers).
+Anything else counts as a wrong answer, as does a gold row with no prediction. Rows whose
+label_source says the model never saw them (merchant cache, kNN transfer, Naive Bayes, or a
+batch row sharing another row's answer) are left out of that model's scores; "rows" in the
+output is how many were scored.
+
+Usage:
+  python compute_accuracy.py                       # writes eval_results.csv and eval_confusion.csv
+  python compute_accuracy.py --bootstrap 5000 --no-nb
+"""
+
+import argparse
 from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+from llm_infra import LABEL_NAMES, label_enums, parse_label
+from storage import FORMATS, ID_COL, list_tables, read_table
+
 # Directories
 LABELED_DIR = Path("labeled")
-PRED_DIR = Path("llm_gen/gemma")
+PRED_DIR = Path("llm_gen")
 
 # Column names (change here if yours differ)
-ID_COL = "Unnamed: 0"
 LABEL_COL = "label"
 
+# answers that are the prompt's own spelling of a category rather than a model mistake
+LABEL_ALIASES = {"utilites": "utilities", "subscription": "subscriptions", **label_enums}
+INVALID = "<invalid>"
+CLASSES = LABEL_NAMES + [INVALID]
+CLASS_CODES = {name: i for i, name in enumerate(CLASSES)}
+# label_source values of rows that did not get their label from the model itself
+NOT_MODEL_SOURCES = ["cache", "knn", "nb", "group"]
+# prediction code of such a row: not scored at all (-1, no prediction, counts as wrong)
+EXCLUDED = -2
+
+
+def encode(labels):
+    """Normalize raw label strings and map them to codes into CLASSES (INVALID for anything unknown)."""
+    labels = pd.Series(labels, dtype=object)
+    uniq, inverse = np.unique(labels.fillna("").astype(str).to_numpy(), return_inverse=True)
+    codes = np.array([CLASS_CODES.get(LABEL_ALIASES.get(p, p), CLASS_CODES[INVALID])
+                      for p in map(parse_label, uniq)], dtype=np.int8)
+    return codes[inverse]
+
+
+def load_gold(labeled_dir=LABELED_DIR):
+    """One frame for all gold files: stem, ID, integer label code."""
+    frames = []
+    for gold_path in list_tables(labeled_dir):
+        gold = read_table(gold_path, columns=[ID_COL, "description", LABEL_COL])
+        frames.append(pd.DataFrame({
+            "stem": gold_path.stem,
+            ID_COL: gold[ID_COL],
+            "description": gold["description"].astype(str),
+            "y": encode(gold[LABEL_COL]),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def discover_prediction_sets(pred_dir, stems):
+    """{model name: {stem: table path}} for every <prefix>_<stem> table under pred_dir."""
+    sets = {}
+    # preferred formats first, so a set saved in two formats is read from the better one
+    for fmt in FORMATS:
+        for path in sorted(Path(pred_dir).rglob(f"*.{fmt}")):
+            for stem in stems:
+                if path.stem.endswith("_" + stem):
+                    prefix = path.stem[:-len(stem) - 1]
+                    name = (path.parent.relative_to(pred_dir) / prefix).as_posix()
+                    sets.setdefault(name, {}).setdefault(stem, path)
+                    break
+    return dict(sorted(sets.items()))
+
+
+def load_predictions(gold, files):
+    """
+    Prediction codes aligned to the gold rows; -1 where the model has no answer for a row,
+    EXCLUDED where the answer did not come from the model (see NOT_MODEL_SOURCES).
+    """
+    pred = np.full(len(gold), -1, dtype=np.int8)
+    for stem, path in files.items():
+        rows = np.flatnonzero(gold["stem"].to_numpy() == stem)
+        df = read_table(path, columns=[ID_COL, LABEL_COL, "label_source"])
+        pos = pd.Index(gold[ID_COL].to_numpy()[rows]).get_indexer(df[ID_COL])
+        ok = pos >= 0
+        codes = encode(df[LABEL_COL].to_numpy())
+        if "label_source" in df.columns:
+            codes[df["label_source"].isin(NOT_MODEL_SOURCES).to_numpy()] = EXCLUDED
+        pred[rows[pos[ok]]] = codes[ok]
+    return pred
+
+
+def nb_oof_predictions(gold, folds=5):
+    """Out-of-fold Naive Bayes predictions, so NB is never scored on rows it was trained on."""
+    from sklearn.model_selection import StratifiedKFold, cross_val_predict
 
-def eval_one(gold_path: Path, pred_path: Path):
-    """Return (correct, total, accuracy) for a single pair of CSVs."""
-    gold = pd.read_csv(gold_path)
-    pred = pd.read_csv(pred_path)
-
-    # Prefer joining on an ID column if present
-    if ID_COL in gold.columns and ID_COL in pred.columns:
-        merged = gold[[ID_COL, LABEL_COL]].merge(
-            pred[[ID_COL, LABEL_COL]],
-            on=ID_COL,
-            how="inner",
-            suffixes=("_gold", "_pred"),
-        )
-    else:
-        # Fallback: align by row order
-        n = min(len(gold), len(pred))
-        merged = pd.DataFrame({
-            "label_gold": gold[LABEL_COL].iloc[:n].to_numpy(),
-            "label_pred": pred[LABEL_COL].iloc[:n].to_numpy(),
-        })
-
-    correct = (merged["label_gold"] == merged["label_pred"]).sum()
-    total = len(merged)
-    acc = correct / total if total else float("nan")
-    return correct, total, acc
+    from nb_classify import make_model
+
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=42)
+    y = np.array(CLASSES)[gold["y"].to_numpy()]
+    return encode(cross_val_predict(make_model(), gold["description"], y, cv=cv))
+
+
+def confusion_matrices(y, P, k):
+    """
+    (M, k, k) counts for M prediction rows P against gold y; -1 (missing) counts as INVALID,
+    EXCLUDED not at all.
+    """
+    M = P.shape[0]
+    flat = np.arange(M)[:, None] * k * k + y[None, :] * k + np.where(P < 0, CLASS_CODES[INVALID], P)
+    counts = np.bincount(flat.ravel(), weights=(P != EXCLUDED).ravel(), minlength=M * k * k)
+    return counts.astype(np.int64).reshape(M, k, k)
+
+
+def prf(cm, n_labels):
+    """Per-class precision, recall, F1 over the real labels (last dims of an (..., k, k) confusion)."""
+    tp = np.diagonal(cm, axis1=-2, axis2=-1)[..., :n_labels].astype(float)
+    predicted = cm.sum(axis=-2)[..., :n_labels]
+    support = cm.sum(axis=-1)[..., :n_labels]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return precision, recall, f1, support
+
+
+def macro_f1(cm, n_labels):
+    _, _, f1, support = prf(cm, n_labels)
+    present = support > 0
+    return (f1 * present).sum(axis=-1) / np.maximum(present.sum(axis=-1), 1)
+
+
+def bootstrap(y, P, n_boot, alpha=0.05, seed=0, chunk=200):
+    """
+    Paired bootstrap over gold rows (same resamples for every model). Returns (M, 2, 2):
+    [accuracy, macro-F1] x [low, high] percentile bounds.
+    """
+    rng = np.random.default_rng(seed)
+    M, N = P.shape
+    k = len(CLASSES)
+    Pv = np.where(P < 0, CLASS_CODES[INVALID], P)
+    scored = P != EXCLUDED
+    acc, mf1 = [], []
+    for start in range(0, n_boot, chunk):
+        B = min(chunk, n_boot - start)
+        idx = rng.integers(0, N, size=(B, N))
+        yb, Pb, Sb = y[idx], Pv[:, idx], scored[:, idx]               # (B, N), (M, B, N), (M, B, N)
+        acc.append(((Pb == yb) & Sb).sum(axis=-1) / np.maximum(Sb.sum(axis=-1), 1))
+        flat = (np.arange(M)[:, None, None] * B + np.arange(B)[None, :, None]) * k * k + yb * k + Pb
+        cm = np.bincount(flat.ravel(), weights=Sb.ravel(), minlength=M * B * k * k).reshape(M, B, k, k)
+        mf1.append(macro_f1(cm, len(LABEL_NAMES)))
+    q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    return np.stack([np.percentile(np.concatenate(acc, axis=1), q, axis=1).T,
+                     np.percentile(np.concatenate(mf1, axis=1), q, axis=1).T], axis=1)
 
 
 def main():
-    total_correct = 0
-    total_examples = 0
-    summary_rows = []
-    # Loop over all gold files in labeled/
-    for gold_path in sorted(LABELED_DIR.glob("*.csv")):
-        stem = gold_path.stem          # e.g. "august"
-        pred_path = PRED_DIR / f"gemma_4b_{stem}.csv"
-
-        if not pred_path.exists():
-            print(f"[WARN] Missing prediction file for {gold_path.name}, "
-                  f"expected {pred_path.name}")
-            continue
-
-        correct, total, acc = eval_one(gold_path, pred_path)
-        total_correct += correct
-        total_examples += total
-
-        print(f"{stem:15s} accuracy = {acc:.4f}  ({correct}/{total})")
-        summary_rows.append([stem, correct, total, acc])
-
-    if total_examples:
-        overall_acc = total_correct / total_examples
-        print("-" * 50)
-        print(f"OVERALL        accuracy = {overall_acc:.4f} "
-              f"({total_correct}/{total_examples})")
-    else:
-        print("No matching gold/prediction CSV pairs found.")
-    results_df= pd.DataFrame(summary_rows)
-    results_df.to_csv("gemma_4b_results.csv",index=False)
+    ap = argparse.ArgumentParser(description="Score every prediction set under llm_gen/ against labeled/.")
+    ap.add_argument("--labeled-dir", default=LABELED_DIR)
+    ap.add_argument("--pred-dir", default=PRED_DIR)
+    ap.add_argument("--bootstrap", type=int, default=1000, help="bootstrap resamples for the confidence intervals")
+    ap.add_argument("--no-nb", action="store_true", help="skip the out-of-fold Naive Bayes baseline")
+    ap.add_argument("--out", default="eval_results.csv")
+    ap.add_argument("--confusion-out", default="eval_confusion.csv")
+    args = ap.parse_args()
+
+    gold = load_gold(args.labeled_dir)
+    stems = gold["stem"].unique()
+    names, preds = [], []
+    for name, files in discover_prediction_sets(args.pred_dir, stems).items():
+        missing = sorted(set(stems) - set(files))
+        if missing:
+            print(f"[WARN] {name}: no predictions for {', '.join(missing)}, counting those rows as wrong")
+        names.append(name)
+        preds.append(load_predictions(gold, files))
+    if not args.no_nb:
+        names.append("naive_bayes_oof")
+        preds.append(nb_oof_predictions(gold))
+    if not names:
+        print("No prediction sets found.")
+        return
+
+    y = gold["y"].to_numpy()
+    P = np.stack(preds)
+    k, n_labels = len(CLASSES), len(LABEL_NAMES)
+    cm = confusion_matrices(y, P, k)
+    precision, recall, f1, support = prf(cm, n_labels)
+    scored = P != EXCLUDED
+    n_scored = scored.sum(axis=1)
+    # NaN for a model with no rows of its own
+    with np.errstate(divide="ignore", invalid="ignore"):
+        accuracy = (P == y).sum(axis=1) / n_scored
+        coverage = (P >= 0).sum(axis=1) / n_scored
+        invalid = ((P == -1) | (P == CLASS_CODES[INVALID])).sum(axis=1) / n_scored
+    mf1 = macro_f1(cm, n_labels)
+    ci = bootstrap(y, P, args.bootstrap)
+
+    rows = []
+    for m, name in enumerate(names):
+        rows.append({"model": name, "class": "ALL", "support": n_scored[m], "accuracy": accuracy[m],
+                     "accuracy_lo": ci[m, 0, 0], "accuracy_hi": ci[m, 0, 1], "macro_f1": mf1[m],
+                     "macro_f1_lo": ci[m, 1, 0], "macro_f1_hi": ci[m, 1, 1],
+                     "coverage": coverage[m], "invalid_rate": invalid[m]})
+        for c, label in enumerate(LABEL_NAMES):
+            rows.append({"model": name, "class": label, "support": support[m, c],
+                         "precision": precision[m, c], "recall": recall[m, c], "f1": f1[m, c]})
+    results = pd.DataFrame(rows)
+    results.to_csv(args.out, index=False, float_format="%.4f")
+
+    m_idx, g_idx, p_idx = np.nonzero(cm)
+    pd.DataFrame({"model": np.array(names)[m_idx], "gold": np.array(CLASSES)[g_idx],
+                  "pred": np.array(CLASSES)[p_idx], "count": cm[m_idx, g_idx, p_idx]}
+                 ).to_csv(args.confusion_out, index=False)
+
+    print(f"{len(y)} gold rows in {len(stems)} files, {args.bootstrap} bootstrap resamples (95% CI)\n")
+    print(f"{'model':25s} {'rows':>5s} {'accuracy':>22s} {'macro-F1':>22s} {'invalid':>8s}")
+    for m, name in enumerate(names):
+        print(f"{name:25s} {n_scored[m]:5d} {accuracy[m]:.4f} [{ci[m, 0, 0]:.4f}, {ci[m, 0, 1]:.4f}] "
+              f"{mf1[m]:.4f} [{ci[m, 1, 0]:.4f}, {ci[m, 1, 1]:.4f}] {invalid[m]:8.1%}")
+
+    print("\nper-file accuracy")
+    file_codes, file_names = pd.factorize(gold["stem"])
+    correct = (P == y).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_file = (np.stack([np.bincount(file_codes, weights=c) for c in correct])
+                    / np.stack([np.bincount(file_codes, weights=s) for s in scored]))
+    print(pd.DataFrame(per_file.T, index=file_names, columns=names).round(4).to_string())
+
+    print("\nper-class F1")
+    print(pd.DataFrame(f1.T, index=LABEL_NAMES, columns=names).round(3).to_string())
+    print(f"\nresults -> {args.out}, confusion matrices -> {args.confusion_out}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""
+Persistent cross-statement deduplication index for parse_pdf.py.
+
+A transaction's fingerprint is its storage.transaction_ids() value computed over the rows of
+its own statement: date, cleaned description and amount plus the occurrence number among
+identical rows of that statement. The file name is not part of it, so the same purchase
+printed by two overlapping statements, or by a re-downloaded PDF with a new name, gets the
+same fingerprint, while two identical coffees on one statement stay two transactions.
+
+The index is a single SQLite file mapping every fingerprint ever emitted to the output table
+it was first written to. parse_pdf.py claims each statement's fingerprints before writing:
+only transactions never emitted before are written, so each one is parsed into exactly one
+output table, and cleansed and labeled once downstream. Writing to the table that already
+holds a transaction again (re-running the same command) keeps it, so reruns are idempotent.
+parse_pdf.py forgets its output table before writing it, since the table is rewritten from
+scratch, and warns about every other table that keeps transactions out of it.
+
+  python dedup_index.py stats                  # transactions per output table
+  python dedup_index.py forget data/old.parquet  # after deleting that table
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+
+# SQLite's default limit on host parameters per statement is 999
+QUERY_BATCH = 900
+
+
+class DedupIndex:
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transactions (
+                fingerprint INTEGER PRIMARY KEY,
+                source_file TEXT NOT NULL,
+                output TEXT NOT NULL,
+                first_seen REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+        self.emitted = set()   # fingerprints written during this run
+        self.new = 0
+        self.duplicates = 0
+        self.held_elsewhere = Counter()   # other output table -> transactions left out for it
+
+    def _known(self, fingerprints):
+        known = {}
+        for i in range(0, len(fingerprints), QUERY_BATCH):
+            batch = fingerprints[i:i + QUERY_BATCH]
+            cur = self.conn.execute(
+                f"SELECT fingerprint, output FROM transactions WHERE fingerprint IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            known.update(cur.fetchall())
+        return known
+
+    def claim(self, fingerprints, source_file, output):
+        """
+        Boolean mask over fingerprints: True for the transactions that belong in output (never
+        emitted before, or first emitted to output itself and not yet in this run). New ones are
+        recorded; call commit() once they are written.
+        """
+        fingerprints = [int(fp) for fp in fingerprints]
+        output = os.path.normpath(output)
+        known = self._known(fingerprints)
+        keep = np.array([fp not in self.emitted and known.get(fp, output) == output for fp in fingerprints],
+                        dtype=bool)
+        self.held_elsewhere.update(known[fp] for fp in fingerprints if known.get(fp, output) != output)
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO transactions VALUES (?, ?, ?, ?)",
+            [(fp, str(source_file), output, now) for fp, k in zip(fingerprints, keep) if k and fp not in known],
+        )
+        self.emitted.update(fp for fp, k in zip(fingerprints, keep) if k)
+        self.new += int(keep.sum())
+        self.duplicates += len(fingerprints) - int(keep.sum())
+        metrics.count("dedup.duplicates", len(fingerprints) - int(keep.sum()))
+        return keep
+
+    def forget(self, output):
+        """Drop every transaction recorded for output, e.g. after deleting that table."""
+        cur = self.conn.execute("DELETE FROM transactions WHERE output = ?", (os.path.normpath(output),))
+        self.conn.commit()
+        return cur.rowcount
+
+    def stats(self):
+        return self.conn.execute(
+            "SELECT output, COUNT(*), COUNT(DISTINCT source_file) FROM transactions GROUP BY output ORDER BY output"
+        ).fetchall()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect or edit the cross-statement dedup index.")
+    ap.add_argument("command", choices=["stats", "forget"])
+    ap.add_argument("output", nargs="?", help="with forget: the output table to drop from the index")
+    ap.add_argument("--index", default=".dedup_index.sqlite")
+    args = ap.parse_args()
+    if not Path(args.index).is_file():
+        raise SystemExit(f"no index at {args.index}")
+    index = DedupIndex(args.index)
+    try:
+        if args.command == "forget":
+            if not args.output:
+                ap.error("forget needs the output table")
+            print(f"forgot {index.forget(args.output)} transactions of {args.output}")
+        else:
+            for output, n, sources in index.stats():
+                print(f"{output:40s} {n:8d} transactions from {sources} statement(s)")
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
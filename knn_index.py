@@ -0,0 +1,387 @@
+"""
+Nearest-neighbour index over hand-labeled transactions, for label transfer and few-shot prompts.
+
+Most descriptions the merchant cache misses are close variants of labeled ones: the same chain
+with another store number, street or city, or a name spelled a little differently. A
+description is reduced to its merchant name with merchant_rules.merchant_key(), the merchant
+cache's key (the words before the first store number, street number or zip; the whole text if
+there are none),
+and cut into character 3-grams within words, as TfidfVectorizer(analyzer="char_wb") would.
+Addresses are left out because they made rows of one chain look unlike each other and rows of
+one street look alike. An n-gram weighs its smoothed idf, and the neighbours of a query are the
+labeled rows with the highest cosine similarity to it:
+
+    "SQ *FAMILIARS COFFEE &6 Strong Ave Northampton 01060 MA USA 2%"
+    "SQ *FAMILIAR COFFEE 12 Main St Amherst 01002 MA USA 2%"        -> similarity 0.90
+
+Everything is plain NumPy: the n-gram ids of every row (CSR arrays) and an inverted index from
+n-gram to rows, so a query only touches rows that share an n-gram with it. insert() adds rows
+without a rebuild: rows inserted since the last rebuild are scanned directly, and the inverted
+index (with the idf weights and row norms it was built with) is rebuilt once MAX_PENDING of
+them have piled up. NumPy is all it needs at query time, so nb_predict.py can load it too.
+
+Used by:
+  - llm_infra.py and batch_generate.py (--cascade-threshold): rows whose nearest labeled
+    neighbours agree with at least KNN_THRESHOLD similarity take their label (label_source
+    "knn") before Naive Bayes is asked; nb_predict.py reports that label as knn_label
+  - llm_infra.py and batch_generate.py (--few-shot K): the K most similar labeled rows are the
+    prompt's examples
+Both leave the labeled tables of the months they are labeling out of the index (skip=), as the
+merchant cache does.
+
+Usage:
+  python knn_index.py build                                  # labeled/ -> models/knn_index.npz
+  python knn_index.py query "SQ *SHARE 99 MAIN ST NORTHAMPTON MA USA 2%" -k 5
+"""
+
+import argparse
+import re
+from pathlib import Path
+
+import numpy as np
+
+from merchant_rules import merchant_key
+
+LABELED_DIR = Path("labeled")
+INDEX_PATH = Path("models/knn_index.npz")
+# bump when the arrays written by save() change meaning
+INDEX_VERSION = 2
+NGRAM = 3
+# inserted rows scanned directly before the inverted index is rebuilt with them
+MAX_PENDING = 256
+# queries x rows up to which search_many() sums similarities in a dense table instead of sorting pairs
+DENSE_LIMIT = 1 << 22
+# neighbours voting on a label, and the similarity from which their label is taken over Naive Bayes'
+# (leave-one-month-out on labeled/, see bench_knn_index.py)
+K = 5
+KNN_THRESHOLD = 0.7
+
+# punctuation, digits and whitespace all separate words
+NON_LETTERS_RE = re.compile(r'[\W\d_]+')
+
+
+def merchant_name(description):
+    """The merchant name part of a description (merchant_rules.merchant_key), or all of it when it has none."""
+    return merchant_key(description) or str(description).upper()
+
+
+def ngrams(description, n=NGRAM):
+    """The set of character n-grams of a description's merchant name, each word padded with spaces."""
+    grams = set()
+    for word in NON_LETTERS_RE.split(merchant_name(description)):
+        if word:
+            word = f" {word} "
+            grams.update(word[i:i + n] for i in range(max(1, len(word) - n + 1)))
+    return grams
+
+
+def _ragged_arange(starts, counts):
+    """The concatenation of range(start, start + count) for every (start, count) pair."""
+    ends = np.cumsum(counts)
+    return np.repeat(starts - ends + counts, counts) + np.arange(ends[-1] if len(ends) else 0)
+
+
+class KNNIndex:
+    def __init__(self, ngram=NGRAM):
+        self.ngram = ngram
+        self.terms = {}                          # n-gram -> id
+        self.df = np.zeros(1024, dtype=np.int64)  # rows containing each n-gram id
+        self.descriptions, self.amounts, self.labels = [], [], []
+        # storage.py txn_id of every row (None when not given), so a row is never its own neighbour
+        self.txn_ids, self._row_of_txn = [], {}
+        # n-gram ids of every row, CSR style; rows past the CSR arrays are still in _pending
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self._pending = []
+        self._pending_flat = None
+        self._label_ids = {}
+        self._codes = np.zeros(0, dtype=np.int64)
+        self._rebuild()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _ids(self, description, grow=False):
+        """(known n-gram ids, number of n-grams the index has never seen) of a description."""
+        terms = self.terms
+        grams = ngrams(description, self.ngram)
+        if grow:
+            for g in grams:
+                terms.setdefault(g, len(terms))
+        ids = np.fromiter((terms[g] for g in grams if g in terms), dtype=np.int32)
+        return ids, len(grams) - len(ids)
+
+    def _idf(self, ids):
+        """Smoothed idf, as TfidfVectorizer(smooth_idf=True) computes it, of n-gram ids now."""
+        return np.log((1 + len(self)) / (1 + self.df[ids])) + 1
+
+    def insert(self, descriptions, labels, amounts=None, txn_ids=None):
+        """Add labeled rows; they are searchable at once."""
+        if amounts is None:
+            amounts = [None] * len(labels)
+        if txn_ids is None:
+            txn_ids = [None] * len(labels)
+        for description, label, amount, txn_id in zip(descriptions, labels, amounts, txn_ids):
+            if txn_id is not None:
+                self._row_of_txn[int(txn_id)] = len(self.labels)
+            self.txn_ids.append(None if txn_id is None else int(txn_id))
+            ids, _ = self._ids(description, grow=True)
+            if len(self.terms) > len(self.df):
+                self.df = np.concatenate([self.df, np.zeros(max(len(self.df), len(self.terms)), dtype=np.int64)])
+            self.df[ids] += 1
+            self._pending.append(ids)
+            self.descriptions.append(str(description).strip())
+            self.amounts.append(None if amount is None or amount != amount else float(amount))
+            self.labels.append(str(label))
+        self._pending_flat = None
+        if len(self._pending) > MAX_PENDING:
+            self._rebuild()
+
+    def _rebuild(self):
+        """Fold pending rows into the CSR arrays and rebuild the inverted index, idf and row norms."""
+        if self._pending:
+            lengths = np.fromiter((len(ids) for ids in self._pending), dtype=np.int64, count=len(self._pending))
+            self.indices = np.concatenate([self.indices, *self._pending]).astype(np.int32)
+            self.indptr = np.concatenate([self.indptr, self.indptr[-1] + np.cumsum(lengths)])
+            self._pending = []
+            self._pending_flat = None
+        n_rows, n_terms = len(self.indptr) - 1, len(self.terms)
+        row_of = np.repeat(np.arange(n_rows, dtype=np.int32), np.diff(self.indptr))
+        self._post_rows = row_of[np.argsort(self.indices, kind="stable")]
+        self._post_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=n_terms), out=self._post_ptr[1:])
+        norms = np.sqrt(np.bincount(row_of, self._idf(self.indices) ** 2, minlength=n_rows))
+        self._norms = np.where(norms > 0, norms, 1.0)
+
+    def _pending_arrays(self):
+        """(n-gram ids, row) of every pending row's n-grams, and the pending rows' norms."""
+        if self._pending_flat is None:
+            lengths = [len(ids) for ids in self._pending]
+            ids = np.concatenate(self._pending)
+            rows = np.repeat(np.arange(len(self._pending)), lengths)
+            norms = np.sqrt(np.bincount(rows, self._idf(ids) ** 2, minlength=len(lengths)))
+            self._pending_flat = ids, rows, np.where(norms > 0, norms, 1.0)
+        return self._pending_flat
+
+    def search_many(self, descriptions, k=K, exclude=None):
+        """
+        (query, row, similarity) arrays: the k labeled rows most similar to each description,
+        grouped by query position and best first. A query sharing no n-gram with the index has
+        no entries. exclude holds a txn_id (or None) per description: the labeled row with that
+        txn_id, the very transaction being labeled, is left out of its neighbours.
+        """
+        parsed = [self._ids(d) for d in descriptions]
+        n_q, n_rows = len(parsed), len(self)
+        if not n_q or not n_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        lengths = np.fromiter((len(ids) for ids, _ in parsed), dtype=np.int64, count=n_q)
+        unseen = np.fromiter((u for _, u in parsed), dtype=np.float64, count=n_q)
+        q_ids = np.concatenate([ids for ids, _ in parsed])
+        q_of = np.repeat(np.arange(n_q), lengths)
+        w2 = self._idf(q_ids) ** 2
+        # n-grams no labeled row has still count towards a query's norm
+        q_norm = np.sqrt(np.bincount(q_of, w2, minlength=n_q) + unseen * (np.log(1 + n_rows) + 1) ** 2)
+        q_norm[q_norm == 0] = 1.0
+
+        # every (query, row) pair sharing an n-gram, from the inverted index
+        indexed = q_ids < len(self._post_ptr) - 1
+        starts = self._post_ptr[q_ids[indexed]]
+        counts = self._post_ptr[q_ids[indexed] + 1] - starts
+        rows = self._post_rows[_ragged_arange(starts, counts)].astype(np.int64)
+        qs = np.repeat(q_of[indexed], counts)
+        ws = np.repeat(w2[indexed], counts) / self._norms[rows]
+        if self._pending:
+            # and from the pending rows, joined with the queries on n-gram id
+            p_ids, p_rows, p_norms = self._pending_arrays()
+            order = np.argsort(q_ids, kind="stable")
+            lo = np.searchsorted(q_ids[order], p_ids, "left")
+            hi = np.searchsorted(q_ids[order], p_ids, "right")
+            match = order[_ragged_arange(lo, hi - lo)]
+            p_rows = np.repeat(p_rows, hi - lo)
+            qs = np.concatenate([qs, q_of[match]])
+            rows = np.concatenate([rows, len(self.indptr) - 1 + p_rows])
+            ws = np.concatenate([ws, w2[match] / p_norms[p_rows]])
+        if exclude is not None:
+            own = np.fromiter((self._row_of_txn.get(None if t is None else int(t), -1) for t in exclude),
+                              dtype=np.int64, count=n_q)
+            keep = rows != own[qs]
+            qs, rows, ws = qs[keep], rows[keep], ws[keep]
+        if not len(qs):
+            return qs, rows, ws
+
+        if n_q * n_rows <= DENSE_LIMIT:
+            # few queries: sum into a dense (query, row) table, no sort of the pairs, and keep
+            # each query's k best
+            dense = np.bincount(qs * n_rows + rows, ws, minlength=n_q * n_rows).reshape(n_q, n_rows)
+            dense /= q_norm[:, None]
+            if k < n_rows:
+                top = np.argpartition(-dense, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(n_rows), (n_q, n_rows))
+            qs, rows = np.repeat(np.arange(n_q), top.shape[1]), top.ravel()
+            sims = dense[qs, rows]
+            qs, rows, sims = qs[sims > 0], rows[sims > 0], sims[sims > 0]
+        else:
+            pairs, inv = np.unique(qs * n_rows + rows, return_inverse=True)
+            sims = np.bincount(inv, ws, minlength=len(pairs))
+            qs, rows = pairs // n_rows, pairs % n_rows
+            sims /= q_norm[qs]
+        order = np.lexsort((-sims, qs))
+        qs, rows, sims = qs[order], rows[order], sims[order]
+        keep = np.arange(len(qs)) - np.searchsorted(qs, qs) < k
+        return qs[keep], rows[keep], sims[keep]
+
+    def search(self, description, k=K, exclude=None):
+        """(rows, similarities) of the k labeled rows most similar to description, best first."""
+        _, rows, sims = self.search_many([description], k, None if exclude is None else [exclude])
+        return rows, sims
+
+    def _label_codes(self):
+        """Every row's label as an index into self._label_ids (label -> code, by first appearance)."""
+        if len(self._codes) < len(self):
+            ids = self._label_ids
+            new = [ids.setdefault(label, len(ids)) for label in self.labels[len(self._codes):]]
+            self._codes = np.concatenate([self._codes, np.array(new, dtype=np.int64)])
+        return self._codes
+
+    def predict(self, descriptions, k=K, exclude=None):
+        """
+        (labels, similarities): per description, the label with the highest similarity-weighted
+        vote among its k nearest rows, and the similarity of the nearest row with that label.
+        A description sharing no n-gram with the index gets None and 0. exclude: see search_many().
+        """
+        n = len(descriptions)
+        labels, similarity = np.full(n, None, dtype=object), np.zeros(n)
+        qs, rows, sims = self.search_many(descriptions, k, exclude)
+        if not len(qs):
+            return labels, similarity
+        codes = self._label_codes()
+        n_labels = len(self._label_ids)
+        key = qs * n_labels + codes[rows]
+        votes = np.bincount(key, sims, minlength=n * n_labels).reshape(n, n_labels)
+        nearest = np.zeros(n * n_labels)
+        np.maximum.at(nearest, key, sims)
+        best = votes.argmax(axis=1)
+        matched = np.unique(qs)
+        labels[matched] = np.array(list(self._label_ids), dtype=object)[best[matched]]
+        similarity[matched] = nearest.reshape(n, n_labels)[matched, best[matched]]
+        return labels, similarity
+
+    def examples(self, description, k=3, exclude=None):
+        """
+        Up to k (description, amount, label) of the most similar labeled rows, one per description,
+        leaving out the row whose txn_id is exclude.
+        """
+        rows, _ = self.search(description, 4 * k, exclude)
+        out, seen = [], set()
+        for row in rows.tolist():
+            if self.descriptions[row] not in seen:
+                seen.add(self.descriptions[row])
+                out.append((self.descriptions[row], self.amounts[row], self.labels[row]))
+                if len(out) == k:
+                    break
+        return out
+
+    def save(self, path=INDEX_PATH):
+        """Write the index as plain arrays (no pickles); the inverted index is rebuilt on load."""
+        self._rebuild()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            version=np.int64(INDEX_VERSION),
+            ngram=np.int64(self.ngram),
+            terms=np.array(list(self.terms), dtype=str),
+            indptr=self.indptr,
+            indices=self.indices,
+            descriptions=np.array(self.descriptions, dtype=str),
+            amounts=np.array([np.nan if a is None else a for a in self.amounts], dtype=np.float64),
+            labels=np.array(self.labels, dtype=str),
+            txn_ids=np.array([0 if t is None else t for t in self.txn_ids], dtype=np.int64),
+            has_txn_id=np.array([t is not None for t in self.txn_ids], dtype=bool),
+        )
+        return path
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        path = Path(path)
+        if not path.is_file():
+            raise FileNotFoundError(f"{path} not found, run `python knn_index.py build` first")
+        with np.load(path, allow_pickle=False) as art:
+            version = int(art["version"])
+            if version != INDEX_VERSION:
+                raise ValueError(f"{path} is index version {version}, expected {INDEX_VERSION}; rebuild it")
+            index = cls(int(art["ngram"]))
+            index.terms = {t: i for i, t in enumerate(art["terms"].tolist())}
+            index.indptr, index.indices = art["indptr"], art["indices"]
+            index.df = np.bincount(index.indices, minlength=max(len(index.terms), 1)).astype(np.int64)
+            index.descriptions = art["descriptions"].tolist()
+            index.amounts = [None if np.isnan(a) else a for a in art["amounts"].tolist()]
+            index.labels = art["labels"].tolist()
+            known = art["has_txn_id"].tolist()
+            index.txn_ids = [t if k else None for t, k in zip(art["txn_ids"].tolist(), known)]
+            index._row_of_txn = {t: row for row, t in enumerate(index.txn_ids) if t is not None}
+        index._rebuild()
+        return index
+
+    @classmethod
+    def from_frame(cls, df):
+        """An index of a labeled table's rows (description, label and, when present, amount and txn_id)."""
+        df = df.dropna(subset=["label"])
+        index = cls()
+        index.insert(df["description"].astype(str).tolist(), df["label"].astype(str).tolist(),
+                     df["amount"].tolist() if "amount" in df.columns else None,
+                     df["txn_id"].tolist() if "txn_id" in df.columns else None)
+        index._rebuild()
+        return index
+
+
+def build(labeled_dir=LABELED_DIR, skip=()):
+    """An index of every hand-labeled row in labeled_dir, leaving out the tables whose stem is in skip."""
+    import pandas as pd
+
+    from storage import list_tables, read_table
+
+    frames = [read_table(f) for f in list_tables(labeled_dir) if f.stem not in set(skip)]
+    return KNNIndex.from_frame(pd.concat(frames, ignore_index=True)) if frames else KNNIndex()
+
+
+def load_or_build(path=INDEX_PATH, labeled_dir=LABELED_DIR, skip=()):
+    """
+    The saved index at path, or a fresh one of labeled_dir when there is none yet. The saved
+    index holds every labeled table, so when one of them is in skip (a month being labeled,
+    whose gold labels must not come back as answers) a fresh index without it is built instead.
+    """
+    from storage import list_tables
+
+    skipped = {f.stem for f in list_tables(labeled_dir)} & set(skip)
+    return KNNIndex.load(path) if Path(path).is_file() and not skipped else build(labeled_dir, skip)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Nearest-neighbour index over labeled transactions.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="index labeled/ and save it")
+    b.add_argument("--data-dir", default=LABELED_DIR)
+    b.add_argument("--out", default=INDEX_PATH)
+    q = sub.add_parser("query", help="show the labeled rows nearest to descriptions")
+    q.add_argument("descriptions", nargs="+")
+    q.add_argument("-k", type=int, default=K)
+    q.add_argument("--index", default=INDEX_PATH)
+    args = ap.parse_args()
+
+    if args.command == "build":
+        index = build(args.data_dir)
+        path = index.save(args.out)
+        print(f"Indexed {len(index)} rows, {len(index.terms)} n-grams -> {path} ({path.stat().st_size / 1024:.0f} KiB)")
+        return
+    index = KNNIndex.load(args.index)
+    for description in args.descriptions:
+        label, sim = index.predict([description], args.k)
+        print(f"{description}\n  -> {label[0]} (similarity {sim[0]:.2f})")
+        for row, s in zip(*index.search(description, args.k)):
+            print(f"  {s:.2f}  {index.labels[row]:14s} {index.descriptions[row]}")
+
+
+if __name__ == "__main__":
+    main()
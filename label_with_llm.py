@@ -1,12 +1,228 @@
-import openai
-import pandas
-import np
+"""
+Real-time labeling of cleansed_data/ through the chat completions API, for statements that
+can't wait for the 24h batch window.
+
+Requests use the same model and prompt as batch_generate.py and go through a fixed pool of
+asyncio workers sharing one AsyncOpenAI client (one connection pool). Two token buckets keep
+them under the account's requests-per-minute and tokens-per-minute limits. 429s, timeouts
+and 5xx responses are retried with exponential backoff and full jitter, honouring Retry-After.
+Rows with the same description and amount are sent once and share the answer.
+
+Each answer is appended to llm_gen/openai/<prefix>_<month>.csv as soon as it arrives, in the
+same layout as the other prediction sets (CSV, since it grows a row at a time; convert it with
+storage.py afterwards if needed). Rows whose txn_id is already in that file are skipped, so an
+interrupted run resumes; rows that still fail after all retries are left out and retried next
+time.
+
+Usage:
+  python label_with_llm.py                                  # every table in cleansed_data/
+  python label_with_llm.py cleansed_data/october.csv --rpm 500 --concurrency 32
+  python label_with_llm.py --mock                           # against batch_mock_server.py
+"""
+
+import argparse
+import asyncio
+import csv
+import random
+import time
 from pathlib import Path
 
+import numpy as np
+
+from batch_generate import DATA_DIR, build_request, estimate_tokens
+from compute_accuracy import LABEL_ALIASES
+import metrics
+from llm_infra import parse_label
+from storage import ID_COL, csv_ready, iter_chunks, list_tables, read_table
+
+OUT_DIR = Path("llm_gen/openai")
+# description and amount last: they are what the worker sends
+COLUMNS = [ID_COL, "date", "description", "amount"]
+
+
+class TokenBucket:
+    """Allows `rate` units per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, n=1):
+        n = min(n, self.capacity)
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # single event loop: nothing can run between this check and the decrement
+            if self.tokens >= n:
+                self.tokens -= n
+                return
+            await asyncio.sleep((n - self.tokens) / self.rate)
+
+
+class RealtimeLabeler:
+    def __init__(self, client, rpm=500, tpm=200_000, max_retries=6, backoff_base=0.5, backoff_max=30.0):
+        self.client = client
+        self.requests = TokenBucket(rpm / 60, max(1, rpm / 60))
+        self.tokens = TokenBucket(tpm / 60, max(1, tpm / 60))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.answers = {}     # (description, amount) -> Future with the label
+        self.latencies = []   # seconds per successful API call
+        self.sent = 0
+        self.retries = 0
+        self.deduplicated = 0
+
+    async def label(self, description, amount):
+        key = (str(description), str(amount))
+        fut = self.answers.get(key)
+        if fut is not None:
+            self.deduplicated += 1
+            metrics.count("llm_api.deduplicated")
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self.answers[key] = fut
+        try:
+            fut.set_result(await self._request(*key))
+        except Exception as e:
+            # let a later duplicate try again rather than inherit the failure
+            del self.answers[key]
+            fut.set_exception(e)
+            fut.exception()
+            raise
+        return fut.result()
+
+    async def _request(self, description, amount):
+        from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+        body = build_request(None, description, amount)["body"]
+        # rough request size for the tokens-per-minute bucket
+        est_tokens = estimate_tokens(body) + body.get("max_tokens", 0)
+        for attempt in range(self.max_retries + 1):
+            await self.requests.acquire()
+            await self.tokens.acquire(est_tokens)
+            t0 = time.perf_counter()
+            try:
+                self.sent += 1
+                metrics.count("llm_api.calls")
+                with metrics.timer("llm_api.request"):
+                    resp = await self.client.chat.completions.create(**body)
+            except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                metrics.count("llm_api.retries")
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                await asyncio.sleep(delay)
+                continue
+            self.latencies.append(time.perf_counter() - t0)
+            label = parse_label(resp.choices[0].message.content or "")
+            return LABEL_ALIASES.get(label, label)
+
+    def stats(self, rows, seconds):
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return (f"{rows} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):.1f} rows/s), "
+                f"{self.sent} API calls ({self.retries} retries), {self.deduplicated} deduplicated, "
+                f"latency p50 {np.percentile(lat, 50):.0f}ms p99 {np.percentile(lat, 99):.0f}ms")
+
+
+async def label_file(labeler, src, dst, concurrency, chunksize=10_000):
+    """Label every row of src not already in dst, appending each answer to dst as it arrives."""
+    done = set()
+    resuming = dst.is_file() and dst.stat().st_size > 0
+    if resuming:
+        done = set(read_table(dst, columns=[ID_COL])[ID_COL].tolist())
+    queue = asyncio.Queue(maxsize=concurrency * 4)
+    written = failed = 0
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    with open(dst, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+
+        async def worker():
+            nonlocal written, failed
+            while (item := await queue.get()) is not None:
+                try:
+                    label = await labeler.label(*item[-2:])
+                except Exception as e:
+                    failed += 1
+                    print(f"[WARN] {src.name} row {item[0]}: {e!r}")
+                else:
+                    writer.writerow(list(item) + [label])
+                    f.flush()
+                    written += 1
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            if not resuming:
+                writer.writerow(COLUMNS + ["label"])
+            for chunk in iter_chunks(src, columns=COLUMNS, chunksize=chunksize):
+                chunk = chunk[~chunk[ID_COL].isin(done)]
+                for item in csv_ready(chunk).itertuples(index=False, name=None):
+                    await queue.put(item)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+    return written, failed
+
+
+async def run(files, args):
+    from openai import AsyncOpenAI
+
+    # retries are ours (with the rate limiter in the loop), not the client's
+    client = AsyncOpenAI(api_key=args.api_key, base_url=args.base_url, max_retries=0, timeout=args.timeout)
+    labeler = RealtimeLabeler(client, args.rpm, args.tpm, args.max_retries)
+    t0 = time.perf_counter()
+    rows = failed = 0
+    try:
+        for src in files:
+            written, n_failed = await label_file(labeler, src, Path(args.out_dir) / f"{args.prefix}_{src.stem}.csv",
+                                                 args.concurrency)
+            rows += written
+            failed += n_failed
+            print(f"{src.name}: {written} labeled, {n_failed} failed")
+    finally:
+        await client.close()
+    print(labeler.stats(rows, time.perf_counter() - t0))
+    return labeler, failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Label cleansed tables in real time with the chat completions API.")
+    ap.add_argument("inputs", nargs="*", help="table files (default: every table in cleansed_data/)")
+    ap.add_argument("--out-dir", default=OUT_DIR)
+    ap.add_argument("--prefix", default="gpt5_nano_rt")
+    ap.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    ap.add_argument("--rpm", type=float, default=500, help="requests per minute")
+    ap.add_argument("--tpm", type=float, default=200_000, help="prompt + completion tokens per minute")
+    ap.add_argument("--max-retries", type=int, default=6)
+    ap.add_argument("--timeout", type=float, default=60.0, help="seconds per API call")
+    ap.add_argument("--base-url", default=None, help="API base URL (default: OPENAI_BASE_URL or api.openai.com)")
+    ap.add_argument("--mock", action="store_true", help="run against an in-process batch_mock_server")
+    args = ap.parse_args()
+
+    args.api_key = None
+    if args.mock:
+        import batch_mock_server
+
+        server, args.base_url = batch_mock_server.start(latency=0.05, rate_limit_rate=0.02)
+        args.api_key = "mock"
+    else:
+        from dotenv import load_dotenv
 
-DATA_DIR = Path("cleansed_data")
-data_list = list(DATA_DIR.rglob("*.csv"))
+        load_dotenv()
+    files = [Path(p) for p in args.inputs] or list_tables(DATA_DIR)
+    _, failed = asyncio.run(run(files, args))
+    if failed:
+        raise SystemExit(1)
 
-label_enums = {'1':'grocery','2':'dining','3':'travel','4':'shopping','5':'subscriptions','6':'utilities','7':'health','8':'entertainment','9':'other'}
 
-client = OpenAI()
+if __name__ == "__main__":
+    main()
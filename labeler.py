@@ -1,9 +1,50 @@
-import pandas as pd
+"""
+Hand-label cleansed transactions, the ones the model is least sure about first.
+
+A Naive Bayes model on hashed features (nb_classify.make_hashing_vectorizer, so it can keep
+learning) is trained on labeled/ when the session starts. Raw NB probabilities are far too sure
+of themselves, so confidence is softmax(joint log-likelihood / T), with T fitted on labeled/
+by leaving one table out at a time. Then, for every table in cleansed_data/ without a
+finished table in labeled/:
+  - rows the model labels with at least --auto-accept confidence are accepted without asking
+  - of the rest, the least confident row is asked next (confidence in 0.01 steps; ties go to
+    the merchant with the most rows in the file, whose answer teaches the model the most)
+  - every answer is appended to labeled/<month>.csv.progress.jsonl at once, fed to the model
+    with partial_fit, and the remaining rows are scored again before the next question
+
+Enter accepts the model's guess; q, Ctrl-C or Ctrl-D stops, and the next session resumes
+from the log. Everything that reads labeled/ takes its rows as gold, so only the rows labeled by
+hand go to labeled/<month>.csv; auto-accepted rows go to labeled/auto/<month>.csv (label_source
+"auto") until someone has checked them and moved them over. bench_labeler.py replays labeled/ to
+show the keystrokes saved.
+
+Usage:
+  python labeler.py                          # auto-accepts predictions >= 0.95
+  python labeler.py --auto-accept 0.99
+  python labeler.py --no-auto-accept         # ask about every row, most uncertain first
+"""
+
+import argparse
 from pathlib import Path
 
+import numpy as np
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import make_pipeline
+
+from checkpoint import LabelCheckpoint
+from merchant_cache import merchant_keys
+from nb_classify import make_hashing_vectorizer
+from storage import ID_COL, find_table, list_tables, read_table, table_path, write_table
+
 DATA_DIR = Path("cleansed_data")
 OUT_DIR = Path("labeled")
-OUT_DIR.mkdir(exist_ok=True)
+# under OUT_DIR: auto-accepted rows waiting for review, kept out of the gold tables
+AUTO_DIR = "auto"
+AUTO_ACCEPT = 0.95
+# partial_fit recomputes every class x feature weight, so the hash space stays small
+N_FEATURES = 2**15
+# used until labeled/ has two tables to fit it on (what the 2025 statements gave)
+DEFAULT_TEMPERATURE = 5.0
 
 label_enums = {
     '1': 'grocery',
@@ -16,32 +57,171 @@ label_enums = {
     '8': 'entertainment',
     '9': 'other'
 }
+LABELS = sorted(label_enums.values())
+
+
+def fit_temperature(jll, gold):
+    """The temperature T minimizing the NLL of the gold class indices under softmax(jll / T)."""
+    best_t, best_nll = 1.0, np.inf
+    for t in np.exp(np.linspace(np.log(0.5), np.log(50.0), 200)):
+        z = jll / t
+        z = z - z.max(axis=1, keepdims=True)
+        nll = (np.log(np.exp(z).sum(axis=1)) - z[np.arange(len(gold)), gold]).mean()
+        if nll < best_nll:
+            best_t, best_nll = float(t), nll
+    return best_t
+
+
+def train_model(paths):
+    """
+    (pipeline, temperature) for the labeled tables in paths. The pipeline's MultinomialNB
+    keeps learning with partial_fit; it is unfitted when paths hold no labels.
+    """
+    vectorizer = make_hashing_vectorizer(N_FEATURES)
+    clf = MultinomialNB(alpha=0.1, fit_prior=False)
+    frames = [read_table(p, columns=["description", "label"]).dropna(subset=["label"]) for p in paths]
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        return make_pipeline(vectorizer, clf), DEFAULT_TEMPERATURE
+    X = vectorizer.transform(np.concatenate([df["description"].astype(str).to_numpy() for df in frames]))
+    y = np.concatenate([df["label"].astype(str).to_numpy() for df in frames])
+    table = np.repeat(np.arange(len(frames)), [len(df) for df in frames])
+
+    temperature = DEFAULT_TEMPERATURE
+    if len(frames) > 1:
+        jll = np.empty((len(y), len(LABELS)))
+        for i in range(len(frames)):
+            held = table == i
+            fold = MultinomialNB(alpha=0.1, fit_prior=False).partial_fit(X[~held], y[~held], classes=LABELS)
+            jll[held] = fold.predict_joint_log_proba(X[held])
+        temperature = fit_temperature(jll, np.searchsorted(LABELS, y))
+    clf.partial_fit(X, y, classes=LABELS)
+    return make_pipeline(vectorizer, clf), temperature
+
+
+def predict(clf, X, temperature):
+    """(labels, calibrated confidences) for the hashed rows X."""
+    z = clf.predict_joint_log_proba(X) / temperature
+    z = np.exp(z - z.max(axis=1, keepdims=True))
+    best = z.argmax(axis=1)
+    return clf.classes_[best], z[np.arange(len(best)), best] / z.sum(axis=1)
 
-for file in DATA_DIR.glob("*.csv"):
-    save_path = OUT_DIR / file.name
-    if Path(save_path).is_file():
-        print(f"{save_path} already exists, skipping...")
-        continue
-    print(f"Labeling the file :   {file}")
-    data = pd.read_csv(file)
-
-    for idx, row in data.iterrows():
-        while True:
-            label = input(
+
+def ask_user(row, guess, confidence):
+    """Prompt until the answer is a label; None when the user stops."""
+    hint = f"  [enter] {guess} ({confidence:.0%} sure)\n" if guess is not None else ""
+    while True:
+        try:
+            answer = input(
                 f"Label this data :\n"
                 f"  {row['description']}, {row['amount']}\n"
                 f"Labels:\n"
                 f"  1. Grocery, 2. Dining, 3. Travel, 4. Shopping,\n"
                 f"  5. Subscriptions, 6. Utilities, 7. Health,\n"
-                f"  8. Entertainment, 9. Other\n> "
-            )
-
-            if label in label_enums:
-                data.loc[idx, "label"] = label_enums[label]
-                break
-            else:
-                print("Invalid label, try again.")
-
-    save_path = OUT_DIR / file.name
-    data.to_csv(save_path, index=False)
-    print(f"{file} is labeled and saved in : {save_path}")
+                f"  8. Entertainment, 9. Other, q. Quit\n{hint}> "
+            ).strip().lower()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return None
+        if answer == "q":
+            return None
+        if answer == "" and guess is not None:
+            return guess
+        if answer in label_enums:
+            return label_enums[answer]
+        print("Invalid label, try again.")
+
+
+def label_file(model, temperature, data, ckpt, ask=ask_user, auto_accept=AUTO_ACCEPT):
+    """
+    Label data's rows, resuming from ckpt and appending every new label to it. model (from
+    train_model) learns from each answer. Returns {row: record}, short of len(data) rows if
+    ask() returned None.
+    """
+    vectorizer, clf = model[0], model[-1]
+    done = ckpt.load(data[ID_COL])
+    if ckpt.stale:
+        print(f"[WARN] {ckpt.stale} saved labels in {ckpt.path} match no transaction in the table, ignoring them")
+    # the vectorizer is stateless, so every row is hashed once and only re-scored after answers
+    X = vectorizer.transform(data["description"].astype(str))
+    hand = [row for row, rec in done.items() if rec.get("source") == "hand"]
+    if hand:
+        clf.partial_fit(X[hand], [done[row]["label"] for row in hand], classes=LABELS)
+    merchants = data["merchant"] if "merchant" in data.columns else merchant_keys(data["description"])
+    frequency = merchants.map(merchants.value_counts()).to_numpy()
+
+    while True:
+        todo = np.array([row for row in range(len(data)) if row not in done], dtype=int)
+        if not len(todo):
+            return done
+        if hasattr(clf, "classes_"):
+            guesses, conf = predict(clf, X[todo], temperature)
+        else:
+            guesses, conf = np.full(len(todo), None, dtype=object), np.zeros(len(todo))
+
+        if auto_accept is not None:
+            accept = conf >= auto_accept
+            records = [{"row": int(row), "label": str(label), "confidence": round(float(c), 4), "source": "auto"}
+                       for row, label, c in zip(todo[accept], guesses[accept], conf[accept])]
+            if records:
+                ckpt.append(records)
+                done.update((rec["row"], {k: v for k, v in rec.items() if k != "row"}) for rec in records)
+                todo, guesses, conf = todo[~accept], guesses[~accept], conf[~accept]
+                if not len(todo):
+                    return done
+
+        nxt = np.lexsort((-frequency[todo], np.round(conf, 2)))[0]
+        row = int(todo[nxt])
+        label = ask(data.iloc[row], guesses[nxt], float(conf[nxt]))
+        if label is None:
+            return done
+        done[row] = {"label": label, "source": "hand"}
+        ckpt.append([{"row": row, **done[row]}])
+        clf.partial_fit(X[[row]], [label], classes=LABELS)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Hand-label cleansed transactions, most uncertain first.")
+    ap.add_argument("--data-dir", default=DATA_DIR)
+    ap.add_argument("--out-dir", default=OUT_DIR)
+    ap.add_argument("--auto-accept", type=float, default=AUTO_ACCEPT,
+                    help="accept model labels at least this confident without asking")
+    ap.add_argument("--no-auto-accept", action="store_true", help="ask about every row")
+    args = ap.parse_args()
+    if not 0 < args.auto_accept <= 1:
+        ap.error("--auto-accept must be in (0, 1]")
+    auto_accept = None if args.no_auto_accept else args.auto_accept
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(exist_ok=True)
+    model, temperature = train_model(list_tables(out_dir))
+    print(f"model trained on {out_dir}, confidence temperature {temperature:.2f}")
+    for file in list_tables(args.data_dir):
+        # hand labels stay CSV so they can be reviewed and diffed
+        ckpt = LabelCheckpoint(table_path(out_dir, file.stem, "csv"))
+        existing = find_table(out_dir, file.stem)
+        if existing is not None and not ckpt.path.exists():
+            print(f"{existing} already exists, skipping...")
+            continue
+        print(f"Labeling the file :   {file}")
+        data = read_table(file)
+        done = label_file(model, temperature, data, ckpt, auto_accept=auto_accept)
+        if len(done) < len(data):
+            ckpt.close()
+            print(f"Stopped with {len(done)}/{len(data)} rows of {file} labeled, progress saved in : {ckpt.path}")
+            return
+
+        data["label"] = [done[row]["label"] for row in range(len(data))]
+        data["label_source"] = [done[row].get("source", "hand") for row in range(len(data))]
+        auto = data["label_source"] == "auto"
+        auto_path = table_path(out_dir / AUTO_DIR, file.stem, "csv")
+        if auto.any():
+            write_table(data[auto], auto_path)
+        ckpt.finalize(data[~auto])
+        print(f"{file} is labeled and saved in : {ckpt.save_path} ({int((~auto).sum())} by hand)")
+        if auto.any():
+            print(f"  {int(auto.sum())} auto-accepted rows to review in : {auto_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,71 @@
-from transformers import pipeline
-import torch
-import pandas as pd
-pipe = pipeline("text-generation", model="google/gemma-3-4b-it", device="mps", torch_dtype=torch.bfloat16)
+"""
+Label cleansed transactions with a local LLM.
+
+Usage:
+  python llm_infra.py                                        # gemma-3-4b-it on cuda, mps or cpu
+  python llm_infra.py --model google/gemma-3-1b-it --out-prefix gemma_1b
+  python llm_infra.py --backend vllm --batch-size 64         # vllm, automatic prefix caching
+  python llm_infra.py --mode score --calibrate                # fit the confidence temperature on labeled/
+  python llm_infra.py --mode score                            # one forward pass per row, adds a confidence column
+  python llm_infra.py --no-merchant-cache                     # send every row to the model
+  python llm_infra.py --cascade-threshold 0.6                 # Naive Bayes labels rows it is >= 60% sure of
+  python llm_infra.py --few-shot 0                            # one fixed example instead of similar rows
+
+Labels are appended to <output>.progress.jsonl as each batch finishes, and the output table
+(Parquet by default, --format csv for CSV; see storage.py) is written once when a file is
+complete. Re-running after an interruption resumes from the log; files whose output already
+exists are skipped unless --overwrite is given.
+
+Rows are labeled in batches. The system message and category instructions are the same for
+every row, so they form a fixed prompt prefix that is encoded once (transformers backend) or
+picked up by vllm's automatic prefix caching; only the short per-row tail is new work.
+Decoding is constrained to the category names, so every answer is a valid label.
+With --few-shot K (3 by default), the fixed example is replaced by the K labeled rows most
+similar to each transaction (knn_index.py). Those differ per row, so they go in the per-row tail
+after the shared prefix; --few-shot 0 gives the old single-example prompt exactly.
+Rows whose merchant is already in the merchant label cache (see merchant_cache.py; its gold
+labels leave out the labeled/ tables of the months being labeled) never reach the model. With --cascade-threshold, rows whose nearest labeled rows (knn_index.py) are at
+least knn_index.KNN_THRESHOLD similar take their label next (label_source "knn"), then the
+Naive Bayes model from nb_classify.py (trained on labeled/) keeps every row whose
+predict_proba reaches the threshold; see cascade.py for choosing it. The output's label_source
+column says which rows came from where.
+
+--mode score (transformers backend) skips generation altogether: a single forward pass gives
+the next-token log-probs of the 9 category names, the argmax is the label, and a softmax over
+those 9 logits, divided by a temperature fitted on labeled/ with --calibrate, is the confidence.
+"""
+
+import argparse
+import copy
+import json
+import math
 import re
+import time
 from pathlib import Path
 
+import pandas as pd
+
+import metrics
+from checkpoint import LabelCheckpoint
+from merchant_cache import MerchantLabelCache
+from storage import DEFAULT_FORMAT, FORMATS, ID_COL, list_tables, read_table
+
 DATA_DIR = Path("cleansed_data")
-data_list = list(DATA_DIR.rglob("*.csv"))
+LABELED_DIR = Path("labeled")
 OUT_DIR = Path("llm_gen/gemma")
-OUT_DIR.mkdir(exist_ok=True)
+# per-model softmax temperature for --mode score, written by --calibrate
+CALIBRATION_PATH = Path("llm_gen/calibration.json")
+
+label_enums = {'1':'grocery','2':'dining','3':'travel','4':'shopping','5':'subscriptions','6':'utilities','7':'health','8':'entertainment','9':'other'}
+# what the model is allowed to answer, in the capitalized form the prompt example uses
+LABEL_NAMES = list(label_enums.values())
+LABEL_CHOICES = [name.capitalize() for name in LABEL_NAMES]
+
+system_prompt = "You are a an excellent data labeler. Your task is to label whatever string user sends."
 
-prompt = """
+# Everything before the row data is identical for every request; keep it first so its
+# KV cache can be shared.
+prompt_head = """
 Following text, with an amount of expense is from a bank statement document.
 You are tasked to label this text into following 9 categories:
     1.Grocery
@@ -24,69 +79,432 @@ You are tasked to label this text into following 9 categories:
     9.Other
 
 If you are absolutely uncertain on which one to put one label in, put to 9.
-You must always give a guess. Here is an example:
+You must always give a guess. ONLY RETURN THE LABEL, NOTHING ELSE. """
+example_prompt = """
+    DESCRIPTION: {description}
+    AMOUNT: 	{amount}
+    Label: {label}
+"""
+# the example every prompt had before --few-shot, and still has with --few-shot 0
+STATIC_EXAMPLES = [("HANGAR PUB WINGS AMHER10 UNIVERSITY DR AMHERST 01002 MA USA 1%", 50.44, "dining")]
+data_intro = """
+Here is data to be labeled:
+"""
+row_prompt = """
+    DESCRIPTION: {description}
+    AMOUNT : {amount}
+    Label:
+"""
 
-    DESCRIPTION: HANGAR PUB WINGS AMHER10 UNIVERSITY DR AMHERST 01002 MA USA 1%
-    AMOUNT: 	50.44
-    Label: Dining
 
-Here is data to be labeled: 
+def format_examples(examples):
+    """The examples part of a prompt, for (description, amount, label) rows."""
+    head = "Here is an example:\n" if len(examples) == 1 else "Here are similar transactions that are already labeled:\n"
+    return head + "".join(example_prompt.format(description=d, amount="" if a is None else a, label=label.capitalize())
+                          for d, a, label in examples)
 
-    DESCRIPTION: {description}
-    AMOUNT : {amount}
-    Label: 
 
-ONLY RETURN THE LABEL, NOTHING ELSE
+prompt_prefix = prompt_head + format_examples(STATIC_EXAMPLES) + data_intro
+prompt = prompt_prefix + row_prompt
 
-"""
 
-for file in data_list:
-    data = pd.read_csv(file)
-    print(f"data is being labeled: {file}")
-    for idx, row in data.iterrows():
-        messages = [
-            [
-                {
-                    "role": "system",
-                    "content": [{"type": "text", "text": "You are a an excellent data labeler. Your task is to label whatever string user sends."},]
-                },
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt.format(description=row['description'],amount=row['amount'])},]
-                },
-            ],
-        ]
-
-        output = pipe(messages, max_new_tokens=50)
-        out = output[0][0]["generated_text"][2]["content"]
-        # print(out)
-        data.loc[idx, "label"] = re.sub(r'[^\w\s]','',out.lower())
-        save_path = OUT_DIR / ("gemma_4b_" + file.name)
-        data.to_csv(save_path, index=False)
+def row_text(description, amount, examples=None):
+    """
+    The user message after the shared prefix. examples (from knn_index.KNNIndex.examples) differ
+    from row to row, so with them the prefix is prompt_head only and they open the row's part;
+    None keeps STATIC_EXAMPLES in prompt_prefix.
+    """
+    text = row_prompt.format(description=description, amount=amount)
+    if examples is None:
+        return text
+    return format_examples(examples or STATIC_EXAMPLES) + data_intro + text
 
-"""
-    [
-        {'generated_text': 
-            [
-                {'role': 'system', 
-                'content': 
-                    [
-                        {'type': 'text', 
-                        'text': 'You are a an excellent data labeler. Your task is to label whatever string user sends.'}
-                    ]
-                }, 
-                {'role': 'user', 
-                'content': 
-                    [   
-                        {'type': 'text', 
-                        'text': '\nFollowing text, with an amount of expense is from a bank statement document.\nYou are tasked to label this text into following 9 categories:\n    1.Grocery\n    2.Dining\n    3.Travel\n    4.Shopping\n    5.Subscription\n    6.Utilites\n    7.Health\n    8.Entertainment\n    9.Other\n\nIf you are absolutely uncertain on which one to put one label in, put to 9.\nYou must always give a guess. Here is an example:\n\n    DESCRIPTION: HANGAR PUB WINGS AMHER10 UNIVERSITY DR AMHERST 01002 MA USA 1%\n    AMOUNT: \t50.44\n    Label: Dining\n\nHere is data to be labeled: \n\n    DESCRIPTION: Previous Monthly Balance\n    AMOUNT : 0.0\n    Label: \n\nONLY RETURN THE LABEL, NOTHING ELSE\n\n'
-                        }
-                    ]   
-                }, 
-                {'role': 'assistant', 
-                'content': 'Label: Utilities'
-                }
-            ]
-        }
+
+def build_messages(description, amount, examples=None):
+    prefix = prompt_prefix if examples is None else prompt_head
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prefix + row_text(description, amount, examples)},
     ]
-"""
+
+
+def parse_label(out):
+    label = re.sub(r'[^\w\s]', '', out.lower()).strip()
+    # models sometimes echo the prompt's "Label:" back
+    return re.sub(r'^label\s*', '', label)
+
+
+class TransformersLabeler:
+    """
+    Batched greedy labeling with a Hugging Face causal LM.
+    The chat-templated prompt prefix is run through the model once; every batch starts from a
+    copy of that KV cache, so only the per-row tail is encoded. Generation is restricted to
+    the token sequences of LABEL_CHOICES and stops after the longest one.
+    score_batch() instead reads the label straight off one forward pass, which needs the
+    category names to start with distinct tokens (true for gemma's tokenizer).
+    With few_shot, rows carry their own examples, which leave the shared prefix for the tail.
+    """
+
+    def __init__(self, model_name, device, dtype="bfloat16", few_shot=False):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        self.device = device
+        self.tok = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name, dtype=getattr(torch, dtype))
+        self.model.to(device).eval()
+        self.pad_id = self.tok.pad_token_id if self.tok.pad_token_id is not None else self.tok.eos_token_id
+
+        # Render the chat template once around a placeholder to find the shared prefix text.
+        sentinel = "\x00ROW\x00"
+        rendered = self.tok.apply_chat_template(
+            [{"role": "system", "content": system_prompt},
+             {"role": "user", "content": (prompt_head if few_shot else prompt_prefix) + sentinel}],
+            tokenize=False, add_generation_prompt=True,
+        )
+        prefix_text, self.suffix_tail = rendered.split(sentinel)
+        self.prefix_ids = self.tok(prefix_text, add_special_tokens=False, return_tensors="pt").input_ids.to(device)
+        with torch.no_grad():
+            self.prefix_cache = self.model(self.prefix_ids, use_cache=True).past_key_values
+
+        # token trie of the allowed answers, each terminated by eos
+        self.label_trie = {}
+        depth = 0
+        for choice in LABEL_CHOICES:
+            ids = self.tok(choice, add_special_tokens=False).input_ids + [self.tok.eos_token_id]
+            depth = max(depth, len(ids))
+            node = self.label_trie
+            for t in ids:
+                node = node.setdefault(t, {})
+        self.max_new_tokens = depth
+        first = [self.tok(choice, add_special_tokens=False).input_ids[0] for choice in LABEL_CHOICES]
+        self.label_first_tokens = first if len(set(first)) == len(first) else None
+
+    def _allowed_tokens(self, prompt_len):
+        def allowed(batch_id, input_ids):
+            node = self.label_trie
+            for t in input_ids[prompt_len:].tolist():
+                node = node.get(t)
+                if not node:
+                    return [self.tok.eos_token_id]
+            return list(node)
+        return allowed
+
+    def _batch_inputs(self, rows):
+        """Token ids, attention mask and a batch-sized copy of the prefix cache for rows."""
+        torch = self.torch
+        tails = [self.tok(row_text(*row) + self.suffix_tail, add_special_tokens=False).input_ids for row in rows]
+        n_prefix = self.prefix_ids.shape[1]
+        width = max(len(t) for t in tails)
+        # [prefix][pads][tail]: pads sit between the cached prefix and each row's tail and are
+        # masked out; generation continues right after every tail.
+        input_ids = torch.full((len(rows), n_prefix + width), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        input_ids[:, :n_prefix] = self.prefix_ids[0].cpu()
+        attention_mask[:, :n_prefix] = 1
+        for i, t in enumerate(tails):
+            input_ids[i, n_prefix + width - len(t):] = torch.tensor(t)
+            attention_mask[i, n_prefix + width - len(t):] = 1
+
+        cache = copy.deepcopy(self.prefix_cache)
+        cache.batch_repeat_interleave(len(rows))
+        return input_ids.to(self.device), attention_mask.to(self.device), cache
+
+    def label_batch(self, rows):
+        """rows: list of (description, amount[, few-shot examples]). Returns one label per row."""
+        input_ids, attention_mask, cache = self._batch_inputs(rows)
+        prompt_len = input_ids.shape[1]
+        with self.torch.no_grad():
+            out = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=cache,
+                max_new_tokens=self.max_new_tokens,
+                do_sample=False,
+                prefix_allowed_tokens_fn=self._allowed_tokens(prompt_len),
+                eos_token_id=self.tok.eos_token_id,
+                pad_token_id=self.pad_id,
+            )
+        texts = self.tok.batch_decode(out[:, prompt_len:], skip_special_tokens=True)
+        return [parse_label(t) for t in texts]
+
+    def label_logits(self, rows):
+        """Next-token log-probs of the 9 category names after each row's prompt, shape (rows, 9)."""
+        if self.label_first_tokens is None:
+            raise ValueError("category names share a first token with this tokenizer; use --mode generate")
+        torch = self.torch
+        input_ids, attention_mask, cache = self._batch_inputs(rows)
+        n_prefix = self.prefix_ids.shape[1]
+        # positions have to skip the pads, as generate() would do from the attention mask
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, n_prefix:]
+        with torch.no_grad():
+            logits = self.model(
+                input_ids=input_ids[:, n_prefix:],
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                past_key_values=cache,
+                use_cache=True,
+            ).logits[:, -1, :]
+        logprobs = torch.log_softmax(logits.float(), dim=-1)
+        return logprobs[:, self.label_first_tokens].cpu()
+
+    def score_batch(self, rows, temperature=1.0):
+        """Return (labels, confidences): the argmax category and its softmax probability over the 9."""
+        probs = self.torch.softmax(self.label_logits(rows) / temperature, dim=-1)
+        conf, idx = probs.max(dim=-1)
+        return [LABEL_NAMES[i] for i in idx.tolist()], [round(c, 4) for c in conf.tolist()]
+
+
+class VLLMLabeler:
+    """Batched labeling through vllm, with automatic prefix caching and choice-constrained decoding."""
+
+    def __init__(self, model_name, dtype="bfloat16"):
+        from vllm import LLM, SamplingParams
+
+        self.llm = LLM(model=model_name, dtype=dtype, enable_prefix_caching=True)
+        try:
+            from vllm.sampling_params import StructuredOutputsParams
+            constraint = {"structured_outputs": StructuredOutputsParams(choice=LABEL_CHOICES)}
+        except ImportError:  # vllm < 0.11
+            from vllm.sampling_params import GuidedDecodingParams
+            constraint = {"guided_decoding": GuidedDecodingParams(choice=LABEL_CHOICES)}
+        self.params = SamplingParams(temperature=0.0, max_tokens=8, **constraint)
+
+    def label_batch(self, rows):
+        outs = self.llm.chat([build_messages(*row) for row in rows], self.params, use_tqdm=False)
+        return [parse_label(o.outputs[0].text) for o in outs]
+
+
+def fit_temperature(logits, gold):
+    """The temperature T minimizing the NLL of the gold labels under softmax(logits / T)."""
+    import torch
+
+    best_t, best_nll = 1.0, math.inf
+    lo, hi, steps = math.log(0.05), math.log(20.0), 240
+    for i in range(steps + 1):
+        t = math.exp(lo + (hi - lo) * i / steps)
+        nll = torch.nn.functional.cross_entropy(logits / t, gold).item()
+        if nll < best_nll:
+            best_t, best_nll = t, nll
+    return best_t
+
+
+def calibration_key(model_name, few_shot=0):
+    """Temperatures are per model and prompt: --few-shot prompts get their own."""
+    return model_name if not few_shot else f"{model_name} --few-shot {few_shot}"
+
+
+def load_temperature(key):
+    if CALIBRATION_PATH.is_file():
+        return json.loads(CALIBRATION_PATH.read_text()).get(key, 1.0)
+    return 1.0
+
+
+def calibrate(labeler, key, batch_size, few_shot=0):
+    """
+    Score the hand-labeled rows in labeled/, fit the confidence temperature and store it.
+    With few_shot, a row's examples come from the other months only, as when labeling (see main()).
+    """
+    import torch
+
+    from knn_index import build
+
+    columns = ["description", "amount", "label"]
+    rows, labels = [], []
+    for f in list_tables(LABELED_DIR):
+        gold = read_table(f, columns=columns)
+        gold = gold[gold["label"].isin(LABEL_NAMES)]
+        month = list(zip(gold["description"], gold["amount"]))
+        if few_shot:
+            index = build(LABELED_DIR, skip={f.stem})
+            month = [(d, a, index.examples(d, few_shot)) for d, a in month]
+        rows += month
+        labels += gold["label"].tolist()
+    logits = torch.cat([labeler.label_logits(rows[i:i + batch_size]) for i in range(0, len(rows), batch_size)])
+    target = torch.tensor([LABEL_NAMES.index(label) for label in labels])
+
+    t = fit_temperature(logits, target)
+    acc = (logits.argmax(dim=-1) == target).float().mean().item()
+    temps = json.loads(CALIBRATION_PATH.read_text()) if CALIBRATION_PATH.is_file() else {}
+    temps[key] = t
+    CALIBRATION_PATH.parent.mkdir(parents=True, exist_ok=True)
+    CALIBRATION_PATH.write_text(json.dumps(temps, indent=2))
+    print(f"{len(rows)} labeled rows: accuracy {acc:.4f}, temperature {t:.3f} saved to {CALIBRATION_PATH}")
+
+
+def pick_device(device="auto", dtype="auto"):
+    """Resolve "auto": cuda, then mps, then cpu; bfloat16 on an accelerator, float32 on cpu."""
+    if device == "auto":
+        import torch
+
+        if torch.cuda.is_available():
+            device = "cuda"
+        elif torch.backends.mps.is_available():
+            device = "mps"
+        else:
+            device = "cpu"
+    if dtype == "auto":
+        dtype = "float32" if device == "cpu" else "bfloat16"
+    return device, dtype
+
+
+def make_labeler(args):
+    if args.backend == "vllm":
+        return VLLMLabeler(args.model, dtype="bfloat16" if args.dtype == "auto" else args.dtype)
+    device, dtype = pick_device(args.device, args.dtype)
+    print(f"{args.model} on {device} ({dtype})")
+    return TransformersLabeler(args.model, device, dtype=dtype, few_shot=args.few_shot > 0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Label cleansed transactions with a local LLM.")
+    ap.add_argument("--backend", choices=["transformers", "vllm"], default="transformers")
+    ap.add_argument("--model", default="google/gemma-3-4b-it")
+    ap.add_argument("--device", default="auto", help="torch device for the transformers backend (auto: cuda, mps, cpu)")
+    ap.add_argument("--dtype", default="auto", help="auto: bfloat16 on cuda/mps, float32 on cpu")
+    ap.add_argument("--batch-size", type=int, default=16)
+    ap.add_argument("--out-prefix", default="gemma_4b", help="output files are <out-prefix>_<month>.<format>")
+    ap.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT, help="output table format")
+    ap.add_argument("--overwrite", action="store_true", help="relabel files that already have an output table")
+    ap.add_argument("--mode", choices=["generate", "score"], default="generate",
+                    help="score: one forward pass, argmax over the category names plus a confidence")
+    ap.add_argument("--calibrate", action="store_true",
+                    help="with --mode score: fit the confidence temperature on labeled/ and exit")
+    ap.add_argument("--no-merchant-cache", action="store_true",
+                    help="label every row with the model, even merchants seen before")
+    ap.add_argument("--cascade-threshold", type=float, default=None,
+                    help="let Naive Bayes label rows it is at least this confident about (see cascade.py)")
+    ap.add_argument("--few-shot", type=int, default=3,
+                    help="prompt examples: the K most similar labeled rows (knn_index.py); 0: one fixed example")
+    args = ap.parse_args()
+    if args.mode == "score" and args.backend != "transformers":
+        ap.error("--mode score needs the transformers backend")
+    if args.few_shot < 0:
+        ap.error("--few-shot must be at least 0")
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    with metrics.timer("llm.load_model"):
+        labeler = make_labeler(args)
+    key = calibration_key(args.model, args.few_shot)
+    if args.calibrate:
+        calibrate(labeler, key, args.batch_size, args.few_shot)
+        return
+    temperature = load_temperature(key)
+    # the gold labels of the months being labeled must not come back as model answers, so the
+    # merchant cache, the kNN index and the cascade's NB all leave those months out
+    months = {f.stem for f in list_tables(DATA_DIR)}
+    merchants = None if args.no_merchant_cache else MerchantLabelCache(skip=months)
+    index = nb = None
+    if args.few_shot or args.cascade_threshold is not None:
+        from knn_index import load_or_build
+        index = load_or_build(labeled_dir=LABELED_DIR, skip=months)
+    if args.cascade_threshold is not None:
+        from nb_classify import load_labeled, train
+        labeled = load_labeled(LABELED_DIR, skip=months).dropna(subset=["label"])
+        if labeled.empty:
+            print("[WARN] every labeled month is being labeled, so --cascade-threshold has nothing to learn from")
+        else:
+            nb = train(labeled)
+
+    total_rows = 0
+    total_secs = 0.0
+    for file in list_tables(DATA_DIR):
+        save_path = OUT_DIR / f"{args.out_prefix}_{file.stem}.{args.format}"
+        ckpt = LabelCheckpoint(save_path)
+        if args.overwrite:
+            ckpt.path.unlink(missing_ok=True)
+        elif save_path.is_file() and not ckpt.path.exists():
+            print(f"{save_path} already exists, skipping...")
+            continue
+
+        data = read_table(file)
+        done = ckpt.load(data[ID_COL])
+        if ckpt.stale:
+            print(f"[WARN] {ckpt.stale} saved labels in {ckpt.path} match no transaction in {file}, ignoring them")
+        todo = [i for i in range(len(data)) if i not in done]
+        if done:
+            print(f"data is being labeled: {file} (resuming, {len(done)}/{len(data)} rows already labeled)")
+        else:
+            print(f"data is being labeled: {file}")
+
+        t0 = time.perf_counter()
+        if merchants is not None:
+            hits = []
+            for i in todo:
+                label = merchants.get(data["description"].iat[i])
+                if label is not None:
+                    done[i] = {"label": label, "source": "cache"}
+                    hits.append({"row": i, **done[i]})
+            ckpt.append(hits)
+            metrics.count("llm.cache_hits", len(hits))
+            todo = [i for i in todo if i not in done]
+
+        if nb is not None and todo:
+            from knn_index import KNN_THRESHOLD
+            from nb_classify import nb_predict
+            descriptions = data["description"].iloc[todo]
+            with metrics.timer("llm.knn_transfer"):
+                knn_labels, sims = index.predict(descriptions.tolist(), exclude=data[ID_COL].iloc[todo])
+            with metrics.timer("llm.nb_cascade"):
+                nb_labels, nb_conf = nb_predict(nb, descriptions)
+            answered = []
+            for i, knn_label, sim, label, conf in zip(todo, knn_labels, sims, nb_labels, nb_conf):
+                # a neighbour's label goes by similarity; --cascade-threshold is for NB's predict_proba only
+                if sim >= KNN_THRESHOLD:
+                    done[i] = {"label": knn_label, "similarity": round(float(sim), 4), "source": "knn"}
+                elif conf >= args.cascade_threshold:
+                    done[i] = {"label": label, "confidence": round(float(conf), 4), "source": "nb"}
+                else:
+                    continue
+                answered.append({"row": i, **done[i]})
+            ckpt.append(answered)
+            metrics.count("llm.knn_rows", sum(rec["source"] == "knn" for rec in answered))
+            metrics.count("llm.nb_rows", sum(rec["source"] == "nb" for rec in answered))
+            todo = [i for i in todo if i not in done]
+
+        for start in range(0, len(todo), args.batch_size):
+            rows = todo[start:start + args.batch_size]
+            batch = data.iloc[rows]
+            pairs = list(zip(batch["description"], batch["amount"]))
+            if args.few_shot:
+                with metrics.timer("llm.few_shot"):
+                    # labeled/ may hold these very rows: a row is never its own example
+                    pairs = [(d, a, index.examples(d, args.few_shot, exclude=t))
+                             for (d, a), t in zip(pairs, batch[ID_COL])]
+            with metrics.timer(f"llm.model_{args.mode}"):
+                if args.mode == "score":
+                    labels, confidences = labeler.score_batch(pairs, temperature=temperature)
+                else:
+                    labels, confidences = labeler.label_batch(pairs), [None] * len(rows)
+            metrics.count("llm.model_rows", len(rows))
+            records = []
+            for row, (desc, *_), label, conf in zip(rows, pairs, labels, confidences):
+                done[row] = {"label": label, "confidence": conf, "source": "model"}
+                records.append({"row": row, **done[row]})
+                if merchants is not None:
+                    merchants.add(desc, label)
+            ckpt.append(records)
+        secs = time.perf_counter() - t0
+
+        data["label"] = [done[i]["label"] for i in range(len(data))]
+        if args.mode == "score":
+            data["confidence"] = [done[i].get("confidence") for i in range(len(data))]
+        if merchants is not None or nb is not None:
+            data["label_source"] = [done[i].get("source", "model") for i in range(len(data))]
+        if merchants is not None:
+            merchants.save()
+        ckpt.finalize(data)
+        total_rows += len(todo)
+        total_secs += secs
+        if todo:
+            print(f"  {len(todo)} rows through the model in {secs:.1f}s ({len(todo) / secs:.1f} rows/sec)")
+
+    if total_secs:
+        print(f"Labeled {total_rows} rows at {total_rows / total_secs:.1f} rows/sec")
+    if merchants is not None:
+        print(merchants.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,60 @@
-def main():
-    print("Hello from bank-classifier!")
+"""
+bank-classifier: one command for every stage of the pipeline.
+
+  bank-classifier parse data/ data/2025-11.parquet       # parse_pdf.py
+  bank-classifier cleanse                                 # cleanse_data.py
+  bank-classifier label --mode score                      # llm_infra.py, device picked automatically
+  bank-classifier train                                   # nb_classify.py train (--stream: train-stream, an experiment)
+  bank-classifier predict cleansed_data/*.parquet --out-dir nb_gen   # nb_predict.py
+  bank-classifier evaluate                                # compute_accuracy.py
+  bank-classifier --metrics run.json parse ...            # metrics.py report (--profile run.prof)
+
+Every subcommand takes the options of its script (bank-classifier <command> --help), and
+`python main.py ...` works the same without installing. A script is imported only when its
+subcommand runs, so pdfplumber, pandas, scikit-learn, torch, transformers and openai load
+only where they are needed: the top-level --help and predict's start well under 100 ms
+(see bench_startup.py).
+"""
+
+import argparse
+import importlib
+import sys
+
+# command -> (module whose main() runs it, arguments put in front, help)
+COMMANDS = {
+    "parse": ("parse_pdf", [], "parse statement PDFs into a transaction table"),
+    "cleanse": ("cleanse_data", [], "cleanse parsed tables into cleansed_data/"),
+    "label": ("llm_infra", [], "label cleansed transactions with a local LLM"),
+    "train": ("nb_classify", ["train"], "train the Naive Bayes model (--stream: out-of-core experiment, not used by predict)"),
+    "predict": ("nb_predict", [], "classify transactions with the saved Naive Bayes model"),
+    "evaluate": ("compute_accuracy", [], "score every prediction set against labeled/"),
+}
+
+
+def run(command, args):
+    """Run a subcommand's script with args as its command line."""
+    module, prefix, _ = COMMANDS[command]
+    if command == "train" and "--stream" in args:
+        prefix = ["train-stream"]
+        args = [a for a in args if a != "--stream"]
+    sys.argv = ["bank-classifier" if prefix else f"bank-classifier {command}", *prefix, *args]
+    return importlib.import_module(module).main()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="bank-classifier", description="Parse, label and classify card statements.")
+    ap.add_argument("--metrics", default=None, metavar="PATH", help="write a metrics.py JSON report here")
+    ap.add_argument("--profile", default=None, metavar="PATH", help="profile the run (.prof: cProfile, .html: pyinstrument)")
+    sub = ap.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (_, _, help) in COMMANDS.items():
+        # options after the command belong to the script, which parses (and documents) them itself
+        sub.add_parser(name, help=help, add_help=False)
+    args, rest = ap.parse_known_args(argv)
+    if args.metrics or args.profile:
+        import metrics
+
+        metrics.enable(args.metrics, args.profile)
+    return run(args.command, rest)
 
 
 if __name__ == "__main__":
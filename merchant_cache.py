@@ -0,0 +1,102 @@
+"""
+Merchant-keyed label cache, so repeat merchants never reach the LLM.
+
+merchant_key() (merchant_rules.py) reduces a statement description to the merchant name by
+dropping dates, the Apple Card "1%/2%/3%" Daily Cash suffix, store numbers, street addresses
+and zip codes:
+
+    "TEXAS ROADHOUSE #2507 280 RUSSELL STREET HADLEY 01035 MA USA 2%"  -> "TEXAS ROADHOUSE"
+    "SQ *SHARE 178 North Pleasant Amherst 01002 MA USA 1%"              -> "SQ *SHARE"
+
+merchant_keys() does the same for a whole column at once.
+
+MerchantLabelCache maps those keys to labels and is persisted as JSON. Labels from the hand
+labeled files in labeled/ ("gold", majority vote per merchant) always win over labels learned
+from model output ("llm"), and are refreshed from labeled/ on every load. A labeled table of a
+month that is itself being labeled is left out of that seed (skip=): otherwise its gold labels
+come straight back as "model" output and get scored as such.
+"""
+
+import json
+import os
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from merchant_rules import GLUED_NUMBER_PAT, LEADING_NUMBERS_PAT, NAME_END_PAT, PUNCT_RE, merchant_key
+from storage import clean_descriptions, list_tables, read_table
+
+CACHE_PATH = Path("merchant_labels.json")
+
+
+def merchant_keys(descriptions, clean=False):
+    """
+    merchant_key() for a whole Series at once with vectorized string operations. Pass
+    clean=True when the descriptions already went through storage.clean_descriptions().
+    """
+    s = descriptions if clean else clean_descriptions(descriptions)
+    s = s.str.replace(GLUED_NUMBER_PAT, r"\1 \2", regex=True)
+    s = s.str.replace(LEADING_NUMBERS_PAT, "", regex=True).str.replace(NAME_END_PAT, "", regex=True)
+    return s.str.replace(PUNCT_RE.pattern, "", regex=True).str.strip(" -.")
+
+
+class MerchantLabelCache:
+    def __init__(self, path=CACHE_PATH, labeled_dir=Path("labeled"), skip=()):
+        self.path = Path(path)
+        self.entries = {}
+        self.hits = 0
+        self.lookups = 0
+        if self.path.is_file():
+            # gold entries are seeded afresh below, without the skipped tables
+            entries = json.loads(self.path.read_text(encoding="utf-8"))
+            self.entries = {k: v for k, v in entries.items() if v["source"] != "gold"}
+        if labeled_dir is not None:
+            self.seed_from_labeled(labeled_dir, skip)
+
+    def seed_from_labeled(self, labeled_dir, skip=()):
+        """
+        (Re)load gold labels from hand-labeled tables, majority label per merchant, leaving out
+        the tables whose stem (month) is in skip.
+        """
+        votes = defaultdict(Counter)
+        skip = set(skip)
+        for f in list_tables(labeled_dir):
+            if f.stem in skip:
+                continue
+            df = read_table(f, columns=["description", "label"]).dropna()
+            for desc, label in zip(df["description"], df["label"]):
+                key = merchant_key(desc)
+                if key:
+                    votes[key][label] += 1
+        for key, counts in votes.items():
+            label, n = counts.most_common(1)[0]
+            self.entries[key] = {"label": label, "source": "gold", "n": n}
+
+    def get(self, description):
+        """Cached label for this description's merchant, or None."""
+        self.lookups += 1
+        entry = self.entries.get(merchant_key(description))
+        if entry is None:
+            return None
+        self.hits += 1
+        return entry["label"]
+
+    def add(self, description, label):
+        """Remember a model label for this merchant (never overrides a gold label)."""
+        key = merchant_key(description)
+        if not key or not label:
+            return
+        entry = self.entries.get(key)
+        if entry is None or (entry["source"] == "llm" and entry["label"] != label):
+            self.entries[key] = {"label": label, "source": "llm", "n": 1}
+        elif entry["source"] == "llm":
+            entry["n"] += 1
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.entries, indent=1, sort_keys=True, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        rate = self.hits / self.lookups if self.lookups else 0.0
+        return (f"merchant cache: {self.hits}/{self.lookups} hits ({rate:.1%}), "
+                f"{self.hits} model calls saved, {len(self.entries)} merchants")
@@ -0,0 +1,44 @@
+"""
+The rules that reduce a statement description to its merchant name, with no pandas import.
+
+merchant_key() drops dates, the Apple Card "1%/2%/3%" Daily Cash suffix, store numbers,
+street addresses and zip codes:
+
+    "TEXAS ROADHOUSE #2507 280 RUSSELL STREET HADLEY 01035 MA USA 2%"  -> "TEXAS ROADHOUSE"
+    "SQ *SHARE 178 North Pleasant Amherst 01002 MA USA 1%"              -> "SQ *SHARE"
+
+merchant_cache.py keys its labels on it (and applies the same rules column-wide with
+merchant_keys()); knn_index.py, which must load without pandas, compares the names it gives.
+"""
+
+import re
+
+DATE_RE = re.compile(r'\b\d{1,2}[-/]\d{1,2}(?:[-/]\d{2,4})?\b')
+CASHBACK_RE = re.compile(r'\s+\d{1,2}%\s*$')
+# "TOOLS30303", "SIREN47906": a word run straight into its street/store number
+GLUED_NUMBER_RE = re.compile(r'(?<=[A-Z]{3})(?=\d)')
+# ASCII punctuation other than & * ' / + . - (spelled out: RE2's \w would drop accented letters)
+PUNCT_RE = re.compile(r"[!\"#$%(),:;<=>?@\[\\\]^`{|}~]")
+
+# merchant_cache.merchant_keys(): the same rules as column-wide regexes (RE2 syntax, no lookarounds)
+GLUED_NUMBER_PAT = r"([A-Z]{3})(\d)"
+# on single-spaced text: leading store/street numbers, then everything from the first token
+# with a digit or "#" on (no capture groups, so RE2 can use its fast DFA)
+LEADING_NUMBERS_PAT = r"^(?:(?:#|\S*\d)\S*(?: |$))+"
+NAME_END_PAT = r"(?s) (?:#|\S*\d).*$"
+
+
+def merchant_key(description):
+    """Normalize a transaction description to a merchant key (upper case, name part only)."""
+    s = DATE_RE.sub(" ", str(description).upper())
+    s = CASHBACK_RE.sub("", s)
+    s = GLUED_NUMBER_RE.sub(" ", s)
+    words = []
+    for tok in s.split():
+        # the first store number, street number or zip ends the name; leading ones are dropped
+        if tok.startswith("#") or any(c.isdigit() for c in tok):
+            if words:
+                break
+            continue
+        words.append(tok)
+    return PUNCT_RE.sub("", " ".join(words)).strip(" -.")
@@ -0,0 +1,261 @@
+"""
+Timers, counters and peak-memory sampling for the pipeline scripts.
+
+Off unless BANK_METRICS names a report file (BANK_PROFILE alone also turns it on):
+
+    BANK_METRICS=run.json python parse_pdf.py data/ data/2025-11.parquet
+    BANK_METRICS=run.json BANK_PROFILE=run.prof python llm_infra.py --mode score
+    python -m pstats run.prof               # BANK_PROFILE=run.html uses pyinstrument instead
+
+The JSON report is written when the process exits:
+
+    {"argv": [...], "started": <unix time>, "wall_seconds": ..., "peak_rss_mb": ...,
+     "timers": {"parse.pdfplumber": {"calls": .., "seconds": .., "max_seconds": .., "peak_rss_mb": ..}, ...},
+     "counters": {"parse.pages": .., "llm.model_rows": .., ...}}
+
+A timer's seconds add up every call, so timers that run concurrently (asyncio requests) can
+sum to more than the wall time. Its peak_rss_mb is the highest resident set size seen while
+it was open, sampled every SAMPLE_INTERVAL seconds by a background thread (a block shorter
+than that gets the latest sample). Pool workers (parse_pdf.py --workers) record into their own
+copy of the state; a task returns delta(snapshot()) with its result and the parent merge()s it.
+The pool's initializer=init_worker turns metrics on in workers whatever the start method (with
+spawn, the default on macOS, nothing is inherited). Reports and profiles are only ever written
+by the process that turned metrics on, never by a worker.
+
+When disabled, timer() hands back one shared no-op context manager, a @timed function costs
+one attribute check and count() returns at once, so instrumented code runs at full speed.
+"""
+
+import atexit
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+SAMPLE_INTERVAL = 0.05
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_NULL = nullcontext()
+
+
+class _State:
+    enabled = False
+    owner = None     # pid of the process that writes the report
+    started = 0.0
+    timers = {}      # name -> [calls, seconds, max_seconds, peak_rss_bytes]
+    counters = {}
+    active = []      # open timers, whose peaks the sampler raises
+    rss = 0          # latest sample
+    lock = threading.Lock()
+
+
+_state = _State()
+
+
+def _rss_bytes():
+    """Current resident set size (Linux /proc); the process peak where that is unavailable."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return _peak_rss_bytes()
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Timer:
+    __slots__ = ("name", "t0", "peak")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.peak = _state.rss
+        with _state.lock:
+            _state.active.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.t0
+        with _state.lock:
+            _state.active.remove(self)
+            stats = _state.timers.setdefault(self.name, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3] = max(stats[3], self.peak, _state.rss)
+
+
+def timer(name):
+    """Context manager that times its block under name (a no-op while metrics are off)."""
+    return _Timer(name) if _state.enabled else _NULL
+
+
+def timed(name=None):
+    """Decorator: time every call of the function (not for generators, which return at once)."""
+    def decorate(fn):
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with _Timer(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    """Add n to counter name."""
+    if _state.enabled:
+        with _state.lock:
+            _state.counters[name] = _state.counters.get(name, 0) + n
+
+
+def enabled():
+    return _state.enabled
+
+
+def _in_worker():
+    # a multiprocessing child has imported multiprocessing already, so this costs no import
+    mp = sys.modules.get("multiprocessing")
+    return mp is not None and mp.parent_process() is not None
+
+
+def init_worker(on):
+    """ProcessPoolExecutor initializer: record in the worker when the parent does (initargs=(enabled(),))."""
+    if on:
+        enable()
+
+
+def snapshot():
+    """The timers and counters so far, to pass to delta() later (None while metrics are off)."""
+    if not _state.enabled:
+        return None
+    with _state.lock:
+        return {name: list(stats) for name, stats in _state.timers.items()}, dict(_state.counters)
+
+
+def delta(since):
+    """
+    What was timed and counted after snapshot `since`, as (timers, counters) for merge().
+    Calls, seconds and counts are differences; max_seconds and peaks are the current ones.
+    """
+    if since is None:
+        return None
+    timers_before, counters_before = since
+    with _state.lock:
+        timers = {}
+        for name, (calls, seconds, longest, peak) in _state.timers.items():
+            old = timers_before.get(name, [0, 0.0, 0.0, 0])
+            if calls > old[0]:
+                timers[name] = [calls - old[0], seconds - old[1], longest, peak]
+        counters = {name: n - counters_before.get(name, 0) for name, n in _state.counters.items()
+                    if n != counters_before.get(name, 0)}
+    return timers, counters
+
+
+def merge(other):
+    """Add a delta() recorded in another process (a pool worker) to this process's report."""
+    if other is None or not _state.enabled:
+        return
+    timers, counters = other
+    with _state.lock:
+        for name, (calls, seconds, longest, peak) in timers.items():
+            stats = _state.timers.setdefault(name, [0, 0.0, 0.0, 0])
+            stats[0] += calls
+            stats[1] += seconds
+            stats[2] = max(stats[2], longest)
+            stats[3] = max(stats[3], peak)
+        for name, n in counters.items():
+            _state.counters[name] = _state.counters.get(name, 0) + n
+
+
+def _sample():
+    while True:
+        rss = _rss_bytes()
+        with _state.lock:
+            _state.rss = rss
+            for t in _state.active:
+                if rss > t.peak:
+                    t.peak = rss
+        time.sleep(SAMPLE_INTERVAL)
+
+
+def _after_fork():
+    # a forked child keeps no threads and may have copied the lock while it was held
+    _state.lock = threading.Lock()
+    _state.active = []
+    _state.rss = _rss_bytes()
+    threading.Thread(target=_sample, name="metrics-sampler", daemon=True).start()
+
+
+def report():
+    """The run report as a dict."""
+    mb = 1024 * 1024
+    with _state.lock:
+        timers = {name: {"calls": calls, "seconds": round(seconds, 6), "max_seconds": round(longest, 6),
+                         "peak_rss_mb": round(peak / mb, 1)}
+                  for name, (calls, seconds, longest, peak) in sorted(_state.timers.items())}
+        counters = dict(sorted(_state.counters.items()))
+    return {"argv": sys.argv, "started": _state.started, "wall_seconds": round(time.time() - _state.started, 6),
+            "peak_rss_mb": round(_peak_rss_bytes() / mb, 1), "timers": timers, "counters": counters}
+
+
+def write_report(path):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report(), f, indent=1)
+    os.replace(tmp, path)
+
+
+def _start_profiler(path):
+    if str(path).endswith(".html"):
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        return lambda: (profiler.stop(), open(path, "w", encoding="utf-8").write(profiler.output_html()))
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return lambda: (profiler.disable(), profiler.dump_stats(path))
+
+
+def enable(report_path=None, profile_path=None):
+    """Turn metrics on for the rest of the process; the report and profile are written at exit."""
+    if _state.enabled:
+        return
+    if _in_worker():
+        # the parent writes the report and profile, with the worker's numbers merged in
+        report_path = profile_path = None
+    _state.enabled = True
+    _state.owner = os.getpid()
+    _state.started = time.time()
+    _state.rss = _rss_bytes()
+    threading.Thread(target=_sample, name="metrics-sampler", daemon=True).start()
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_after_fork)
+    stop_profiler = _start_profiler(profile_path) if profile_path else None
+
+    def finish():
+        if os.getpid() != _state.owner:
+            return
+        if stop_profiler is not None:
+            stop_profiler()
+        if report_path:
+            write_report(report_path)
+    atexit.register(finish)
+
+
+if os.environ.get("BANK_METRICS") or os.environ.get("BANK_PROFILE"):
+    enable(os.environ.get("BANK_METRICS"), os.environ.get("BANK_PROFILE"))
@@ -1,48 +1,229 @@
+"""
+Naive Bayes transaction classifier trained on the hand-labeled CSVs in labeled/.
+
+  python nb_classify.py                 # hold-out evaluation with a confusion matrix plot
+  python nb_classify.py train           # fit on all of labeled/ and save models/nb_classify.npz
+  python nb_classify.py train-stream --estimator sgd --chunksize 50000
+
+The saved artifact is read by nb_predict.py, which only needs NumPy at prediction time. train
+also saves the nearest-neighbour index of labeled/ (knn_index.py, models/knn_index.npz), which
+nb_predict.py uses for its knn_label column.
+
+train-stream is an out-of-core training experiment for long histories: labeled tables are read
+in chunks, hashed into a fixed number of word and char n-gram features (no vocabulary to grow)
+and fed to partial_fit, so memory depends on --chunksize and --n-features, not on how much data
+there is. It is training-only: its joblib pickle (models/nb_stream.joblib) is not the .npz
+artifact and nothing in the pipeline loads it (nb_predict.py reads train's artifact, labeler.py
+and cascade.py fit their own models). bench_nb_stream.py measures it.
+"""
+
+import argparse
+import hashlib
+from datetime import datetime, timezone
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import SGDClassifier
 from sklearn.naive_bayes import MultinomialNB
-from sklearn.pipeline import make_pipeline
-from sklearn.metrics import confusion_matrix, classification_report
-import matplotlib.pyplot as plt
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
+from sklearn.pipeline import make_pipeline, make_union
+from sklearn.metrics import confusion_matrix
+
+import metrics
+from knn_index import INDEX_PATH, KNNIndex
+from storage import iter_chunks, list_tables, read_table
 
 DATA_DIR = Path("labeled")
+MODEL_PATH = Path("models/nb_classify.npz")
+STREAM_MODEL_PATH = Path("models/nb_stream.joblib")
+# bump when the arrays stored by save_model() change meaning
+ARTIFACT_VERSION = 1
+
+
+def load_labeled(data_dir=DATA_DIR, skip=()):
+    """Every labeled table in data_dir but those whose stem (month) is in skip."""
+    skip = set(skip)
+    frames = [read_table(f) for f in list_tables(data_dir) if f.stem not in skip]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["description", "label"])
+
+
+def make_model():
+    return make_pipeline(
+        TfidfVectorizer(ngram_range=(1, 3)),
+        MultinomialNB()
+    )
+
+
+@metrics.timed("nb.train")
+def train(df):
+    return make_model().fit(df["description"].astype(str), df["label"].astype(str))
+
+
+def make_hashing_vectorizer(n_features=2**18):
+    """Stateless word 1-3 gram + char 3-5 gram features; alternate_sign off so MultinomialNB can use them."""
+    return make_union(
+        HashingVectorizer(ngram_range=(1, 3), n_features=n_features, alternate_sign=False),
+        HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), n_features=n_features, alternate_sign=False),
+    )
+
+
+def iter_labeled_chunks(paths, chunksize):
+    """Yield (descriptions, labels) chunks from labeled tables, never holding more than chunksize rows."""
+    for path in paths:
+        for chunk in iter_chunks(path, columns=["description", "label"], chunksize=chunksize):
+            chunk = chunk.dropna(subset=["label"])
+            if len(chunk):
+                yield chunk["description"].astype(str), chunk["label"].astype(str)
+
+
+@metrics.timed("nb.train_stream")
+def train_streaming(paths, estimator="nb", chunksize=10_000, n_features=2**18, epochs=1):
+    """
+    Out-of-core training: chunks from iter_labeled_chunks() are hashed and passed to partial_fit.
+    estimator is "nb" (MultinomialNB) or "sgd" (SGDClassifier with logistic loss). Returns a
+    pipeline that predicts and predict_probas like make_model()'s.
+    """
+    paths = list(paths)
+    # partial_fit needs the full label set up front; one cheap pass over the label column
+    classes = set()
+    for path in paths:
+        for chunk in iter_chunks(path, columns=["label"], chunksize=chunksize):
+            classes.update(chunk["label"].dropna().astype(str))
+    classes = np.array(sorted(classes))
+
+    vectorizer = make_hashing_vectorizer(n_features)
+    if estimator == "nb":
+        clf = MultinomialNB(alpha=0.1)
+    elif estimator == "sgd":
+        clf = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=42)
+    else:
+        raise ValueError(f"unknown estimator {estimator!r}, expected 'nb' or 'sgd'")
+    rows = 0
+    for _ in range(epochs):
+        for X, y in iter_labeled_chunks(paths, chunksize):
+            clf.partial_fit(vectorizer.transform(X), y, classes=classes)
+            rows += len(y)
+    print(f"train-stream: {rows} rows ({epochs} epoch(s)), {len(classes)} labels, {estimator}")
+    # the vectorizer is stateless, so the pipeline is usable without ever calling fit on it
+    return make_pipeline(vectorizer, clf)
+
+
+@metrics.timed("nb.predict")
+def nb_predict(model, descriptions):
+    """Return (labels, confidences): the most probable class per row and its predict_proba."""
+    proba = model.predict_proba(pd.Series(descriptions).astype(str))
+    idx = proba.argmax(axis=1)
+    return model.classes_[idx], proba[np.arange(len(idx)), idx]
+
+
+def save_model(model, path=MODEL_PATH, trained_on=None):
+    """
+    Save a fitted make_model() pipeline as plain arrays: the TF-IDF vocabulary and idf weights,
+    the Naive Bayes log-probabilities and the label set. No pickles, so loading it needs neither
+    scikit-learn nor a matching library version.
+    """
+    vec, nb = model.steps[0][1], model.steps[1][1]
+    if vec.analyzer != "word" or vec.sublinear_tf or vec.norm != "l2" or vec.stop_words is not None:
+        raise ValueError("save_model only supports the make_model() TfidfVectorizer settings")
+    terms = sorted(vec.vocabulary_, key=vec.vocabulary_.get)
+    meta = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "rows": 0 if trained_on is None else len(trained_on),
+        "data_sha256": "" if trained_on is None else hashlib.sha256(
+            pd.util.hash_pandas_object(trained_on[["description", "label"]], index=False).values
+        ).hexdigest(),
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(
+        path,
+        version=np.int64(ARTIFACT_VERSION),
+        terms=np.array(terms, dtype=str),
+        idf=vec.idf_,
+        feature_log_prob=nb.feature_log_prob_,
+        class_log_prior=nb.class_log_prior_,
+        classes=np.array(nb.classes_, dtype=str),
+        token_pattern=np.array(vec.token_pattern),
+        lowercase=np.bool_(vec.lowercase),
+        ngram_range=np.array(vec.ngram_range),
+        meta=np.array([f"{k}={v}" for k, v in meta.items()]),
+    )
+    return path
+
+
+def evaluate():
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import ConfusionMatrixDisplay
+
+    df = load_labeled()
+    print(len(df))
+    X = df["description"].astype(str)
+    y = df["label"].astype(str)
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.3, random_state=42, stratify=y
+    )
 
-df = pd.concat((pd.read_csv(f) for f in DATA_DIR.glob("*.csv")), ignore_index=True)
-print(len(df))
-X = df["description"].astype(str)
-y = df["label"].astype(str)
+    model = make_model()
+    model.fit(X_train, y_train)
 
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.3, random_state=42, stratify=y
-)
+    y_pred = model.predict(X_test)
+    labels = sorted(df["label"].unique())
 
+    cm = confusion_matrix(y_test, y_pred, labels=labels)
+    fig, ax = plt.subplots(figsize=(6, 6))
+    disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=labels)
+    disp.plot(ax=ax, cmap="Blues", colorbar=True)
 
-model = make_pipeline(
-    TfidfVectorizer(ngram_range=(1, 3)),
-    MultinomialNB()
-)
+    print("Test accuracy:", model.score(X_test, y_test))
 
-model.fit(X_train, y_train)
+    example = ["SQ *JET RAG 825 North La Brea LOS ANGELES 90038 CA USA 2%"]
+    print("Prediction:", model.predict(example)[0])
 
-y_pred = model.predict(X_test)
-labels = sorted(df["label"].unique())
+    plt.xticks(rotation=45, ha="right")
+    plt.title("Naive Bayes Confusion Matrix")
+    plt.tight_layout()
+    plt.show()
 
-cm = confusion_matrix(y_test, y_pred, labels=labels)
-fig, ax = plt.subplots(figsize=(6, 6))
-disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=labels)
-disp.plot(ax=ax, cmap="Blues", colorbar=True)
 
+def main():
+    ap = argparse.ArgumentParser(description="Train or evaluate the Naive Bayes classifier.")
+    sub = ap.add_subparsers(dest="command")
+    sub.add_parser("eval", help="hold-out evaluation with a confusion matrix plot (default)")
+    tr = sub.add_parser("train", help="fit on all labeled data and save the model artifact")
+    tr.add_argument("--data-dir", default=DATA_DIR)
+    tr.add_argument("--out", default=MODEL_PATH)
+    tr.add_argument("--knn-out", default=INDEX_PATH, help="where to save the nearest-neighbour index")
+    st = sub.add_parser("train-stream", help="experiment: out-of-core training with hashed features and partial_fit; "
+                                             "the saved model is not used by predict")
+    st.add_argument("--data-dir", default=DATA_DIR)
+    st.add_argument("--estimator", choices=["nb", "sgd"], default="nb")
+    st.add_argument("--chunksize", type=int, default=10_000)
+    st.add_argument("--n-features", type=int, default=2**18, help="hash buckets per feature family")
+    st.add_argument("--epochs", type=int, default=1, help="passes over the data (sgd benefits from a few)")
+    st.add_argument("--out", default=STREAM_MODEL_PATH, help="joblib pickle, for experiments only (not models/nb_classify.npz)")
+    args = ap.parse_args()
 
-print("Test accuracy:", model.score(X_test, y_test))
+    if args.command == "train":
+        df = load_labeled(args.data_dir)
+        model = train(df)
+        path = save_model(model, args.out, trained_on=df)
+        print(f"Trained on {len(df)} rows, {len(model.classes_)} labels, "
+              f"{len(model.steps[0][1].vocabulary_)} terms -> {path} ({path.stat().st_size / 1024:.0f} KiB)")
+        knn_path = KNNIndex.from_frame(df).save(args.knn_out)
+        print(f"Nearest-neighbour index of the same rows -> {knn_path} ({knn_path.stat().st_size / 1024:.0f} KiB)")
+    elif args.command == "train-stream":
+        import joblib
 
-example = ["SQ *JET RAG 825 North La Brea LOS ANGELES 90038 CA USA 2%"]
-print("Prediction:", model.predict(example)[0])
+        model = train_streaming(list_tables(args.data_dir), args.estimator,
+                                args.chunksize, args.n_features, args.epochs)
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        joblib.dump(model, args.out, compress=3)
+        print(f"saved {args.out} ({Path(args.out).stat().st_size / 1024:.0f} KiB)")
+    else:
+        evaluate()
 
 
-plt.xticks(rotation=45, ha="right")
-plt.title("Naive Bayes Confusion Matrix")
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
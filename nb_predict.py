@@ -0,0 +1,287 @@
+"""
+Fast inference with the Naive Bayes artifact saved by `python nb_classify.py train`.
+
+The artifact is loaded once and scored with NumPy only (no scikit-learn import), so startup
+stays well under a second and rows are classified in bulk. When the nearest-neighbour index
+saved next to it (knn_index.py) is there, knn_label and knn_similarity columns are added: the
+label of the nearest labeled rows where they are at least --knn-threshold similar, blank
+elsewhere. nb_label and nb_confidence are always Naive Bayes' own.
+
+Inputs are tables in any storage.py format (.parquet, .arrow or .csv), read a chunk at a time.
+With --out-dir each becomes a table of the same name and format (or --format); without one the
+rows go to stdout as CSV. Only these reads and writes need pandas.
+
+Usage:
+  python nb_predict.py cleansed_data/*.parquet --out-dir nb_gen   # adds nb_label, nb_confidence
+  python nb_predict.py cleansed_data/*.csv --out-dir nb_gen --format csv
+  cat descriptions.txt | python nb_predict.py                     # one description per line -> CSV on stdout
+  python nb_predict.py --serve --port 8765                        # local HTTP endpoint
+  python nb_predict.py cleansed_data/*.parquet --no-knn           # no knn_label column
+
+The HTTP endpoint takes POST /predict with {"descriptions": [...]} and answers
+{"labels": [...], "confidence": [...]}, plus "knn_labels" and "knn_similarity" with an index;
+GET /health returns the artifact metadata.
+"""
+
+import argparse
+import csv
+import json
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+import metrics
+
+MODEL_PATH = Path("models/nb_classify.npz")
+KNN_PATH = Path("models/knn_index.npz")
+ARTIFACT_VERSION = 1
+
+
+class NBModel:
+    def __init__(self, path=MODEL_PATH, knn_path=None, knn_threshold=None):
+        import numpy as np
+
+        self.np = np
+        path = Path(path)
+        if not path.is_file():
+            raise FileNotFoundError(f"{path} not found, run `python nb_classify.py train` first")
+        with np.load(path, allow_pickle=False) as art:
+            version = int(art["version"])
+            if version != ARTIFACT_VERSION:
+                raise ValueError(f"{path} is artifact version {version}, expected {ARTIFACT_VERSION}; retrain it")
+            self.vocabulary = {t: i for i, t in enumerate(art["terms"].tolist())}
+            self.idf = art["idf"]
+            # (n_terms, n_classes) so the rows of one description can be gathered contiguously
+            self.term_log_prob = np.ascontiguousarray(art["feature_log_prob"].T)
+            self.class_log_prior = art["class_log_prior"]
+            self.classes = art["classes"]
+            self.token_re = re.compile(str(art["token_pattern"]))
+            self.lowercase = bool(art["lowercase"])
+            self.min_n, self.max_n = (int(n) for n in art["ngram_range"])
+            self.meta = dict(m.split("=", 1) for m in art["meta"].tolist())
+        self.meta.update(version=version, labels=self.classes.tolist(), terms=len(self.vocabulary))
+        # label transfer from the nearest labeled rows, when an index is given
+        self.knn = None
+        if knn_path is not None:
+            from knn_index import KNN_THRESHOLD, KNNIndex
+
+            self.knn = KNNIndex.load(knn_path)
+            self.knn_threshold = KNN_THRESHOLD if knn_threshold is None else knn_threshold
+            self.meta.update(knn_rows=len(self.knn), knn_threshold=self.knn_threshold)
+
+    def _term_counts(self, text):
+        """Vocabulary index -> count for the word n-grams of one description (TfidfVectorizer's analyzer)."""
+        if self.lowercase:
+            text = text.lower()
+        tokens = self.token_re.findall(text)
+        grams = tokens if self.min_n == 1 else []
+        for n in range(max(self.min_n, 2), self.max_n + 1):
+            grams = grams + [" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+        vocab = self.vocabulary
+        return Counter(vocab[g] for g in grams if g in vocab)
+
+    def predict_proba(self, descriptions):
+        np = self.np
+        cols, counts, offsets = [], [], [0]
+        for text in descriptions:
+            tc = self._term_counts(str(text))
+            cols.extend(tc.keys())
+            counts.extend(tc.values())
+            offsets.append(len(cols))
+        cols = np.asarray(cols, dtype=np.intp)
+        offsets = np.asarray(offsets)
+        n = len(offsets) - 1
+
+        # l2-normalized tf-idf weights, then the multinomial log-likelihood per class
+        w = np.asarray(counts, dtype=np.float64) * self.idf[cols]
+        nonempty = offsets[1:] > offsets[:-1]
+        starts = offsets[:-1][nonempty]
+        norms = np.ones(n)
+        if len(w):
+            norms[nonempty] = np.sqrt(np.add.reduceat(w * w, starts))
+        w /= np.repeat(norms, np.diff(offsets))
+        jll = np.tile(self.class_log_prior, (n, 1))
+        if len(w):
+            jll[nonempty] += np.add.reduceat(self.term_log_prob[cols] * w[:, None], starts, axis=0)
+        jll -= jll.max(axis=1, keepdims=True)
+        proba = np.exp(jll)
+        proba /= proba.sum(axis=1, keepdims=True)
+        return proba
+
+    @metrics.timed("nb.predict")
+    def predict(self, descriptions):
+        """Return (labels, confidences): the most probable class per row and its probability."""
+        np = self.np
+        proba = self.predict_proba(descriptions)
+        idx = proba.argmax(axis=1)
+        return self.classes[idx], proba[np.arange(len(idx)), idx]
+
+    @metrics.timed("nb.knn")
+    def transfer(self, descriptions, txn_ids=None):
+        """
+        Return (labels, similarities) from the nearest labeled rows: their label where they are
+        at least knn_threshold similar, else None. Needs the model to be loaded with a knn_path.
+        A labeled row whose txn_id is the description's own (txn_ids) is not a neighbour of it.
+        """
+        labels, sims = self.knn.predict([str(d) for d in descriptions], exclude=txn_ids)
+        labels[sims < self.knn_threshold] = None
+        metrics.count("nb.knn_rows", int((sims >= self.knn_threshold).sum()))
+        return labels, sims
+
+
+def output_columns(model):
+    return ["nb_label", "nb_confidence"] + (["knn_label", "knn_similarity"] if model.knn is not None else [])
+
+
+def predict_rows(model, descriptions, txn_ids=None):
+    """The output_columns() values of every description, formatted for CSV."""
+    labels, conf = model.predict(descriptions)
+    out = [[label, f"{c:.4f}"] for label, c in zip(labels, conf)]
+    if model.knn is not None:
+        # blank where no labeled row is similar enough
+        for values, label, sim in zip(out, *model.transfer(descriptions, txn_ids)):
+            values += [label or "", f"{sim:.4f}" if label else ""]
+    return out
+
+
+def predict_columns(model, descriptions, txn_ids=None):
+    """The output_columns() of every description as arrays, for a DataFrame."""
+    np = model.np
+    labels, conf = model.predict(descriptions)
+    columns = {"nb_label": labels, "nb_confidence": conf.round(4)}
+    if model.knn is not None:
+        knn_labels, sims = model.transfer(descriptions, txn_ids)
+        columns["knn_label"] = knn_labels
+        # blank where no labeled row is similar enough
+        found = np.array([label is not None for label in knn_labels], dtype=bool)
+        columns["knn_similarity"] = np.where(found, sims.round(4), np.nan)
+    return columns
+
+
+def predict_table(model, src, dst=None, column="description", batch_size=4096):
+    """
+    Copy the table at src adding nb_label and nb_confidence (and, with a kNN index, knn_label
+    and knn_similarity) columns, predicting batch_size rows at a time. The copy is written to
+    dst (its format by suffix) or, when dst is None, to stdout as CSV. Returns the row count.
+    """
+    from storage import ID_COL, TableWriter, csv_ready, iter_chunks, transaction_ids
+
+    writer, n = None, 0
+    counts = Counter()
+    try:
+        for chunk in iter_chunks(src, chunksize=batch_size):
+            if column not in chunk.columns:
+                raise ValueError(f"{src} has no {column!r} column")
+            if ID_COL not in chunk.columns:
+                # derived as storage does for old tables, so labeled/ rows still match by txn_id
+                chunk.insert(0, ID_COL, transaction_ids(chunk, counts))
+            descriptions = chunk[column].fillna("").astype(str).tolist()
+            # a labeled copy of a row is never its own neighbour
+            chunk = chunk.assign(**predict_columns(model, descriptions, chunk[ID_COL]))
+            if dst is None:
+                csv_ready(chunk).to_csv(sys.stdout, header=n == 0, index=False)
+            else:
+                if writer is None:
+                    writer = TableWriter(dst, [c for c in chunk.columns if c != ID_COL])
+                writer.write(chunk)
+            n += len(chunk)
+        if dst is not None and writer is None:
+            # an empty input still gets its (empty) output table
+            writer = TableWriter(dst, [column] + output_columns(model))
+    finally:
+        if writer is not None:
+            writer.close()
+    return n
+
+
+def serve(model, host, port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, model.meta)
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                return self._reply(404, {"error": "not found"})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                descriptions = payload["descriptions"]
+                if not isinstance(descriptions, list):
+                    raise TypeError("descriptions must be a list")
+            except (ValueError, KeyError, TypeError) as e:
+                return self._reply(400, {"error": f"expected {{\"descriptions\": [...]}}: {e}"})
+            labels, conf = model.predict(descriptions)
+            reply = {"labels": labels.tolist(), "confidence": [round(float(c), 4) for c in conf]}
+            if model.knn is not None:
+                knn_labels, sims = model.transfer(descriptions)
+                reply.update(knn_labels=knn_labels.tolist(), knn_similarity=[round(float(s), 4) for s in sims])
+            self._reply(200, reply)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving {model.meta['labels']} on http://{host}:{port}/predict", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Classify transactions with the saved Naive Bayes model.")
+    ap.add_argument("inputs", nargs="*",
+                    help="tables (.parquet, .arrow, .csv) with a description column; '-' or nothing reads lines from stdin")
+    ap.add_argument("--model", default=MODEL_PATH)
+    ap.add_argument("--knn", default=KNN_PATH, help="nearest-neighbour index, used when the file exists")
+    ap.add_argument("--no-knn", action="store_true", help="leave out the knn_label and knn_similarity columns")
+    ap.add_argument("--knn-threshold", type=float, default=None,
+                    help="similarity from which the neighbours' label is given (default: knn_index.KNN_THRESHOLD)")
+    ap.add_argument("--out-dir", default=None, help="write <out-dir>/<name> per input (default: CSV on stdout)")
+    # storage.FORMATS, spelled out so --help does not import pandas
+    ap.add_argument("--format", choices=["parquet", "arrow", "csv"], default=None,
+                    help="output table format with --out-dir (default: the input's)")
+    ap.add_argument("--column", default="description")
+    ap.add_argument("--serve", action="store_true", help="run the HTTP endpoint instead")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+
+    knn = None if args.no_knn or not Path(args.knn).is_file() else args.knn
+    model = NBModel(args.model, knn, args.knn_threshold)
+    if args.serve:
+        return serve(model, args.host, args.port)
+
+    if not args.inputs or args.inputs == ["-"]:
+        lines = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+        writer = csv.writer(sys.stdout)
+        writer.writerow([args.column] + output_columns(model))
+        writer.writerows([d] + values for d, values in zip(lines, predict_rows(model, lines)))
+        return
+
+    for src in map(Path, args.inputs):
+        if args.out_dir is None:
+            predict_table(model, src, column=args.column)
+            continue
+        dst = Path(args.out_dir) / (src.name if args.format is None else f"{src.stem}.{args.format}")
+        n = predict_table(model, src, dst, args.column)
+        print(f"{src}: {n} rows -> {dst}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,86 @@
 # filename: cc_pdf_to_csv.py
 """
-Usage:
+Usage (the output format follows the suffix: .csv, .parquet or .arrow, see storage.py):
   pip install pdfplumber python-dateutil tqdm
   python cc_pdf_to_csv.py /path/to/statements/ output.csv
   # or
   python cc_pdf_to_csv.py /path/to/one.pdf output.csv
+  # spread files over 8 processes, splitting PDFs into 20-page extraction tasks
+  python cc_pdf_to_csv.py /path/to/statements/ output.csv --workers 8 --pages-per-task 20
+  # constant-memory, page-by-page parsing for multi-hundred-page statements
+  python cc_pdf_to_csv.py /path/to/huge.pdf output.csv --stream
+  python cc_pdf_to_csv.py /path/to/statements/ output.parquet
+  # every run writes only transactions no earlier run has emitted (see dedup_index.py)
+  python cc_pdf_to_csv.py /path/to/statements/ data/2025-11.parquet
 """
 
 import sys
 import re
-import csv
 import os
+import argparse
+import datetime
+from abc import ABC, abstractmethod
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
 from pathlib import Path
 from dateutil import parser as dateparser
 import pdfplumber
+from pdfplumber.utils import cluster_objects
 from tqdm import tqdm
+import pandas as pd
+import metrics
+from dedup_index import DedupIndex
+from pdf_cache import ExtractionCache, file_digest
+from storage import TableWriter, transaction_ids
+
+# Bump these whenever extraction or line parsing changes, so cached results are invalidated.
+EXTRACT_VERSION = 1
+PARSER_VERSION = 2
+
+# Streaming mode (--stream) reads the statement year from this many leading pages only.
+YEAR_HINT_PAGES = 2
+
+# rows handed to the output writer at a time
+WRITE_BATCH = 5000
+
+# files per pool worker scheduled ahead of the one being written out
+SCHEDULE_AHEAD = 2
 
 # --- Helpers ---------------------------------------------------------------
 
-CURRENCY_RE = re.compile(r'(?<![\d,.-])(-?\$?\d{1,3}(?:,\d{3})*\.\d{2})(?![\d])')
+# the leading lookahead is redundant but lets the engine reject most positions before the lookbehind
+CURRENCY_RE = re.compile(r'(?=[-$\d])(?<![\d,.-])(-?\$?\d{1,3}(?:,\d{3})*\.\d{2})(?![\d])')
 DATE_CANDIDATE_RE = re.compile(
     r'\b((?:\d{1,2}[-/]\d{1,2}(?:[-/]\d{2,4})?)|(?:\d{4}[-/]\d{1,2}[-/]\d{1,2}))\b'
 )
+# The shapes DATE_CANDIDATE_RE can produce, split into groups for try_parse_date's fast path
+DATE_TOKEN_RE = re.compile(
+    r'(?P<m>\d{1,2})[-/](?P<d>\d{1,2})(?:[-/](?P<y>\d{2}|\d{4}))?'
+    r'|(?P<Y>\d{4})[-/](?P<M>\d{1,2})[-/](?P<D>\d{1,2})'
+)
+YEAR_RE = re.compile(r'(20\d{2})')
 POSSIBLE_HEADER_HINTS = re.compile(
     r'(previous\s+balance|new\s+balance|total\s+payment|statement\s+period|credit\s+limit)',
     re.I
 )
+PAGE_NUMBER_RE = re.compile(r'page\s+\d+\s+of\s+\d+', re.I)
+TOTALS_RE = re.compile(r'\b(total|new balance|previous balance|payments?\s+and\s+credits)\b', re.I)
+# Header hints, page footers and totals rows folded into one alternation: any hit drops the line.
+SKIP_LINE_RE = re.compile(
+    '|'.join(f'(?:{r.pattern})' for r in (POSSIBLE_HEADER_HINTS, PAGE_NUMBER_RE, TOTALS_RE)),
+    re.I
+)
+PAYMENT_KEYWORDS = ('payment', 'autopay', 'thank you')
+FEE_KEYWORDS = ('fee', 'interest', 'late')
+CREDIT_KEYWORDS = ('credit', 'refund', 'reversal')
+# Every literal that SKIP_LINE_RE or the type keywords need, as one case-sensitive alternation
+# run over the lowercased line. Most transaction lines contain none of them, so a single miss
+# here settles "not a header/total" and "plain purchase" without running the re.I patterns.
+LINE_KEYWORD_RE = re.compile('|'.join(
+    ('previous', 'new', 'total', 'statement', 'page') + PAYMENT_KEYWORDS + FEE_KEYWORDS + CREDIT_KEYWORDS
+))
 
 def normalize_money(s):
     """Convert money string like '$1,234.56' or '-123.45' to float."""
@@ -35,31 +90,66 @@ def normalize_money(s):
     except ValueError:
         return None
 
+def _two_digit_year(yy):
+    """Expand 'yy' the way dateutil does: the year within 50 years of today."""
+    this_year = datetime.date.today().year
+    year = yy + this_year // 100 * 100
+    if year >= this_year + 50:
+        year -= 100
+    elif year < this_year - 50:
+        year += 100
+    return year
+
+@lru_cache(maxsize=4096)
+def _parse_date_token(token, year_hint):
+    m = DATE_TOKEN_RE.fullmatch(token)
+    if m:
+        try:
+            if m.group('Y'):
+                return datetime.date(int(m.group('Y')), int(m.group('M')), int(m.group('D'))).isoformat()
+            y = m.group('y')
+            if y is None:
+                year = year_hint.year if year_hint is not None else datetime.date.today().year
+            elif len(y) == 2:
+                year = _two_digit_year(int(y))
+            else:
+                year = int(y)
+            return datetime.date(year, int(m.group('m')), int(m.group('d'))).isoformat()
+        except ValueError:
+            # e.g. '13/05' or '02/29' outside a leap year: let dateutil apply its own rules
+            pass
+    metrics.count("parse.dateutil_calls")
+    try:
+        with metrics.timer("parse.dateutil"):
+            dt = dateparser.parse(token, dayfirst=False, yearfirst=False, default=year_hint)
+        return dt.date().isoformat()
+    except Exception:
+        return None
+
 def try_parse_date(token, year_hint=None):
     """
     Try to parse a date from a token like '03/12' or '2025-03-12'.
     If year is missing, use year_hint when available.
+    The mm/dd[/yy[yy]] and yyyy-mm-dd shapes are parsed directly and memoized per (token, year_hint);
+    anything else goes through dateutil.
     """
-    token = token.strip()
-    try:
-        dt = dateparser.parse(token, dayfirst=False, yearfirst=False, default=year_hint)
-        return dt.date().isoformat()
-    except Exception:
-        return None
+    return _parse_date_token(token.strip(), year_hint)
 
-def detect_year_hint(all_text):
+def detect_year_hint(text):
     """
     Try to infer statement year from text (look for 'Statement Period: mm/dd/yyyy - mm/dd/yyyy' etc.).
+    text may be one string or an iterable of lines.
     """
-    year_hits = re.findall(r'(20\d{2})', all_text)
-    if year_hits:
-        # choose the most common or last
-        from collections import Counter
-        c = Counter(year_hits)
+    if isinstance(text, str):
+        text = (text,)
+    c = Counter()
+    for line in text:
+        c.update(YEAR_RE.findall(line))
+    if c:
+        # choose the most common
         year = int(c.most_common(1)[0][0])
         # Use January 1st as default time for dateutil default.
-        import datetime as _dt
-        return _dt.datetime(year, 1, 1)
+        return datetime.datetime(year, 1, 1)
     return None
 
 def is_header_line(line):
@@ -68,25 +158,43 @@ def is_header_line(line):
         return True
     if POSSIBLE_HEADER_HINTS.search(line):
         return True
-    if re.search(r'page\s+\d+\s+of\s+\d+', line, re.I):
+    if PAGE_NUMBER_RE.search(line):
         return True
     return False
 
 def clean_line(line):
     # Collapse whitespace, keep original for alignment in case-by-case tweaks
-    return re.sub(r'\s+', ' ', line).strip()
+    # (str.split() splits on exactly the characters \s matches, without the regex overhead)
+    return ' '.join(line.split())
 
 # --- Core parsing ----------------------------------------------------------
 
-def extract_text_lines(pdf_path):
-    """Extract lines of text from a PDF using pdfplumber."""
-    lines = []
+def iter_pages(pdf_path, page_range=None):
+    """
+    Yield (page, text lines) for each pdfplumber page in turn.
+    Each page's cached layout objects are released once the caller asks for the next page, so
+    memory stays flat however long the document is. page_range is an optional (start, stop)
+    slice of pages, used to split big PDFs across workers.
+    """
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-            lines.extend(text.splitlines())
-    return lines
+        pages = pdf.pages if page_range is None else pdf.pages[page_range[0]:page_range[1]]
+        for page in pages:
+            with metrics.timer("parse.pdfplumber"):
+                text = page.extract_text() or ""
+            metrics.count("parse.pages")
+            yield page, text.splitlines()
+            page.close()
+
+def iter_page_lines(pdf_path, page_range=None):
+    """Yield the text lines of each page in turn, using pdfplumber."""
+    for _, lines in iter_pages(pdf_path, page_range):
+        yield lines
+
+def extract_text_lines(pdf_path, page_range=None):
+    """Extract lines of text from a PDF using pdfplumber."""
+    return [line for page_lines in iter_page_lines(pdf_path, page_range) for line in page_lines]
 
+@metrics.timed("parse.guess_transactions")
 def guess_transactions(lines, year_hint=None):
     """
     Generic transaction extraction:
@@ -98,60 +206,60 @@ def guess_transactions(lines, year_hint=None):
     Returns list of dicts with keys:
       date, description, amount, balance (optional), type (debit/credit/payment/fee/unknown), source_line
     """
-    txns = []
+    return list(iter_transactions(lines, year_hint=year_hint))
+
+def iter_transactions(lines, year_hint=None):
+    """Generator behind guess_transactions(): yields each record as soon as its line is read."""
     for raw_line in lines:
-        if not raw_line or is_header_line(raw_line):
+        # cheap rejects first: most lines of a statement carry no amount at all
+        if not raw_line:
             continue
-
-        # currency candidates
         monies = list(CURRENCY_RE.finditer(raw_line))
         if not monies:
             continue
-
-        # Heuristic: ignore rows that look like totals only
-        if re.search(r'\b(total|new balance|previous balance|payments?\s+and\s+credits)\b', raw_line, re.I):
+        # re.I can match non-ASCII look-alikes that lower() keeps, so only trust the gate on ASCII
+        line_l = raw_line.lower()
+        has_keyword = not raw_line.isascii() or LINE_KEYWORD_RE.search(line_l) is not None
+        if len(raw_line.strip()) < 3 or (has_keyword and SKIP_LINE_RE.search(raw_line)):
             continue
 
         amount_m = monies[-1]
-        amount_str = amount_m.group(1)
-        amount = normalize_money(amount_str)
+        amount = normalize_money(amount_m.group(1))
         if amount is None:
             continue
 
         balance = None
+        cut_idx = amount_m.start()
         if len(monies) >= 2:
-            balance = normalize_money(monies[-2].group(1))
+            bal_m = monies[-2]
+            balance = normalize_money(bal_m.group(1))
+            if balance is not None:
+                # clip description up to before balance, but keep text between balance and amount as well
+                cut_idx = bal_m.start()
 
-        # Try to find a date
+        # Try to find a date, preferring one near line start (endpos=40 behaves like raw_line[:40])
         date = None
-        # prefer date near line start
-        head = raw_line[:40]
-        date_m = DATE_CANDIDATE_RE.search(head) or DATE_CANDIDATE_RE.search(raw_line)
+        date_m = DATE_CANDIDATE_RE.search(raw_line, 0, 40) or DATE_CANDIDATE_RE.search(raw_line)
         if date_m:
-            date_tok = date_m.group(1)
-            date = try_parse_date(date_tok, year_hint=year_hint)
+            date = try_parse_date(date_m.group(1), year_hint=year_hint)
 
         # Build description: everything except the trailing amount (and balance if present)
-        cut_idx = amount_m.start()
-        desc_segment = raw_line[:cut_idx].rstrip()
-        if balance is not None:
-            # remove balance token as well
-            bal_m = monies[-2]
-            # clip description up to before balance, but keep text between balance and amount as well
-            desc_segment = raw_line[:bal_m.start()].rstrip()
-
-        description = clean_line(desc_segment)
+        description = clean_line(raw_line[:cut_idx])
+        if date is None and not description:
+            continue
 
-        # Classify type: crude rules
-        line_l = raw_line.lower()
-        if any(k in line_l for k in ['payment', 'autopay', 'thank you']):
+        # Classify type: crude rules, payment > fee/interest > credit > purchase
+        if not has_keyword:
+            tx_type = 'purchase'
+            amount = abs(amount)
+        elif any(k in line_l for k in PAYMENT_KEYWORDS):
             tx_type = 'payment'
             # payments are usually negative to the balance; amounts can appear as -value or positive under "payments"
             if amount > 0:
                 amount = -amount
-        elif any(k in line_l for k in ['fee', 'interest', 'late']):
+        elif any(k in line_l for k in FEE_KEYWORDS):
             tx_type = 'fee/interest'
-        elif any(k in line_l for k in ['credit', 'refund', 'reversal']) and amount > 0:
+        elif any(k in line_l for k in CREDIT_KEYWORDS) and amount > 0:
             tx_type = 'credit'
             amount = -abs(amount)  # credits reduce balance; make them negative for spending/outflow sign convention
         else:
@@ -159,54 +267,177 @@ def guess_transactions(lines, year_hint=None):
             tx_type = 'purchase'
             amount = abs(amount)
 
-        txns.append({
+        yield {
             "date": date,
             "description": description or None,
-            "amount": round(amount, 2) if amount is not None else None,
+            "amount": round(amount, 2),
             "balance": round(balance, 2) if balance is not None else None,
             "type": tx_type,
             "source_line": clean_line(raw_line),
-        })
-
-    # Post-filter: keep rows that have at least date+amount or description+amount
-    filtered = [
-        t for t in txns
-        if t["amount"] is not None and (t["date"] is not None or t["description"])
-    ]
-    return filtered
-
-# --- Optional: bank-specific tweak hooks (examples only; off by default) ---
+        }
+
+# --- Bank layouts ----------------------------------------------------------
+# Statements whose layout is known are read as tables, cell by cell, instead of by guessing at
+# lines. A layout is picked by a cheap fingerprint of the first page's text, so detection costs
+# one page; statements no layout claims go through the generic line parser above.
+
+# name -> Layout instance, in detection order
+LAYOUTS = {}
+
+def register_layout(cls):
+    """Class decorator adding a Layout to the registry."""
+    LAYOUTS[cls.name] = cls()
+    return cls
+
+def detect_layout(first_page_lines):
+    """The registered Layout matching a statement's first page text lines, or None (generic)."""
+    for layout in LAYOUTS.values():
+        if layout.matches(first_page_lines):
+            return layout
+    return None
 
-def tweak_for_known_banks(txns, all_text):
+class Layout(ABC):
     """
-    Hook to apply bank-specific fixes (enable & expand as needed).
-    Example heuristics are commented for Chase/Amex/CapOne layouts.
+    A bank's statement layout. Subclasses set name and implement:
+      matches(first_page_lines) - a cheap check on the first page's text lines
+      parse_page(page, year_hint) - the rows of one pdfplumber page, as guess_transactions() makes them
     """
-    text_l = all_text.lower()
-
-    # Example: Chase sometimes lists "Payments and Credits" as a section:
-    # We already negate credits; you could add extra checks here.
+    name = None
 
-    # Example: American Express often uses two date columns (transaction date / posting date).
-    # You could parse two dates and pick one; here we keep the detected one.
+    @abstractmethod
+    def matches(self, first_page_lines):
+        ...
 
-    # Example: Capital One might separate categories; no change here.
+    @abstractmethod
+    def parse_page(self, page, year_hint=None):
+        ...
 
-    return txns
+def table_rows(page, header_first, header_last, y_tolerance=3):
+    """
+    Cut the tables of a page into cells using the x coordinates of their header rows.
+    A header row is a line of words starting with header_first and ending with header_last;
+    header words less than a space apart form one column name ("Daily Cash"). Every later line,
+    until the next header, yields (title, {column: text}, line text), where title is the line
+    just above the header (the table's section title). A word falls in the last column whose
+    edge is left of its start: a column's edge is its name's x0, except for header_last, which
+    is taken to be a right-aligned amount column whose edge sits halfway from the previous name.
+    """
+    title = columns = None
+    previous = ""
+    for words in cluster_objects(page.extract_words(), "top", y_tolerance):
+        text = " ".join(w["text"] for w in words)
+        if words[0]["text"] == header_first and words[-1]["text"] == header_last:
+            names = []
+            for w in words:
+                if names and w["x0"] - names[-1][2] < 5:
+                    names[-1] = (f"{names[-1][0]} {w['text']}", names[-1][1], w["x1"])
+                else:
+                    names.append((w["text"], w["x0"], w["x1"]))
+            edges = [x0 - y_tolerance for _, x0, _ in names]
+            if len(names) > 1:
+                edges[-1] = (names[-2][2] + names[-1][1]) / 2
+            title, columns = previous, [(name, edge) for (name, _, _), edge in zip(names, edges)]
+        elif columns is not None:
+            cells = {name: [] for name, _ in columns}
+            for w in words:
+                name = next((name for name, edge in reversed(columns) if w["x0"] >= edge), columns[0][0])
+                cells[name].append(w["text"])
+            yield title, {name: " ".join(ws) for name, ws in cells.items()}, text
+        previous = text
+
+@register_layout
+class AppleCardLayout(Layout):
+    """
+    Apple Card (Goldman Sachs) statements: every page opens with "Statement" / "Apple Card
+    Customer", and the Payments, Transactions and Interest Charged tables have Date,
+    Description, [Daily Cash,] Amount columns. Summary boxes, totals and the Daily Cash notes
+    printed under some purchases have no date cell and are dropped. There is no running
+    balance: the Daily Cash rate stays at the end of the description, where cleanse_data.py
+    reads it, and its dollar amount is left out.
+    """
+    name = "apple_card"
+
+    def matches(self, first_page_lines):
+        return "Apple Card Customer" in (line.strip() for line in first_page_lines[:5])
+
+    def parse_page(self, page, year_hint=None):
+        for title, cells, text in table_rows(page, "Date", "Amount"):
+            date_m = DATE_TOKEN_RE.fullmatch(cells["Date"])
+            amount = normalize_money(cells["Amount"]) if CURRENCY_RE.fullmatch(cells["Amount"]) else None
+            if date_m is None or amount is None:
+                continue
+            rate = next((w for w in cells.get("Daily Cash", "").split() if w.endswith("%")), None)
+            description = f"{cells['Description']} {rate}" if rate else cells["Description"]
+            title_l = title.lower()
+            if "payment" in title_l:
+                tx_type = 'payment'
+            elif "interest" in title_l:
+                tx_type = 'fee/interest'
+            else:
+                tx_type = 'credit' if amount < 0 else 'purchase'
+            yield {
+                "date": try_parse_date(date_m.group(0), year_hint=year_hint),
+                "description": description or None,
+                "amount": round(amount, 2),
+                "balance": None,
+                "type": tx_type,
+                "source_line": text,
+            }
+
+def parse_layout_page(layout, page, year_hint, pdf_path):
+    """Rows of one page of a statement in a known layout."""
+    with metrics.timer(f"parse.layout.{layout.name}"):
+        rows = list(layout.parse_page(page, year_hint))
+    for t in rows:
+        t["source_file"] = str(pdf_path)
+    return rows
 
 # --- Orchestrator ----------------------------------------------------------
 
-def parse_pdf(pdf_path):
-    lines = extract_text_lines(pdf_path)
-    all_text = "\n".join(lines)
-    year_hint = detect_year_hint(all_text)
+def parse_lines(lines, pdf_path):
+    """Rows of a statement in no known layout, from its text lines (the generic parser)."""
+    year_hint = detect_year_hint(lines)
     txns = guess_transactions(lines, year_hint=year_hint)
-    txns = tweak_for_known_banks(txns, all_text)
     # add file metadata
     for t in txns:
         t["source_file"] = str(pdf_path)
     return txns
 
+def parse_pdf(pdf_path):
+    return extract_and_parse(pdf_path)[1]
+
+def iter_pdf_transactions(pdf_path):
+    """
+    Constant-memory variant of parse_pdf(): yields rows page by page and never holds more than
+    YEAR_HINT_PAGES pages of text. The layout is detected on the first page; the generic
+    parser's year hint comes from the leading pages only.
+    """
+    pages = iter_pages(pdf_path)
+    first = next(pages, None)
+    if first is None:
+        return
+    layout = detect_layout(first[1])
+    if layout is not None:
+        year_hint = detect_year_hint(first[1])
+        for page, _ in chain([first], pages):
+            yield from parse_layout_page(layout, page, year_hint, pdf_path)
+        return
+    page_lines = (lines for _, lines in pages)
+    head = [first[1], *islice(page_lines, YEAR_HINT_PAGES - 1)]
+    year_hint = detect_year_hint(line for lines in head for line in lines)
+    for lines in chain(head, page_lines):
+        for t in guess_transactions(lines, year_hint=year_hint):
+            t["source_file"] = str(pdf_path)
+            yield t
+
+def stream_pdf(pdf_path):
+    """Worker task for --stream: rows only, the lines are never collected."""
+    return None, list(iter_pdf_transactions(pdf_path))
+
+def count_pages(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
 def iter_pdf_files(pathlike):
     p = Path(pathlike)
     if p.is_file() and p.suffix.lower() == ".pdf":
@@ -217,42 +448,237 @@ def iter_pdf_files(pathlike):
     else:
         raise FileNotFoundError(f"No PDF found at {p}")
 
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: python cc_pdf_to_csv.py <pdf_or_folder> <output.csv>")
-        sys.exit(1)
+# --- Parallel driver -------------------------------------------------------
 
-    inp, out_csv = sys.argv[1], sys.argv[2]
-    all_rows = []
-    pdfs = list(iter_pdf_files(inp))
+FIELDNAMES = ["date", "description", "amount", "balance", "type", "source_file", "source_line"]
 
-    for pdf_path in tqdm(pdfs, desc="Parsing PDFs"):
+def extract_and_parse(pdf_path):
+    """
+    Worker task: return both the raw lines (for the cache) and the parsed rows.
+    The first page picks the layout; in a known one every page is parsed as it is extracted.
+    """
+    lines, rows, layout = [], [], None
+    for i, (page, page_lines) in enumerate(iter_pages(pdf_path)):
+        if i == 0:
+            layout = detect_layout(page_lines)
+            year_hint = detect_year_hint(page_lines)
+        lines.extend(page_lines)
+        if layout is not None:
+            rows.extend(parse_layout_page(layout, page, year_hint, pdf_path))
+    return lines, (rows if layout is not None else parse_lines(lines, pdf_path))
+
+def extract_pages(pdf_path, page_range, layout=None, year_hint=None):
+    """
+    Worker task for one page range: (lines, rows). rows is None without a layout, since the
+    generic parser reads the lines of the whole document at once.
+    """
+    lines, rows = [], None if layout is None else []
+    for page, page_lines in iter_pages(pdf_path, page_range):
+        lines.extend(page_lines)
+        if layout is not None:
+            rows.extend(parse_layout_page(layout, page, year_hint, pdf_path))
+    return lines, rows
+
+def _measured(task, *args):
+    """Run task in a pool process: (its result, the metrics it recorded there)."""
+    before = metrics.snapshot()
+    return task(*args), metrics.delta(before)
+
+def _submit(ex, task, *args):
+    """Submit task to the pool; the returned resolve() also adds the worker's metrics to ours."""
+    future = ex.submit(_measured, task, *args)
+    def resolve():
+        result, worker_metrics = future.result()
+        metrics.merge(worker_metrics)
+        return result
+    return resolve
+
+def _schedule(pdf_path, ex, pages_per_task, cache, stream):
+    """
+    Start the work for one PDF and return (resolve, digest, fresh).
+    resolve() blocks until (lines, rows) is ready; fresh tells the caller to store it in the cache.
+    Pool work is submitted here so it runs while earlier files are still being written out.
+    In stream mode lines is None and, without a pool, rows is a generator.
+    """
+    if stream:
+        if ex is None:
+            return (lambda: (None, iter_pdf_transactions(pdf_path))), None, False
+        return _submit(ex, stream_pdf, pdf_path), None, False
+
+    digest = None
+    if cache is not None:
+        digest = file_digest(pdf_path)
+        hit = cache.get(digest)
+        if hit is not None:
+            lines, rows = hit
+            if rows is not None:
+                for r in rows:
+                    r["source_file"] = str(pdf_path)
+                return (lambda: (lines, rows)), digest, False
+            if detect_layout(lines) is None:
+                return (lambda: (lines, parse_lines(lines, pdf_path))), digest, True
+            # known layouts are parsed from the page objects, so the PDF is read again
+
+    if ex is None:
+        return (lambda: extract_and_parse(pdf_path)), digest, True
+
+    n_pages = count_pages(pdf_path) if pages_per_task > 0 else 0
+    if n_pages > pages_per_task:
+        # the layout is detected here, on the first page, so each task can parse its own pages
+        first_lines = next(iter_page_lines(pdf_path, (0, 1)))
+        layout, year_hint = detect_layout(first_lines), detect_year_hint(first_lines)
+        chunks = [
+            _submit(ex, extract_pages, pdf_path, (start, start + pages_per_task), layout, year_hint)
+            for start in range(0, n_pages, pages_per_task)
+        ]
+        def resolve():
+            parts = [chunk() for chunk in chunks]
+            lines = [line for part_lines, _ in parts for line in part_lines]
+            if layout is None:
+                return lines, parse_lines(lines, pdf_path)
+            return lines, [row for _, part_rows in parts for row in part_rows]
+        return resolve, digest, True
+    return _submit(ex, extract_and_parse, pdf_path), digest, True
+
+def iter_parsed(pdfs, workers=1, pages_per_task=0, cache=None, stream=False):
+    """
+    Yield (pdf_path, rows, error) for every PDF, always in the order of `pdfs`.
+    With workers > 1 files are parsed in a process pool; results are still yielded in input
+    order as soon as the head of the queue is done, so the caller can stream them to disk.
+    At most SCHEDULE_AHEAD files per worker are in flight, so finished results waiting behind a
+    slow file cannot pile up in memory.
+    With pages_per_task > 0, PDFs longer than that are extracted as page-range tasks and
+    the lines are stitched back together before parsing.
+    Files whose bytes are already in `cache` (an ExtractionCache) skip extraction entirely.
+    With stream=True every file goes through iter_pdf_transactions() and cache/pages_per_task
+    are ignored; rows may then be a generator that raises part-way through a broken file.
+    """
+    ex = None
+    if workers > 1:
+        ex = ProcessPoolExecutor(max_workers=workers, initializer=metrics.init_worker,
+                                 initargs=(metrics.enabled(),))
+    todo = iter(pdfs)
+    pending = deque()
+
+    def schedule_next():
+        pdf_path = next(todo, None)
+        if pdf_path is None:
+            return False
         try:
-            rows = parse_pdf(pdf_path)
-            all_rows.extend(rows)
+            pending.append((pdf_path, _schedule(pdf_path, ex, pages_per_task, cache, stream), None))
         except Exception as e:
-            sys.stderr.write(f"[WARN] Failed on {pdf_path}: {e}\n")
-
-    # Deduplicate obvious duplicates (same file+date+desc+amount)
-    seen = set()
-    deduped = []
-    for r in all_rows:
-        key = (r.get("source_file"), r.get("date"), r.get("description"), r.get("amount"))
-        if key in seen:
-            continue
-        seen.add(key)
-        deduped.append(r)
+            pending.append((pdf_path, None, e))
+        return True
 
-    # Write CSV
-    fieldnames = ["date", "description", "amount", "balance", "type", "source_file", "source_line"]
-    with open(out_csv, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        for r in deduped:
-            w.writerow(r)
+    try:
+        # without a pool each file is only read when the caller asks for it
+        ahead = SCHEDULE_AHEAD * workers if ex is not None else 1
+        while len(pending) < ahead and schedule_next():
+            pass
+        while pending:
+            pdf_path, scheduled, err = pending.popleft()
+            if err is None:
+                resolve, digest, fresh = scheduled
+                try:
+                    lines, rows = resolve()
+                except Exception as e:
+                    rows, err = None, e
+            schedule_next()
+            if err is not None:
+                yield pdf_path, None, err
+                continue
+            if cache is not None and fresh:
+                cache.put(digest, lines, rows)
+            yield pdf_path, rows, None
+    finally:
+        if ex is not None:
+            ex.shutdown(cancel_futures=True)
+
+def run(inp, out_path, workers=1, pages_per_task=0, cache_path=None, cache_max_mb=256, stream=False,
+        index_path=None):
+    """
+    Parse every PDF under inp and stream the deduplicated rows to out_path (CSV, Parquet or
+    Arrow, by suffix) as files finish. Each row's storage.ID_COL is its dedup fingerprint.
+    With index_path, rows that an earlier run already wrote to another table are left out too,
+    with a warning naming that table; out_path's own entries are dropped first, as it is
+    rewritten from scratch.
+    """
+    pdfs = list(iter_pdf_files(inp))
+    cache = None
+    if cache_path and not stream:
+        cache = ExtractionCache(cache_path, EXTRACT_VERSION, PARSER_VERSION,
+                                max_bytes=cache_max_mb * 1024 * 1024)
+    # without a persistent index, still drop repeats across the statements of this run
+    index = DedupIndex(index_path or ":memory:")
+    # the table is rewritten, so nothing recorded for it is in it any more
+    index.forget(out_path)
+
+    n_written = 0
+    try:
+        with TableWriter(out_path, FIELDNAMES) as w:
+            results = iter_parsed(pdfs, workers=workers, pages_per_task=pages_per_task,
+                                  cache=cache, stream=stream)
+            for pdf_path, rows, err in tqdm(results, total=len(pdfs), desc="Parsing PDFs"):
+                if err is None:
+                    # occurrence numbers are per statement, so the fingerprint ignores the file name
+                    counts = Counter()
+                    try:
+                        rows = iter(rows)
+                        while batch := list(islice(rows, WRITE_BATCH)):
+                            ids = transaction_ids(pd.DataFrame(batch, columns=FIELDNAMES), counts)
+                            with metrics.timer("parse.dedup"):
+                                keep = index.claim(ids, pdf_path.name, out_path)
+                            w.write([r for r, k in zip(batch, keep) if k], ids=ids[keep])
+                            n_written += int(keep.sum())
+                            metrics.count("parse.rows", len(batch))
+                    except Exception as e:
+                        err = e
+                w.flush()
+                index.commit()
+                if cache is not None:
+                    cache.commit()
+                metrics.count("parse.pdfs")
+                if err is not None:
+                    sys.stderr.write(f"[WARN] Failed on {pdf_path}: {err}\n")
+    finally:
+        if cache is not None:
+            cache.close()
+            print(f"Cache: {cache.hits} hits, {cache.misses} misses ({cache_path})")
+        index.close()
+        if index.duplicates:
+            print(f"Dedup: {index.duplicates} duplicate transactions skipped")
+        for table, n in sorted(index.held_elsewhere.items()):
+            sys.stderr.write(f"[WARN] {n} transactions left out of {out_path}: already in {table} "
+                             f"(`python dedup_index.py forget {table}` after deleting it, or --no-index)\n")
+
+    return n_written
 
-    print(f"Saved {len(deduped)} rows to {out_csv}")
+def main():
+    ap = argparse.ArgumentParser(description="Convert credit card statement PDFs to a table of transactions.")
+    ap.add_argument("inp", help="a PDF file or a folder of PDFs")
+    ap.add_argument("out_path", help="output path: .csv, .parquet or .arrow")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="number of parser processes (default: 1, no pool)")
+    ap.add_argument("--pages-per-task", type=int, default=0,
+                    help="split PDFs longer than this many pages into page-range tasks (0 = whole files)")
+    ap.add_argument("--cache", default=".parse_cache.sqlite",
+                    help="extraction cache keyed by PDF content hash (default: .parse_cache.sqlite)")
+    ap.add_argument("--no-cache", action="store_true", help="always re-parse every PDF")
+    ap.add_argument("--cache-max-mb", type=int, default=256,
+                    help="evict least recently used cache entries beyond this size (default: 256)")
+    ap.add_argument("--index", default=".dedup_index.sqlite",
+                    help="cross-run dedup index of every transaction already written (default: .dedup_index.sqlite)")
+    ap.add_argument("--no-index", action="store_true",
+                    help="write every transaction in the input, deduplicated within this run only")
+    ap.add_argument("--stream", action="store_true",
+                    help="constant-memory mode for very large statements: parse page by page, "
+                         "year from the first pages only (bypasses the cache and --pages-per-task)")
+    args = ap.parse_args()
+
+    n = run(args.inp, args.out_path, workers=args.workers, pages_per_task=args.pages_per_task,
+            cache_path=None if args.no_cache else args.cache, cache_max_mb=args.cache_max_mb,
+            stream=args.stream, index_path=None if args.no_index else args.index)
+    print(f"Saved {n} rows to {args.out_path}")
 
 if __name__ == "__main__":
     main()
-
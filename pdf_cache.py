@@ -0,0 +1,111 @@
+"""
+On-disk cache for parse_pdf.py, so unchanged statements are never re-parsed.
+
+Entries are keyed by the SHA-256 of the PDF bytes (not the file name), and hold the raw
+extracted text lines plus the parsed rows. Each half is tagged with the version of the code
+that produced it: bumping parse_pdf.PARSER_VERSION only re-runs the (cheap) line parser on
+cached lines (statements in a known bank layout are read again, their tables need the page),
+bumping EXTRACT_VERSION re-runs pdfplumber as well.
+
+The store is a single SQLite file. Least recently used entries are evicted once it grows past
+max_bytes. parse_pdf.run() commits after every file, so a crash loses at most the one in flight.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+
+import metrics
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file's bytes."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _pack(obj):
+    return zlib.compress(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class ExtractionCache:
+    def __init__(self, path, extract_version, parser_version, max_bytes=256 * 1024 * 1024):
+        self.path = str(path)
+        self.extract_version = extract_version
+        self.parser_version = parser_version
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                digest TEXT PRIMARY KEY,
+                extract_version INTEGER NOT NULL,
+                parser_version INTEGER NOT NULL,
+                lines BLOB NOT NULL,
+                rows BLOB,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get(self, digest):
+        """
+        Return (lines, rows) for a cached PDF, or None on a miss.
+        rows is None when the lines are still valid but were parsed by an older parser version.
+        """
+        cur = self.conn.execute(
+            "SELECT extract_version, parser_version, lines, rows FROM extractions WHERE digest = ?",
+            (digest,),
+        )
+        hit = cur.fetchone()
+        if hit is None or hit[0] != self.extract_version:
+            self.misses += 1
+            metrics.count("parse_cache.misses")
+            return None
+        self.hits += 1
+        metrics.count("parse_cache.hits")
+        self.conn.execute("UPDATE extractions SET last_used = ? WHERE digest = ?", (time.time(), digest))
+        lines = _unpack(hit[2])
+        rows = _unpack(hit[3]) if hit[1] == self.parser_version and hit[3] is not None else None
+        return lines, rows
+
+    def put(self, digest, lines, rows):
+        lines_blob = _pack(lines)
+        rows_blob = _pack(rows)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (digest, self.extract_version, self.parser_version, lines_blob, rows_blob,
+             len(lines_blob) + len(rows_blob), time.time()),
+        )
+
+    def evict(self):
+        """Drop least recently used entries until the store fits in max_bytes."""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        cur = self.conn.execute("SELECT digest, size FROM extractions ORDER BY last_used")
+        victims = []
+        for digest, size in cur:
+            if total <= self.max_bytes:
+                break
+            victims.append((digest,))
+            total -= size
+        self.conn.executemany("DELETE FROM extractions WHERE digest = ?", victims)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
@@ -1,24 +1,31 @@
 from openai import OpenAI
 from dotenv import load_dotenv
 import os
-import json
+import sys
+from pathlib import Path
 load_dotenv()
-print(os.getenv("OPENAI_API_KEY"))
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-stuff =client.files.create(
-  file=open("batched.jsonl", "rb"),
-  purpose="batch",
-  expires_after={
-    "anchor": "created_at",
-    "seconds": 2592000
-  }
-)
-print(stuff.id)
 
-stuff2 = client.batches.create(
-  input_file_id=stuff.id,
-  endpoint="/v1/chat/completions",
-  completion_window="24h"
-)
+# one batch per shard written by batch_generate.py (or the files given on the command line)
+shards = [Path(p) for p in sys.argv[1:]] or sorted(Path("batch_shards").glob("batched_*.jsonl"))
+if not shards:
+    raise SystemExit("No shards found, run batch_generate.py first")
 
-print(stuff2)
+for shard in shards:
+    stuff = client.files.create(
+      file=open(shard, "rb"),
+      purpose="batch",
+      expires_after={
+        "anchor": "created_at",
+        "seconds": 2592000
+      }
+    )
+    print(shard, stuff.id)
+
+    stuff2 = client.batches.create(
+      input_file_id=stuff.id,
+      endpoint="/v1/chat/completions",
+      completion_window="24h"
+    )
+
+    print(stuff2)
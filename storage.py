@@ -0,0 +1,356 @@
+"""
+Table storage shared by every stage of the data -> cleansed_data -> labeled -> llm_gen pipeline.
+
+Tables are Parquet (.parquet, zstd), Arrow IPC (.arrow, uncompressed, zero-copy memory-mapped
+reads) or CSV (.csv, for export and for the hand-labeled files). The format is picked from the
+file suffix. Reads memory-map Parquet and Arrow files and take a column list, so a stage that
+only needs description and label never decodes the rest.
+
+Every table carries a txn_id column: a 64-bit hash of the transaction's date, description and
+amount plus its occurrence number among identical rows of the same table. The description is
+hashed in its clean_descriptions() form, which is what cleanse_data.py writes, so a row keeps
+its id whether it was read before or after cleansing. It is computed once,
+when the row first enters the pipeline (parse_pdf.py), and copied through every later stage,
+so stages join on txn_id instead of the pandas index that used to leak into CSVs as
+"Unnamed: 0". Tables written before txn_id existed get one derived on read from the same
+fields, so old CSVs join with each other the same way.
+
+Known columns get fixed types (dates as datetime64, amounts as float64); text stays object.
+"""
+
+import csv
+import os
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+ID_COL = "txn_id"
+LEGACY_INDEX_COL = "Unnamed: 0"
+ID_FIELDS = ("date", "description", "amount")
+FORMATS = ("parquet", "arrow", "csv")
+DEFAULT_FORMAT = "parquet"
+SUFFIXES = {"." + fmt: fmt for fmt in FORMATS}
+
+FLOAT_COLS = ("amount", "balance", "cashback_pct", "confidence", "nb_confidence")
+DATE_COLS = ("date",)
+
+# RE2-compatible, so pandas can run them through pyarrow on Arrow-backed strings
+DATE_IN_TEXT_RE = r"\b\d{1,2}[-/]\d{1,2}(?:[-/]\d{2,4})?\b"
+CASHBACK_RE = r"\s+(\d{1,2})%\s*$"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("pyarrow is needed for .parquet/.arrow tables; install it or use --format csv") from None
+    return pyarrow
+
+
+def table_format(path):
+    fmt = SUFFIXES.get(Path(path).suffix)
+    if fmt is None:
+        raise ValueError(f"{path}: unknown table format, expected one of {', '.join(SUFFIXES)}")
+    return fmt
+
+
+def table_path(directory, stem, fmt=DEFAULT_FORMAT):
+    return Path(directory) / f"{stem}.{fmt}"
+
+
+def list_tables(directory, pattern="*"):
+    """Every table in directory matching pattern (a glob on the stem), one per stem: Parquet over Arrow over CSV."""
+    best = {}
+    for fmt in reversed(FORMATS):
+        for path in Path(directory).glob(f"{pattern}.{fmt}"):
+            best[path.stem] = path
+    return [best[stem] for stem in sorted(best)]
+
+
+def find_table(directory, stem):
+    """The table for stem in directory in any format, or None."""
+    for fmt in FORMATS:
+        path = table_path(directory, stem, fmt)
+        if path.is_file():
+            return path
+    return None
+
+
+def clean_descriptions(descriptions):
+    """
+    Canonical form of a Series of descriptions: upper case, dates printed into the text and the
+    Apple Card Daily Cash suffix ("... MA USA 2%") removed, whitespace collapsed.
+    """
+    s = pd.Series(descriptions).astype("str").fillna("")
+    s = s.str.upper().str.replace(DATE_IN_TEXT_RE, " ", regex=True).str.replace(CASHBACK_RE, "", regex=True)
+    # only runs and non-space whitespace: rewriting every single space is several times slower
+    return s.str.replace(r"\s{2,}|[^\S ]", " ", regex=True).str.strip()
+
+
+def _id_key_frame(df):
+    """The ID_FIELDS of df in canonical form, so typed, CSV-read and cleansed tables hash the same."""
+    key = {}
+    for name in ID_FIELDS:
+        if name not in df.columns:
+            continue
+        col = df[name]
+        if name in DATE_COLS:
+            # days since the epoch; NaT stays the int64 minimum
+            days = pd.to_datetime(col, errors="coerce", format="mixed").to_numpy().astype("datetime64[D]")
+            key[name] = days.astype(np.int64)
+        elif name in FLOAT_COLS:
+            key[name] = pd.to_numeric(col, errors="coerce").astype("float64").round(2).to_numpy()
+        else:
+            key[name] = clean_descriptions(col).to_numpy()
+    return pd.DataFrame(key, index=pd.RangeIndex(len(df)))
+
+
+def transaction_ids(df, counts=None):
+    """
+    txn_id for every row of df. Pass the same `counts` Counter to successive calls to number
+    repeats across the chunks of one table the way a single call over the whole table would.
+    """
+    key_frame = _id_key_frame(df)
+    if key_frame.shape[1]:
+        key = pd.Series(pd.util.hash_pandas_object(key_frame, index=False).to_numpy())
+    else:
+        key = pd.Series(np.zeros(len(df), dtype=np.uint64))
+    occurrence = key.groupby(key, sort=False).cumcount().to_numpy(np.uint64)
+    if counts is not None:
+        if counts:
+            occurrence += key.map(counts).fillna(0).to_numpy(np.uint64)
+        counts.update(key.value_counts(sort=False).to_dict())
+    frame = pd.DataFrame({"k": key.to_numpy(), "n": occurrence})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy().view(np.int64)
+
+
+def normalize(df, counts=None):
+    """Fix column types, drop the leaked pandas index and make sure txn_id exists and comes first."""
+    df = df.drop(columns=[LEGACY_INDEX_COL], errors="ignore")
+    for name in DATE_COLS:
+        if name in df.columns and not pd.api.types.is_datetime64_any_dtype(df[name]):
+            df[name] = pd.to_datetime(df[name], errors="coerce", format="mixed")
+    for name in FLOAT_COLS:
+        if name in df.columns:
+            df[name] = pd.to_numeric(df[name], errors="coerce").astype("float64")
+    if ID_COL not in df.columns:
+        df.insert(0, ID_COL, transaction_ids(df, counts))
+    elif df.columns[0] != ID_COL:
+        df = df[[ID_COL] + [c for c in df.columns if c != ID_COL]]
+    df[ID_COL] = df[ID_COL].astype("int64")
+    return df
+
+
+def csv_ready(df):
+    """Object frame for CSV writing: dates as YYYY-MM-DD, missing values as empty strings."""
+    out = df.astype(object)
+    for name in DATE_COLS:
+        if name in df.columns and pd.api.types.is_datetime64_any_dtype(df[name]):
+            out[name] = df[name].dt.strftime("%Y-%m-%d")
+    return out.where(df.notna(), "")
+
+
+@metrics.timed("storage.read")
+def read_table(path, columns=None):
+    """
+    Read a table as a DataFrame, optionally only `columns`. Parquet and Arrow files are
+    memory-mapped; CSVs without a txn_id get one derived from their ID_FIELDS.
+    """
+    path = Path(path)
+    fmt = table_format(path)
+    if fmt == "csv":
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = None
+        if columns is not None:
+            need = set(columns)
+            if ID_COL in need and ID_COL not in header:
+                need.update(ID_FIELDS)
+            usecols = [c for c in header if c in need]
+        df = normalize(pd.read_csv(path, usecols=usecols))
+    else:
+        pa = _require_pyarrow()
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            if columns is not None:
+                # like the other formats, columns the file does not have are left out
+                names = set(pq.read_schema(path).names)
+                columns = [c for c in columns if c in names]
+            table = pq.read_table(path, columns=columns, memory_map=True)
+        else:
+            # the columns stay backed by the mapping (zero-copy) until pandas converts them
+            table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+            if columns is not None:
+                table = table.select([c for c in columns if c in table.column_names])
+        df = table.to_pandas()
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    metrics.count("storage.rows_read", len(df))
+    return df
+
+
+def iter_chunks(path, columns=None, chunksize=50_000):
+    """Yield DataFrames of at most chunksize rows, reading only one chunk's worth at a time."""
+    path = Path(path)
+    fmt = table_format(path)
+    if fmt == "csv":
+        header = pd.read_csv(path, nrows=0).columns
+        derive = ID_COL not in header
+        counts = Counter()
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            chunk = normalize(chunk, counts) if derive else normalize(chunk)
+            yield chunk if columns is None else chunk[[c for c in columns if c in chunk.columns]]
+        return
+    pa = _require_pyarrow()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize, columns=columns)
+        for batch in batches:
+            yield batch.to_pandas()
+        return
+    reader = pa.ipc.open_file(pa.memory_map(str(path)))
+    for i in range(reader.num_record_batches):
+        table = pa.Table.from_batches([reader.get_batch(i)])
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.column_names])
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas()
+
+
+@metrics.timed("storage.write")
+def write_table(df, path):
+    """Write df (normalized, txn_id first) to path in the format of its suffix, atomically."""
+    path = Path(path)
+    fmt = table_format(path)
+    df = normalize(df)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    if fmt == "csv":
+        csv_ready(df).to_csv(tmp, index=False)
+    else:
+        pa = _require_pyarrow()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(table, tmp, compression="zstd")
+        else:
+            with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    os.replace(tmp, path)
+    metrics.count("storage.rows_written", len(df))
+    return path
+
+
+class TableWriter:
+    """
+    Appends chunks (DataFrames or lists of dicts) to one table without holding it in memory.
+    txn_ids are assigned with one running Counter, so they match what write_table() would give
+    the whole table. Close it (or use it as a context manager) to finish the file.
+    """
+
+    def __init__(self, path, columns):
+        self.path = Path(path)
+        self.fmt = table_format(self.path)
+        self.columns = list(columns)
+        self.counts = Counter()
+        self.rows = 0
+        self._writer = None
+        self._f = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.fmt == "csv":
+            self._f = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._f)
+            self._writer.writerow([ID_COL] + self.columns)
+
+    @metrics.timed("storage.write")
+    def write(self, rows, ids=None):
+        """Append rows; ids overrides the txn_ids the writer would assign itself."""
+        values = None
+        if isinstance(rows, pd.DataFrame):
+            df = rows
+        else:
+            values = list(rows)
+            df = pd.DataFrame(values, columns=self.columns)
+        if df.empty:
+            return
+        if ids is not None:
+            ids = np.asarray(ids, dtype=np.int64)
+        elif ID_COL in df.columns:
+            ids = df[ID_COL].to_numpy()
+        else:
+            ids = transaction_ids(df, self.counts)
+        self.rows += len(df)
+        metrics.count("storage.rows_written", len(df))
+        if self.fmt == "csv":
+            if values is not None:
+                # dict values go out as given (None as empty), like csv.DictWriter
+                body = ([r.get(c) for c in self.columns] for r in values)
+            else:
+                body = csv_ready(df[self.columns]).itertuples(index=False, name=None)
+            self._writer.writerows([i, *row] for i, row in zip(ids.tolist(), body))
+            return
+        pa = _require_pyarrow()
+        df = normalize(df.assign(**{ID_COL: ids})[[ID_COL] + self.columns])
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._schema = table.schema
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+
+                self._writer = pq.ParquetWriter(self.path, self._schema, compression="zstd")
+            else:
+                self._f = pa.OSFile(str(self.path), "wb")
+                self._writer = pa.ipc.new_file(self._f, self._schema)
+        self._writer.write_table(table.cast(self._schema))
+
+    def flush(self):
+        if self.fmt == "csv":
+            self._f.flush()
+
+    def close(self):
+        if self._writer is None and self.fmt != "csv":
+            # no rows at all: still leave a valid, empty table behind
+            write_table(pd.DataFrame(columns=self.columns), self.path)
+        elif self.fmt != "csv":
+            self._writer.close()
+        if self._f is not None:
+            self._f.close()
+        self._writer = self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert(src, dst):
+    """Rewrite one table in another format (e.g. a legacy CSV to Parquet)."""
+    return write_table(read_table(src), dst)
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Convert pipeline tables between CSV, Parquet and Arrow.")
+    ap.add_argument("inputs", nargs="+", help="table files or directories of them")
+    ap.add_argument("--format", choices=FORMATS, default=DEFAULT_FORMAT)
+    ap.add_argument("--out-dir", default=None, help="default: next to each input")
+    args = ap.parse_args()
+    for inp in map(Path, args.inputs):
+        for src in list_tables(inp) if inp.is_dir() else [inp]:
+            dst = table_path(args.out_dir or src.parent, src.stem, args.format)
+            if dst == src:
+                continue
+            convert(src, dst)
+            print(f"{src} -> {dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from checkpoint import LabelCheckpoint
+
+
+class TornLineTest(unittest.TestCase):
+    def test_resume_after_torn_line_keeps_later_records(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ckpt = LabelCheckpoint(Path(tmp) / "april.csv")
+            ckpt.append([{"row": 0, "label": "dining"}, {"row": 1, "label": "travel"}])
+            ckpt.close()
+            # a crash in the middle of writing row 2
+            with open(ckpt.path, "a", encoding="utf-8") as f:
+                f.write('{"row": 2, "la')
+
+            resumed = LabelCheckpoint(ckpt.save_path)
+            self.assertEqual(set(resumed.load()), {0, 1})
+            resumed.append([{"row": 2, "label": "grocery"}, {"row": 3, "label": "other"}])
+            resumed.close()
+            later = LabelCheckpoint(ckpt.save_path)
+            later.append([{"row": 4, "label": "health"}])
+            later.close()
+
+            done = LabelCheckpoint(ckpt.save_path).load()
+            self.assertEqual(set(done), {0, 1, 2, 3, 4})
+            self.assertEqual(done[2]["label"], "grocery")
+
+
+class TxnIdTest(unittest.TestCase):
+    def test_resume_follows_txn_ids_when_the_table_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ckpt = LabelCheckpoint(Path(tmp) / "april.csv")
+            ckpt.load([101, 102, 103])
+            ckpt.append([{"row": 0, "label": "dining"}, {"row": 2, "label": "travel"}])
+            ckpt.close()
+
+            # re-cleansed: reordered, one row gone and one new
+            resumed = LabelCheckpoint(ckpt.save_path)
+            done = resumed.load([104, 103, 102])
+            self.assertEqual(done, {1: {"label": "travel"}})
+            self.assertEqual(resumed.stale, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()